@@ -0,0 +1,39 @@
+﻿import hmac
+import re
+import time
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, RedirectResponse, Response
+
+from config import CONTRACT_ACCEL_PREFIX
+from services.contract_store import contract_store, link_signature, S3ContractStore
+
+router = APIRouter()
+
+KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+# С CONTRACT_ACCEL_PREFIX файл отдаёт nginx (X-Accel-Redirect): sendfile без копирования
+# через Python и Range. Без него — FileResponse: Range есть, но uvicorn не поддерживает
+# http.response.pathsend, и файл читается в процесс API кусками
+@router.get("/contracts/{key}")
+async def download_contract(key: str, expires: int, sig: str):
+    if not KEY_RE.match(key) or not hmac.compare_digest(sig, link_signature(key, expires)):
+        raise HTTPException(status_code=403, detail="Invalid link")
+    if expires < time.time():
+        raise HTTPException(status_code=403, detail="Link expired")
+
+    if isinstance(contract_store, S3ContractStore):
+        return RedirectResponse(contract_store.presigned_url(key, int(expires - time.time())))
+
+    path = contract_store.path(key)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Contract not found")
+    # Содержимое адресовано хэшем и не меняется — его можно кэшировать до конца жизни ссылки
+    headers = {"Content-Encoding": "gzip", "ETag": f'"{key}"',
+               "Cache-Control": f"private, max-age={int(expires - time.time())}, immutable"}
+    if CONTRACT_ACCEL_PREFIX:
+        relative = path.relative_to(contract_store.root).as_posix()
+        headers["X-Accel-Redirect"] = f"{CONTRACT_ACCEL_PREFIX.rstrip('/')}/{relative}"
+        return Response(media_type="text/html; charset=utf-8", headers=headers)
+    return FileResponse(path, media_type="text/html; charset=utf-8", headers=headers)
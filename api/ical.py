@@ -0,0 +1,122 @@
+﻿import hashlib
+import hmac
+from collections import defaultdict
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import select
+
+from api.partner import etag_matches, query
+from models.booking import Booking
+from models.car import Car
+from services.ical import (
+    FEED_STATUSES, feed_token, feed_since, calendar_header, CALENDAR_FOOTER, render_events, car_events_cache
+)
+from services.metrics import metrics
+
+router = APIRouter()
+
+# Лента владельца собирается пачками авто: один запрос бронирований на пачку промахов кэша
+CHUNK_SIZE = 200
+MEDIA_TYPE = "text/calendar; charset=utf-8"
+
+
+def check_token(kind: str, object_id: int, token: str):
+    if not hmac.compare_digest(token, feed_token(kind, object_id)):
+        raise HTTPException(status_code=403, detail="Invalid token")
+
+
+async def car_events(cars, since) -> bytes:
+    """События пачки авто: готовые блоки из кэша, для остальных — один запрос к бронированиям."""
+    blocks = {}
+    missing = {}
+    for car in cars:
+        stamp = (car.version, since)
+        events = car_events_cache.get(car.id, stamp)
+        if events is None:
+            missing[car.id] = car
+        else:
+            blocks[car.id] = events
+
+    if missing:
+        rows = await query(
+            select(Booking.id, Booking.car_id, Booking.date_from, Booking.date_to, Booking.status,
+                   Booking.created_at).where(
+                Booking.car_id.in_(list(missing)),
+                Booking.status.in_(FEED_STATUSES),
+                Booking.date_to >= since
+            ).order_by(Booking.car_id, Booking.date_from)
+        )
+        by_car = defaultdict(list)
+        for row in rows:
+            by_car[row.car_id].append(row)
+        for car_id, car in missing.items():
+            events = render_events(f"{car.brand} {car.model}", by_car[car_id])
+            car_events_cache.put(car_id, (car.version, since), events)
+            blocks[car_id] = events
+    return b"".join(blocks[car.id] for car in cars)
+
+
+def not_modified(request: Request, etag: str, kind: str):
+    if etag_matches(request, etag):
+        metrics.inc("ical_requests", kind=kind, status="304")
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+def feed_response(etag: str, body, kind: str, filename: str):
+    metrics.inc("ical_requests", kind=kind, status="200")
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache",
+               "Content-Disposition": f'inline; filename="{filename}"'}
+    if isinstance(body, bytes):
+        return Response(body, media_type=MEDIA_TYPE, headers=headers)
+    return StreamingResponse(body, media_type=MEDIA_TYPE, headers=headers)
+
+
+CAR_COLUMNS = (Car.id, Car.version, Car.brand, Car.model)
+
+
+@router.get("/ical/cars/{car_id}.ics")
+async def car_feed(request: Request, car_id: int, token: str):
+    check_token("cars", car_id, token)
+    car = await query(select(*CAR_COLUMNS).where(Car.id == car_id), one=True)
+    if car is None:
+        raise HTTPException(status_code=404, detail="Car not found")
+
+    since = feed_since()
+    etag = f'"ic{car.id}.{car.version}.{since:%Y%m%d}"'
+    cached = not_modified(request, etag, "car")
+    if cached:
+        return cached
+    body = calendar_header(f"{car.brand} {car.model}") + await car_events([car], since) + CALENDAR_FOOTER
+    return feed_response(etag, body, "car", f"car_{car.id}.ics")
+
+
+@router.get("/ical/owners/{owner_id}.ics")
+async def owner_feed(request: Request, owner_id: int, token: str):
+    """
+    Все авто владельца одной лентой.
+
+    ETag — хэш пар (id, version) его авто: если ни одно не менялось, ответ 304
+    без чтения бронирований. Иначе лента отдаётся потоком по ``CHUNK_SIZE`` авто,
+    и события пересобираются только для авто со сменившейся версией.
+    """
+    check_token("owners", owner_id, token)
+    cars = await query(select(*CAR_COLUMNS).where(Car.owner_id == owner_id).order_by(Car.id))
+    if not cars:
+        raise HTTPException(status_code=404, detail="No cars")
+
+    since = feed_since()
+    digest = hashlib.sha1(",".join(f"{car.id}.{car.version}" for car in cars).encode()).hexdigest()
+    etag = f'"io{digest[:32]}.{since:%Y%m%d}"'
+    cached = not_modified(request, etag, "owner")
+    if cached:
+        return cached
+
+    async def stream():
+        yield calendar_header("MyRentCar — бронирования")
+        for start in range(0, len(cars), CHUNK_SIZE):
+            yield await car_events(cars[start:start + CHUNK_SIZE], since)
+        yield CALENDAR_FOOTER
+
+    return feed_response(etag, stream(), "owner", f"owner_{owner_id}.ics")
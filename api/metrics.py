@@ -0,0 +1,17 @@
+﻿from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.loop_monitor import loop_monitor
+from services.metrics import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return metrics.render()
+
+
+@router.get("/debug/blocking")
+async def blocking_sites(limit: int = 10):
+    return loop_monitor.worst(limit)
@@ -0,0 +1,224 @@
+﻿import base64
+import hashlib
+import hmac
+from datetime import date, timedelta
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from config import PARTNER_API_KEYS, PARTNER_PAGE_SIZE, PARTNER_MAX_PAGE_SIZE
+from database import read_session
+from handlers.calculator import calculate_rental_price
+from models.booking import Booking
+from models.car import Car
+from services.availability import ACTIVE_STATUSES
+from services.metrics import metrics
+
+# Максимальный интервал дат в запросах доступности и расчёта цены
+MAX_RANGE_DAYS = 366
+DEFAULT_RANGE_DAYS = 90
+
+# Поля авто, которые видят партнёры (номер, VIN и владелец не отдаются)
+CAR_FIELDS = {
+    "id": Car.id,
+    "brand": Car.brand,
+    "model": Car.model,
+    "year": Car.year,
+    "city": Car.city,
+    "city_id": Car.city_id,
+    "price_per_day": Car.price_per_day,
+    "discount": Car.discount,
+    "rental_terms": Car.rental_terms,
+    "version": Car.version,
+}
+
+
+def partner_key(x_api_key: str = Header(default="")):
+    if not any(hmac.compare_digest(x_api_key, key) for key in PARTNER_API_KEYS):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+
+router = APIRouter(prefix="/partner", dependencies=[Depends(partner_key)])
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+
+def conditional(request: Request, etag: str, endpoint: str):
+    """304 без тела, если у партнёра уже эта версия, иначе None."""
+    if etag_matches(request, etag):
+        metrics.inc("partner_api_requests", endpoint=endpoint, status="304")
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+def respond(content, etag: str, endpoint: str) -> JSONResponse:
+    metrics.inc("partner_api_requests", endpoint=endpoint, status="200")
+    # no-cache: промежуточные кэши обязаны перепроверять ответ через If-None-Match
+    return JSONResponse(content, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+def car_etag(car_id: int, version: int, suffix: str = "") -> str:
+    return f'"c{car_id}.{version}{suffix}"'
+
+
+def encode_cursor(car_id: int) -> str:
+    return base64.urlsafe_b64encode(str(car_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: str) -> list:
+    if not fields:
+        return list(CAR_FIELDS)
+    names = ["id"] + [name.strip() for name in fields.split(",") if name.strip() and name.strip() != "id"]
+    unknown = [name for name in names if name not in CAR_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def date_range(date_from: date, date_to: date) -> tuple:
+    date_from = date_from or date.today()
+    date_to = date_to or date_from + timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to is before date_from")
+    if (date_to - date_from).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is longer than {MAX_RANGE_DAYS} days")
+    return date_from, date_to
+
+
+def _query(statement, one: bool = False):
+    db = read_session()
+    try:
+        result = db.execute(statement)
+        return result.first() if one else result.all()
+    finally:
+        db.close()
+
+
+async def query(statement, one: bool = False):
+    # Синхронный SQLAlchemy — в пуле потоков, event loop воркера не блокируется
+    return await run_in_threadpool(_query, statement, one)
+
+
+async def car_version(car_id: int) -> int:
+    row = await query(select(Car.version).where(Car.id == car_id, Car.available == True), one=True)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Car not found")
+    return row.version
+
+
+@router.get("/cars")
+async def list_cars(request: Request, cursor: str = "", city_id: int = None, fields: str = "",
+                    limit: int = Query(PARTNER_PAGE_SIZE, ge=1, le=PARTNER_MAX_PAGE_SIZE)):
+    """
+    Доступные авто по возрастанию id, страницами по ``limit``.
+
+    Сначала читаются только (id, version) страницы: ETag страницы — хэш этих пар,
+    и при совпадении с If-None-Match остальные колонки не запрашиваются.
+    """
+    names = parse_fields(fields)
+    after = decode_cursor(cursor) if cursor else 0
+
+    condition = [Car.available == True, Car.id > after]
+    if city_id is not None:
+        condition.append(Car.city_id == city_id)
+    page = await query(select(Car.id, Car.version).where(*condition).order_by(Car.id).limit(limit + 1))
+    has_next = len(page) > limit
+    page = page[:limit]
+
+    digest = hashlib.sha1(",".join(f"{row.id}.{row.version}" for row in page).encode()).hexdigest()
+    etag = f'"l{digest[:32]}"'
+    not_modified = conditional(request, etag, "cars")
+    if not_modified:
+        return not_modified
+
+    rows = await query(
+        select(*(CAR_FIELDS[name] for name in names)).where(Car.id.in_([row.id for row in page])).order_by(Car.id)
+    ) if page else []
+    return respond({
+        "items": [dict(zip(names, row)) for row in rows],
+        "next_cursor": encode_cursor(page[-1].id) if has_next else None,
+    }, etag, "cars")
+
+
+@router.get("/cars/{car_id}")
+async def get_car(request: Request, car_id: int, fields: str = ""):
+    names = parse_fields(fields)
+    etag = car_etag(car_id, await car_version(car_id))
+    not_modified = conditional(request, etag, "car")
+    if not_modified:
+        return not_modified
+
+    row = await query(select(*(CAR_FIELDS[name] for name in names)).where(Car.id == car_id), one=True)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Car not found")
+    return respond(dict(zip(names, row)), etag, "car")
+
+
+@router.get("/cars/{car_id}/availability")
+async def car_availability(request: Request, car_id: int, date_from: date = None, date_to: date = None):
+    """Занятые интервалы авто в [date_from, date_to]; по умолчанию ближайшие 90 дней."""
+    date_from, date_to = date_range(date_from, date_to)
+    etag = car_etag(car_id, await car_version(car_id), f".{date_from:%Y%m%d}-{date_to:%Y%m%d}")
+    not_modified = conditional(request, etag, "availability")
+    if not_modified:
+        return not_modified
+
+    bookings = await query(
+        select(Booking.date_from, Booking.date_to).where(
+            Booking.car_id == car_id,
+            Booking.status.in_(ACTIVE_STATUSES),
+            Booking.date_to >= date_from,
+            Booking.date_from <= date_to
+        ).order_by(Booking.date_from)
+    )
+    return respond({
+        "car_id": car_id,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "booked": [{"date_from": b.date_from.isoformat(), "date_to": b.date_to.isoformat()} for b in bookings],
+    }, etag, "availability")
+
+
+@router.get("/cars/{car_id}/quote")
+async def car_quote(request: Request, car_id: int, date_from: date, date_to: date):
+    date_from, date_to = date_range(date_from, date_to)
+    etag = car_etag(car_id, await car_version(car_id), f".{date_from:%Y%m%d}-{date_to:%Y%m%d}")
+    not_modified = conditional(request, etag, "quote")
+    if not_modified:
+        return not_modified
+
+    car = await query(select(Car.price_per_day, Car.discount).where(Car.id == car_id), one=True)
+    if car is None:
+        raise HTTPException(status_code=404, detail="Car not found")
+    conflict = await query(
+        select(Booking.id).where(
+            Booking.car_id == car_id,
+            Booking.status.in_(ACTIVE_STATUSES),
+            Booking.date_to >= date_from,
+            Booking.date_from <= date_to
+        ).limit(1), one=True
+    )
+    return respond({
+        "car_id": car_id,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "days": (date_to - date_from).days + 1,
+        "price_per_day": car.price_per_day,
+        "discount": car.discount or 0.0,
+        "total": calculate_rental_price(date_from, date_to, car.price_per_day, car.discount or 0.0),
+        "available": conflict is None,
+    }, etag, "quote")
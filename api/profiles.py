@@ -0,0 +1,30 @@
+﻿import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+
+from config import PROFILES_DIR, PROFILES_MAX_BYTES, DEBUG_API_TOKEN
+from services.profiles import ProfileStore
+
+
+# Профили содержат стеки и имена функций, а сервер слушает 0.0.0.0 (там же /metrics)
+def debug_token(x_debug_token: str = Header(default="")):
+    if not DEBUG_API_TOKEN or not hmac.compare_digest(x_debug_token, DEBUG_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+router = APIRouter(dependencies=[Depends(debug_token)])
+profile_store = ProfileStore(PROFILES_DIR, PROFILES_MAX_BYTES)
+
+
+@router.get("/debug/profiles")
+async def list_profiles():
+    return profile_store.list()
+
+
+@router.get("/debug/profiles/{name}")
+async def download_profile(name: str):
+    path = profile_store.path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
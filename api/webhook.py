@@ -3,6 +3,8 @@ from fastapi import FastAPI, Request, Form, HTTPException
 from database import SessionLocal
 from models.payment import Payment, PaymentStatus, PaymentMethod
 from models.booking import Booking, BookingStatus
+from models.user import User
+from services.outbox import add_event
 from loguru import logger
 
 from config import FREEKASSA_SECRET_2
@@ -10,8 +12,10 @@ from config import FREEKASSA_SECRET_2
 app = FastAPI()
 
 
+# Обычная (не async) функция: FastAPI выполняет её в пуле потоков,
+# и синхронные запросы к БД не блокируют event loop воркера
 @app.post("/freekassa_callback")
-async def freekassa_callback(
+def freekassa_callback(
         MERCHANT_ID: str = Form(...),
         AMOUNT: str = Form(...),
         intid: str = Form(...),
@@ -35,16 +39,30 @@ async def freekassa_callback(
         if not payment:
             raise HTTPException(status_code=404, detail="Payment not found")
 
+        # Повторный callback по оплаченному платежу ничего не меняет
+        if payment.status == PaymentStatus.COMPLETED:
+            return "YES"
+
         payment.status = PaymentStatus.COMPLETED
         payment.transaction_id = intid
 
         booking = db.query(Booking).filter(Booking.id == payment.booking_id).first()
         if booking:
             booking.status = BookingStatus.CONFIRMED
+            renter = db.query(User).filter(User.id == booking.renter_id).first()
+            if renter:
+                # Уведомление пишется в той же транзакции, что и смена статусов
+                add_event(
+                    db, "payment_completed", renter.telegram_id,
+                    {"payment_id": payment.id, "booking_id": booking.id, "amount": payment.amount},
+                    dedup_key=f"payment_completed:{payment.id}"
+                )
 
         db.commit()
         logger.info(f"Payment {payment.id} completed via FreeKassa")
         return "YES"
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"FreeKassa error: {e}")
         raise HTTPException(status_code=500, detail="Internal Error")
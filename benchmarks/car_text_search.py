@@ -0,0 +1,105 @@
+﻿"""
+Поиск авто по названию (services.car_text_search) на 100 тыс. авто.
+
+В Postgres запросы идут по GIN-индексам (tsvector и pg_trgm), план первого
+запроса печатается через EXPLAIN; в SQLite работает запасной вариант с LIKE.
+
+Запуск из корня проекта:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.car_text_search --cars 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import select, text
+
+from database import Base, engine, SessionLocal
+from models.car import Car
+from models.user import User, UserType
+from services.car_text_search import ensure_search_schema, search_cars_ranked, search_condition
+
+BRANDS = [("BMW", "X5"), ("BMW", "320d"), ("Toyota", "Corolla"), ("Skoda", "Octavia"), ("Volkswagen", "Golf"),
+          ("Renault", "Clio"), ("Mercedes-Benz", "E 220"), ("Audi", "A4"), ("Kia", "Sportage"), ("Fiat", "500")]
+CITIES = ["Belgrade", "Novi Sad", "Niš", "Kragujevac", "Subotica", "Zrenjanin", "Pančevo", "Čačak"]
+TERMS = ["без залога", "детское кресло", "только по городу", "автомат, кондиционер", ""]
+QUERIES = ["bmw x5", "toyota corolla novi sad", "octavia", "octavya", "mercedes", "golf belgrade",
+           "sportage", "детское кресло", "fiat 500", "renault clio nis"]
+BATCH_SIZE = 10000
+
+
+def seed(cars: int) -> int:
+    Base.metadata.create_all(bind=engine)
+    ensure_search_schema(engine)
+    db = SessionLocal()
+    try:
+        owner = User(telegram_id=-int(time.time()), user_type=UserType.OWNER_LEGAL, name="bench")
+        db.add(owner)
+        db.flush()
+        for start in range(0, cars, BATCH_SIZE):
+            rows = []
+            for _ in range(start, min(start + BATCH_SIZE, cars)):
+                brand, model = random.choice(BRANDS)
+                rows.append({"owner_id": owner.id, "brand": brand, "model": model,
+                             "year": random.randint(2010, 2024), "price_per_day": random.randint(20, 150),
+                             "city": random.choice(CITIES), "rental_terms": random.choice(TERMS),
+                             "available": True})
+            db.execute(Car.__table__.insert(), rows)
+        db.commit()
+        if engine.dialect.name == "postgresql":
+            db.execute(text("ANALYZE cars"))
+        return owner.id
+    finally:
+        db.close()
+
+
+def cleanup(owner_id: int):
+    db = SessionLocal()
+    try:
+        db.query(Car).filter(Car.owner_id == owner_id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == owner_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def explain(db, query: str):
+    condition, _ = search_condition(db, query)
+    compiled = select(Car.id).where(condition).compile(engine)
+    for (line,) in db.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params):
+        print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cars", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    owner_id = seed(args.cars)
+    print(f"cars={args.cars} dialect={engine.dialect.name} seed={time.perf_counter() - started:.1f}s")
+    try:
+        db = SessionLocal()
+        try:
+            if engine.dialect.name == "postgresql":
+                print(f"  plan for «{QUERIES[0]}»:")
+                explain(db, QUERIES[0])
+            for query in QUERIES:
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    rows, has_next = search_cars_ranked(db, query, page=1)
+                    timings.append(time.perf_counter() - started)
+                top = f"{rows[0].brand} {rows[0].model}, {rows[0].city}" if rows else "—"
+                print(f"  {query:<26} median={statistics.median(timings) * 1000:7.1f} ms  "
+                      f"page2={len(rows)} more={has_next}  top: {top}")
+        finally:
+            db.close()
+    finally:
+        cleanup(owner_id)
+
+
+if __name__ == "__main__":
+    main()
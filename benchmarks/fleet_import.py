@@ -0,0 +1,79 @@
+﻿"""
+Скорость импорта автопарка из CSV (services.fleet_import).
+
+Запуск из корня проекта:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.fleet_import --rows 10000
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from database import Base, engine, SessionLocal
+from models.car import Car
+from models.user import User, UserType
+from services.fleet_import import import_fleet
+
+BRANDS = [("Toyota", "Corolla"), ("Skoda", "Octavia"), ("Volkswagen", "Golf"), ("Renault", "Clio")]
+CITIES = ["Belgrade", "Novi Sad", "Niš", "Kragujevac", "Subotica"]
+
+
+def write_csv(path: str, rows: int, bad_every: int):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["brand", "model", "year", "license_plate", "price_per_day", "discount", "city"])
+        for i in range(rows):
+            brand, model = random.choice(BRANDS)
+            year = "19" if bad_every and i % bad_every == 0 else random.randint(2005, 2024)
+            writer.writerow([brand, model, year, f"BG{i:06d}", random.randint(20, 120),
+                             random.choice([0, 5, 10]), random.choice(CITIES)])
+
+
+def seed_owner() -> int:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        owner = User(telegram_id=-int(time.time()), user_type=UserType.OWNER_LEGAL, name="bench")
+        db.add(owner)
+        db.commit()
+        return owner.id
+    finally:
+        db.close()
+
+
+def cleanup(owner_id: int):
+    db = SessionLocal()
+    try:
+        db.query(Car).filter(Car.owner_id == owner_id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == owner_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--bad-every", type=int, default=100, help="каждая N-я строка с ошибкой (0 — без ошибок)")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    owner_id = seed_owner()
+    try:
+        write_csv(path, args.rows, args.bad_every)
+        started = time.perf_counter()
+        report = import_fleet(path, owner_id)
+        elapsed = time.perf_counter() - started
+        print(f"rows={args.rows} imported={report.imported} errors={len(report.errors)} "
+              f"time={elapsed:.2f}s ({args.rows / elapsed:.0f} rows/s)")
+    finally:
+        os.remove(path)
+        cleanup(owner_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+﻿"""
+Inline-поиск авто (@bot запрос): сколько запросов в секунду выдерживает индекс
+в памяти (services.inline_search) по сравнению с ILIKE-запросом к БД.
+
+Запросы приходят на каждое нажатие клавиши, поэтому нагрузка моделируется
+набором фраз по буквам: «n», «no», «nov», ... «novi sad bmw».
+
+Запуск из корня проекта:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.inline_search --cars 20000
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import select, or_, and_
+
+from database import Base, engine, SessionLocal
+from models.car import Car
+from models.user import User, UserType
+from services.inline_search import InlineCarIndex, CAR_COLUMNS, MAX_RESULTS, normalize_terms
+
+BRANDS = [("BMW", "X5"), ("BMW", "320d"), ("Toyota", "Corolla"), ("Skoda", "Octavia"),
+          ("Volkswagen", "Golf"), ("Renault", "Clio"), ("Mercedes-Benz", "E 220"), ("Audi", "A4")]
+CITIES = ["Belgrade", "Novi Sad", "Niš", "Kragujevac", "Subotica"]
+PHRASES = ["novi sad bmw", "belgrade toyota corolla", "skoda octavia", "audi a4 2020", "mercedes e 220",
+           "kragujevac golf", "bmv x5", "subotica clio"]
+PAGE_SIZE = 20
+
+
+def seed(cars: int) -> int:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        owner = User(telegram_id=-int(time.time()), user_type=UserType.OWNER_LEGAL, name="bench")
+        db.add(owner)
+        db.flush()
+        rows = []
+        for i in range(cars):
+            brand, model = random.choice(BRANDS)
+            rows.append({"owner_id": owner.id, "brand": brand, "model": model, "year": random.randint(2010, 2024),
+                         "price_per_day": random.randint(20, 150), "city": random.choice(CITIES),
+                         "photo_file_id": f"photo{i}" if i % 2 else None, "available": True})
+        db.execute(Car.__table__.insert(), rows)
+        db.commit()
+        return owner.id
+    finally:
+        db.close()
+
+
+def cleanup(owner_id: int):
+    db = SessionLocal()
+    try:
+        db.query(Car).filter(Car.owner_id == owner_id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == owner_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def keystrokes(users: int) -> list:
+    """Запросы, которые придут от ``users`` пользователей, набирающих фразы по буквам."""
+    queries = []
+    for _ in range(users):
+        phrase = random.choice(PHRASES)
+        queries.extend(phrase[:i] for i in range(1, len(phrase) + 1))
+    return queries
+
+
+def sql_search(db, query: str):
+    # Так искали бы без индекса: каждое слово — ILIKE по марке, модели и городу
+    conditions = [
+        or_(Car.brand.ilike(f"%{term}%"), Car.model.ilike(f"%{term}%"), Car.city.ilike(f"%{term}%"))
+        for term in normalize_terms(query)
+    ]
+    stmt = select(*CAR_COLUMNS).where(Car.available == True, and_(*conditions))
+    return db.execute(stmt.order_by(Car.price_per_day, Car.id).limit(PAGE_SIZE)).all()
+
+
+def measure(name: str, queries: list, search):
+    started = time.perf_counter()
+    for query in queries:
+        search(query)
+    elapsed = time.perf_counter() - started
+    print(f"  {name:<18} {len(queries) / elapsed:>10.0f} queries/s  ({elapsed / len(queries) * 1000:.3f} ms/query)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cars", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    owner_id = seed(args.cars)
+    try:
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            index = InlineCarIndex(cache_ttl=30, cache_size=5000)
+            index.load(db)
+            print(f"cars={args.cars} index load={time.perf_counter() - started:.2f}s")
+
+            queries = keystrokes(args.users)
+            uncached = InlineCarIndex(cache_ttl=0, cache_size=0)
+            uncached.load(db)
+            measure("index, no cache", queries, lambda q: uncached.search(q, 0, PAGE_SIZE))
+            measure("index + cache", queries, lambda q: index.search(q, 0, PAGE_SIZE))
+            sample = queries[:max(len(queries) // 10, 1)]
+            measure("sql ilike", sample, lambda q: sql_search(db, q))
+
+            cars, _ = index.search("bmv x5", 0, MAX_RESULTS)
+            print(f"  fuzzy «bmv x5» -> {len(cars)} cars, first: {cars[0].brand} {cars[0].model}" if cars
+                  else "  fuzzy «bmv x5» -> 0 cars")
+        finally:
+            db.close()
+    finally:
+        cleanup(owner_id)
+
+
+if __name__ == "__main__":
+    main()
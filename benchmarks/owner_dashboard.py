@@ -0,0 +1,123 @@
+﻿"""
+Статистика «Моих автомобилей» для владельца с 500 авто: один агрегирующий
+запрос (services.owner_stats) против наивных запросов на каждое авто.
+
+Запуск из корня проекта:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.owner_dashboard --cars 500
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from database import Base, engine, SessionLocal
+from models.booking import Booking, BookingStatus
+from models.car import Car
+from models.payment import Payment, PaymentMethod, PaymentStatus
+from models.review import Review
+from models.user import User, UserType
+from services.availability import booked_days
+from services.owner_stats import owner_car_stats
+from services.sql_accounting import QueryStats, current_query_stats
+
+
+def seed(cars: int, bookings_per_car: int) -> tuple:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        owner = User(telegram_id=-int(time.time()), user_type=UserType.OWNER_LEGAL, name="bench")
+        db.add(owner)
+        db.flush()
+        car_rows = [{"owner_id": owner.id, "brand": "Bench", "model": f"M{i}", "year": 2015 + i % 10,
+                     "price_per_day": 30.0, "city": "Bench", "available": True} for i in range(cars)]
+        db.execute(Car.__table__.insert(), car_rows)
+        car_ids = [cid for (cid,) in db.query(Car.id).filter(Car.owner_id == owner.id)]
+
+        today = date.today()
+        for car_id in car_ids:
+            for n in range(bookings_per_car):
+                start = today + timedelta(days=random.randint(-60, 60))
+                booking = Booking(car_id=car_id, renter_id=owner.id, date_from=start,
+                                  date_to=start + timedelta(days=3), total_price=90.0,
+                                  status=BookingStatus.CONFIRMED)
+                db.add(booking)
+                db.flush()
+                db.add(Payment(booking_id=booking.id, amount=90.0, method=PaymentMethod.NBS_QR,
+                               status=PaymentStatus.COMPLETED))
+            db.add(Review(car_id=car_id, renter_id=owner.id, rating=random.randint(3, 5)))
+        db.commit()
+        return owner.id, car_ids
+    finally:
+        db.close()
+
+
+def naive_stats(db, owner_id: int) -> list:
+    """Как было бы без агрегирующего запроса: по несколько запросов на авто."""
+    today = date.today()
+    result = []
+    for car in db.query(Car).filter(Car.owner_id == owner_id).all():
+        bookings = db.query(Booking).filter(Booking.car_id == car.id).count()
+        revenue = db.query(func.sum(Payment.amount)).join(Booking).filter(
+            Booking.car_id == car.id, Payment.status == PaymentStatus.COMPLETED).scalar()
+        rating = db.query(func.avg(Review.rating)).filter(Review.car_id == car.id).scalar()
+        upcoming = db.query(Booking).filter(Booking.car_id == car.id, Booking.date_to >= today).all()
+        result.append((car.id, bookings, revenue, rating, len(upcoming)))
+    return result
+
+
+def measure(fn, owner_id: int, repeat: int) -> tuple:
+    stats = QueryStats()
+    token = current_query_stats.set(stats)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn(db, owner_id)
+        elapsed = (time.perf_counter() - started) / repeat
+    finally:
+        db.close()
+        current_query_stats.reset(token)
+    return elapsed, stats.count // repeat
+
+
+def cleanup(owner_id: int, car_ids: list):
+    db = SessionLocal()
+    try:
+        booking_ids = db.query(Booking.id).filter(Booking.car_id.in_(car_ids))
+        db.query(Payment).filter(Payment.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+        db.query(Booking).filter(Booking.car_id.in_(car_ids)).delete(synchronize_session=False)
+        db.query(Review).filter(Review.car_id.in_(car_ids)).delete(synchronize_session=False)
+        db.query(Car).filter(Car.owner_id == owner_id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == owner_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cars", type=int, default=500)
+    parser.add_argument("--bookings-per-car", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    owner_id, car_ids = seed(args.cars, args.bookings_per_car)
+    try:
+        db = SessionLocal()
+        try:
+            booked_days.load(db)
+        finally:
+            db.close()
+        print(f"{'variant':>12} {'queries':>8} {'ms':>10}")
+        for name, fn in (("aggregated", owner_car_stats), ("naive", naive_stats)):
+            elapsed, queries = measure(fn, owner_id, args.repeat)
+            print(f"{name:>12} {queries:>8} {elapsed * 1000:>10.1f}")
+    finally:
+        cleanup(owner_id, car_ids)
+
+
+if __name__ == "__main__":
+    main()
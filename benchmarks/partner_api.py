@@ -0,0 +1,201 @@
+﻿"""
+Нагрузка «партнёр опрашивает каталог» на партнёрское API public_api.py.
+
+Открытая модель нагрузки: запросы уходят с заданной частотой (``--rate``)
+независимо от скорости ответов. Каждый клиент хранит ETag и шлёт If-None-Match,
+как настоящий агрегатор; за время прогона ``--changes`` авто меняют цену,
+чтобы часть ответов была полной. Печатает достигнутую частоту, задержки и
+долю 304.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.partner_api --cars 10000 --rate 1000 --duration 30
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.payment_callback import wait_for_port
+from database import Base, engine, SessionLocal
+from models.car import Car
+from models.user import User, UserType
+from services.car_versions import bump_versions
+
+API_KEY = "bench-partner"
+
+
+def seed_cars(count: int) -> tuple:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        owner = User(telegram_id=-int(time.time()), user_type=UserType.OWNER_PHYSICAL, name="bench")
+        db.add(owner)
+        db.flush()
+        cars = [dict(owner_id=owner.id, brand="Bench", model=f"M{i}", year=2020, price_per_day=30.0,
+                     city="Bench", available=True) for i in range(count)]
+        db.execute(Car.__table__.insert(), cars)
+        db.commit()
+        car_ids = [row.id for row in db.query(Car.id).filter(Car.owner_id == owner.id)]
+        return owner.id, car_ids
+    finally:
+        db.close()
+
+
+def cleanup(owner_id: int):
+    db = SessionLocal()
+    try:
+        db.query(Car).filter(Car.owner_id == owner_id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == owner_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def touch_cars(car_ids: list):
+    db = SessionLocal()
+    try:
+        bump_versions(db.connection(), car_ids)
+        db.commit()
+    finally:
+        db.close()
+
+
+def wait_ready(port: int, timeout: float = 60.0):
+    # При нескольких воркерах порт открывается раньше, чем воркеры готовы отвечать
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f"http://127.0.0.1:{port}/partner/cars?limit=1", headers={"X-API-Key": API_KEY})
+            if response.status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"partner API did not become ready on port {port}")
+
+
+def car_paths(car_id: int) -> list:
+    return [
+        f"/partner/cars/{car_id}/availability",
+        f"/partner/cars/{car_id}",
+        f"/partner/cars/{car_id}/quote?date_from=2030-06-01&date_to=2030-06-07",
+    ]
+
+
+# Доли запросов: доступность 50%, карточка 30%, цена 15%, первая страница каталога 5%
+def request_path(car_ids: list) -> str:
+    kind = random.random()
+    if kind < 0.95:
+        availability, car, quote = car_paths(random.choice(car_ids))
+        return availability if kind < 0.5 else car if kind < 0.8 else quote
+    return "/partner/cars?limit=50"
+
+
+async def poll(port: int, car_ids: list, rate: float, duration: float, changes: int, max_in_flight: int) -> dict:
+    etags = {}
+    statuses = Counter()
+    latencies = []
+    in_flight = 0
+    dropped = 0
+    limits = httpx.Limits(max_connections=max_in_flight)
+    loop = asyncio.get_running_loop()
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", headers={"X-API-Key": API_KEY},
+                                 limits=limits, timeout=30) as client:
+        async def one(path):
+            nonlocal in_flight
+            headers = {"If-None-Match": etags[path]} if path in etags else {}
+            started = time.perf_counter()
+            try:
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+                if "etag" in response.headers:
+                    etags[path] = response.headers["etag"]
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            finally:
+                in_flight -= 1
+
+        # Прогрев: партнёр уже выгрузил весь каталог и дальше только перепроверяет ETag
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def warm(path):
+            async with semaphore:
+                try:
+                    response = await client.get(path)
+                except httpx.HTTPError:
+                    return
+                if "etag" in response.headers:
+                    etags[path] = response.headers["etag"]
+
+        await asyncio.gather(*(warm(path) for car_id in car_ids for path in car_paths(car_id)))
+
+        tasks = []
+        total = int(rate * duration)
+        change_every = total // changes if changes else 0
+        started = time.perf_counter()
+        for n in range(total):
+            delay = started + n / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if change_every and n % change_every == 0:
+                await loop.run_in_executor(None, touch_cars, random.sample(car_ids, 1))
+            if in_flight >= max_in_flight:
+                dropped += 1
+                continue
+            in_flight += 1
+            tasks.append(asyncio.create_task(one(request_path(car_ids))))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "sent": len(tasks),
+        "dropped": dropped,
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000 if latencies else 0,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        "statuses": dict(statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cars", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=1000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--changes", type=int, default=100, help="сколько раз за прогон меняется случайное авто")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    owner_id, car_ids = seed_cars(args.cars)
+    env = dict(os.environ, PUBLIC_API_WORKERS=str(args.workers), PUBLIC_API_PORT=str(args.port),
+               PARTNER_API_KEYS=API_KEY)
+    proc = subprocess.Popen([sys.executable, "public_api.py"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        wait_ready(args.port)
+        result = asyncio.run(poll(args.port, car_ids, args.rate, args.duration, args.changes, args.max_in_flight))
+    finally:
+        proc.terminate()
+        proc.wait()
+        cleanup(owner_id)
+
+    print(f"target {args.rate:.0f} req/s, {args.workers} workers, {args.cars} cars")
+    print(f"achieved {result['rps']:.0f} req/s, sent {result['sent']}, dropped {result['dropped']}")
+    print(f"latency p50 {result['p50']:.1f} ms, p99 {result['p99']:.1f} ms")
+    print(f"statuses {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+﻿"""
+Пропускная способность платёжного callback'а при 1, 2 и 4 воркерах payment_api.py.
+
+Запуск из корня проекта (лучше на Postgres, SQLite блокирует запись между процессами):
+
+    DATABASE_URL=postgresql://... python -m benchmarks.payment_callback --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import date
+
+import httpx
+
+from config import FREEKASSA_MERCHANT_ID, FREEKASSA_SECRET_2
+from database import Base, engine, SessionLocal
+from models.booking import Booking
+from models.car import Car
+from models.outbox import OutboxEvent
+from models.payment import Payment, PaymentMethod, PaymentStatus
+from models.user import User, UserType
+
+
+def seed_payments(count: int) -> list:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = User(telegram_id=-int(time.time()), user_type=UserType.RENTER, name="bench")
+        db.add(user)
+        db.flush()
+        car = Car(owner_id=user.id, brand="Bench", model="Car", year=2020, price_per_day=10.0, city="Bench")
+        db.add(car)
+        db.flush()
+        booking = Booking(car_id=car.id, renter_id=user.id, date_from=date.today(), date_to=date.today(),
+                          total_price=10.0)
+        db.add(booking)
+        db.flush()
+        payments = [Payment(booking_id=booking.id, amount=10.0, method=PaymentMethod.FREEKASSA)
+                    for _ in range(count)]
+        db.add_all(payments)
+        db.commit()
+        return [p.id for p in payments]
+    finally:
+        db.close()
+
+
+def reset_payments(ids: list):
+    db = SessionLocal()
+    try:
+        db.query(Payment).filter(Payment.id.in_(ids)).update(
+            {Payment.status: PaymentStatus.PENDING}, synchronize_session=False
+        )
+        db.query(OutboxEvent).filter(
+            OutboxEvent.dedup_key.in_([f"payment_completed:{pid}" for pid in ids])
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def callback_form(payment_id: int) -> dict:
+    amount = "10.00"
+    sign = hashlib.md5(f"{FREEKASSA_MERCHANT_ID}:{amount}:{FREEKASSA_SECRET_2}:{payment_id}".encode()).hexdigest()
+    return {"MERCHANT_ID": FREEKASSA_MERCHANT_ID, "AMOUNT": amount, "intid": f"bench-{payment_id}",
+            "MERCHANT_ORDER_ID": str(payment_id), "SIGN": sign}
+
+
+def wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"payment_api did not start on port {port}")
+
+
+async def fire(port: int, ids: list, concurrency: int) -> float:
+    url = f"http://127.0.0.1:{port}/api/freekassa_callback"
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def one(payment_id):
+            async with semaphore:
+                response = await client.post(url, data=callback_form(payment_id))
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(pid) for pid in ids))
+        return time.perf_counter() - started
+
+
+def run(workers: int, ids: list, concurrency: int, port: int) -> float:
+    env = dict(os.environ, PAYMENT_API_WORKERS=str(workers), PAYMENT_API_PORT=str(port))
+    proc = subprocess.Popen([sys.executable, "payment_api.py"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        time.sleep(1)
+        elapsed = asyncio.run(fire(port, ids, concurrency))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return len(ids) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    ids = seed_payments(args.requests)
+    print(f"{'workers':>8} {'req/s':>10}")
+    for workers in args.workers:
+        reset_payments(ids)
+        rps = run(workers, ids, args.concurrency, args.port)
+        print(f"{workers:>8} {rps:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
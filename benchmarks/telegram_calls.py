@@ -0,0 +1,199 @@
+﻿"""
+Сколько вызовов Telegram Bot API стоит одно бронирование с оплатой по QR.
+
+Бот не ходит в сеть: ``CountingBot`` отвечает на вызовы API сам и считает их
+по методам. Прогоняется полный путь: /menu -> бронирование -> город -> авто ->
+даты -> подтверждение -> оплата -> подтверждение оплаты.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.telegram_calls --bookings 20
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from aiogram import Bot, Dispatcher, types
+
+from database import Base, engine, SessionLocal
+from models.booking import Booking
+from models.car import Car
+from models.payment import Payment
+from models.user import User, UserType
+from services.availability import booked_days
+from services.cities import city_directory
+from services.fsm_storage import BoundedMemoryStorage
+from services.telegram_api import TrackedBot
+from middlewares.throttling import ThrottlingMiddleware
+
+# Методы, которые отправляют или меняют сообщения (на них действуют лимиты Telegram)
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageReplyMarkup",
+                   "editMessageCaption", "deleteMessage"}
+
+
+class OfflineBot(Bot):
+    """Отвечает на вызовы Bot API сам, без сети, и считает их по методам."""
+
+    def __init__(self):
+        super().__init__(token="123456:" + "A" * 35)
+        self.calls = Counter()
+        self._ids = itertools.count(1000)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        if method in ("answerCallbackQuery", "deleteMessage"):
+            return True
+        message = {"message_id": next(self._ids), "date": int(time.time()),
+                   "chat": {"id": int(data["chat_id"]), "type": "private"}}
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}]
+        elif method == "sendDocument":
+            message["document"] = {"file_id": "document", "file_unique_id": "document"}
+            message["caption"] = str(data.get("caption") or "")
+        else:
+            message["text"] = str(data.get("text") or data.get("caption") or "")
+        return message
+
+
+# Учёт и отсев вызовов TrackedBot поверх бота без сети
+class CountingBot(TrackedBot, OfflineBot):
+    pass
+
+
+def build_dispatcher(bot: Bot) -> Dispatcher:
+    import bot as app
+    dp = Dispatcher(bot, storage=BoundedMemoryStorage(64 * 1024 * 1024, {}, 3600))
+    app.setup_dispatcher(dp)
+    # Скрипт жмёт кнопки быстрее человека — ограничение частоты здесь не нужно
+    for middleware in dp.middleware.applications:
+        if isinstance(middleware, ThrottlingMiddleware):
+            middleware.limits, middleware.default = {}, (1e6, 1e6)
+    return dp
+
+
+def seed(bookings: int) -> tuple:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        stamp = int(time.time())
+        owner = User(telegram_id=-stamp, user_type=UserType.OWNER_PHYSICAL, name="owner", registered=True)
+        renter = User(telegram_id=stamp, user_type=UserType.RENTER, name="renter", registered=True)
+        db.add_all([owner, renter])
+        db.flush()
+        city = city_directory.resolve(db, f"Bench {stamp}")
+        cars = [Car(owner_id=owner.id, brand="Bench", model=f"M{i}", year=2020, price_per_day=30.0,
+                    city=city.name, city_id=city.id, available=True) for i in range(bookings)]
+        db.add_all(cars)
+        db.commit()
+        booked_days.load(db)
+        city_directory.load(db)
+        return renter.telegram_id, city.id, [car.id for car in cars], owner.id
+    finally:
+        db.close()
+
+
+def cleanup(owner_id: int, renter_telegram_id: int, car_ids: list):
+    db = SessionLocal()
+    try:
+        booking_ids = db.query(Booking.id).filter(Booking.car_id.in_(car_ids))
+        db.query(Payment).filter(Payment.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+        db.query(Booking).filter(Booking.car_id.in_(car_ids)).delete(synchronize_session=False)
+        db.query(Car).filter(Car.id.in_(car_ids)).delete(synchronize_session=False)
+        db.query(User).filter(User.id == owner_id).delete(synchronize_session=False)
+        db.query(User).filter(User.telegram_id == renter_telegram_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+class Client:
+    """Пользователь Telegram: шлёт сообщения и нажимает кнопки."""
+
+    def __init__(self, dp: Dispatcher, user_id: int):
+        self.dp = dp
+        self.user = {"id": user_id, "is_bot": False, "first_name": "Bench"}
+        self.chat = {"id": user_id, "type": "private"}
+        self._ids = itertools.count(1)
+
+    async def send(self, text: str):
+        message = {"message_id": next(self._ids), "date": int(time.time()), "chat": self.chat,
+                   "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self._process(types.Update(update_id=next(self._ids), message=message))
+
+    async def press(self, data: str):
+        message = {"message_id": next(self._ids), "date": int(time.time()), "chat": self.chat,
+                   "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "..."}
+        callback = {"id": str(next(self._ids)), "from": self.user, "chat_instance": "bench",
+                    "message": message, "data": data}
+        await self._process(types.Update(update_id=next(self._ids), callback_query=callback))
+
+    async def _process(self, update: types.Update):
+        # Как при polling: каждый апдейт в своей задаче со своим контекстом
+        await asyncio.create_task(self.dp.process_update(update))
+
+
+def last_payment_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Payment.id).order_by(Payment.id.desc()).first()[0]
+    finally:
+        db.close()
+
+
+def last_booking_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Booking.id).order_by(Booking.id.desc()).first()[0]
+    finally:
+        db.close()
+
+
+async def book_and_pay(client: Client, city_id: int, car_id: int, day: date):
+    await client.send("/menu")
+    await client.press("cmd_book")
+    await client.press(f"city:{city_id}")
+    await client.press(f"car:{car_id}")
+    await client.press(f"cal:pick:{day.isoformat()}")
+    await client.press(f"cal:pick:{(day + timedelta(days=2)).isoformat()}")
+    await client.press("confirm:yes")
+    await client.press("cmd_pay")
+    await client.press(f"pay_booking_{last_booking_id()}")
+    await client.press("method_qr")
+    await client.press(f"pay_confirm_{last_payment_id()}")
+
+
+async def run(bookings: int):
+    bot = CountingBot()
+    Bot.set_current(bot)
+    dp = build_dispatcher(bot)
+    Dispatcher.set_current(dp)
+
+    renter_id, city_id, car_ids, owner_id = seed(bookings)
+    try:
+        client = Client(dp, renter_id)
+        day = date.today() + timedelta(days=7)
+        for car_id in car_ids:
+            await book_and_pay(client, city_id, car_id, day)
+    finally:
+        cleanup(owner_id, renter_id, car_ids)
+
+    total = sum(bot.calls.values())
+    messages = sum(n for method, n in bot.calls.items() if method in MESSAGE_METHODS)
+    print(f"bookings={bookings} api_calls/booking={total / bookings:.1f} "
+          f"message_calls/booking={messages / bookings:.1f}")
+    for method, n in bot.calls.most_common():
+        print(f"  {method:<24} {n / bookings:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bookings", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.bookings))
+
+
+if __name__ == "__main__":
+    main()
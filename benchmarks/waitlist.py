@@ -0,0 +1,137 @@
+﻿"""
+Лист ожидания: подбор подписок под поток изменений доступности
+(services.waitlist) при 100 тыс. активных подписок.
+
+Сравнивается выборка кандидатов по индексу (город + даты) с полным
+просмотром активных подписок, и замеряется весь подбор вместе с записью
+уведомлений в outbox.
+
+Запуск из корня проекта:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.waitlist --subscriptions 100000 --events 200
+"""
+import argparse
+import importlib
+import random
+import statistics
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+from sqlalchemy import select
+
+from database import Base, engine, SessionLocal
+from models.city import City
+from models.outbox import OutboxEvent
+from models.waitlist import WaitlistSubscription
+from services.waitlist import candidates_query, match_cars
+
+# Таблица users для внешних ключей cars и класс User для relationship() у Car
+importlib.import_module("models.user")
+
+CITIES = 8
+BenchCar = namedtuple("BenchCar", "id brand model year city_id city price_per_day")
+
+
+def seed(subscriptions: int) -> list:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        suffix = int(time.time())
+        cities = [City(name=f"Bench {i}", normalized_name=f"bench {suffix} {i}") for i in range(CITIES)]
+        db.add_all(cities)
+        db.flush()
+        city_ids = [city.id for city in cities]
+        today = date.today()
+        rows = []
+        for i in range(subscriptions):
+            date_from = today + timedelta(days=random.randint(0, 180))
+            rows.append({"telegram_id": -(i + 1), "city_id": random.choice(city_ids), "date_from": date_from,
+                         "date_to": date_from + timedelta(days=random.randint(0, 13)),
+                         "max_price": random.choice([None, random.randint(20, 150)])})
+        for start in range(0, len(rows), 10000):
+            db.execute(WaitlistSubscription.__table__.insert(), rows[start:start + 10000])
+        db.commit()
+        return city_ids
+    finally:
+        db.close()
+
+
+def cleanup(city_ids: list):
+    db = SessionLocal()
+    try:
+        db.query(OutboxEvent).filter(OutboxEvent.event_type == "waitlist_match").delete(synchronize_session=False)
+        db.query(WaitlistSubscription).filter(WaitlistSubscription.city_id.in_(city_ids)) \
+            .delete(synchronize_session=False)
+        db.query(City).filter(City.id.in_(city_ids)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def events(city_ids: list, count: int) -> list:
+    """Поток изменений: новое авто в городе или отмена бронирования на несколько дней."""
+    today = date.today()
+    stream = []
+    for i in range(count):
+        car = BenchCar(10 ** 9 + i, "Bench", "M", 2020, random.choice(city_ids), "Bench", random.randint(40, 150))
+        if random.random() < 0.5:
+            stream.append((car, None, None))
+        else:
+            freed_from = today + timedelta(days=random.randint(0, 180))
+            stream.append((car, freed_from, freed_from + timedelta(days=random.randint(2, 6))))
+    return stream
+
+
+def full_scan(db, car, freed_from, freed_to) -> int:
+    # Без индекса: все активные подписки из БД и фильтр в Python
+    today = date.today()
+    sub = WaitlistSubscription
+    found = 0
+    for s in db.execute(select(sub.id, sub.city_id, sub.date_from, sub.date_to, sub.max_price)
+                        .where(sub.notified_at == None)):
+        if (s.city_id == car.city_id and s.date_from >= today
+                and (s.max_price is None or s.max_price >= car.price_per_day)
+                and (freed_from is None or (s.date_from <= freed_to and s.date_to >= freed_from))):
+            found += 1
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscriptions", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+
+    city_ids = seed(args.subscriptions)
+    stream = events(city_ids, args.events)
+    try:
+        db = SessionLocal()
+        try:
+            lookup, scan = [], []
+            for car, freed_from, freed_to in stream[:20]:
+                started = time.perf_counter()
+                db.execute(candidates_query(car.city_id, car.price_per_day, freed_from, freed_to)).all()
+                lookup.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                full_scan(db, car, freed_from, freed_to)
+                scan.append(time.perf_counter() - started)
+            print(f"subscriptions={args.subscriptions} dialect={engine.dialect.name}")
+            print(f"  candidates by index   median={statistics.median(lookup) * 1000:8.1f} ms/event")
+            print(f"  full scan             median={statistics.median(scan) * 1000:8.1f} ms/event")
+
+            timings, notified = [], 0
+            for car, freed_from, freed_to in stream:
+                started = time.perf_counter()
+                notified += match_cars(db, [car], freed_from, freed_to)
+                timings.append(time.perf_counter() - started)
+            print(f"  match + outbox write  median={statistics.median(timings) * 1000:8.1f} ms/event  "
+                  f"max={max(timings) * 1000:.1f} ms  events={len(stream)} notified={notified}")
+        finally:
+            db.close()
+    finally:
+        cleanup(city_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,127 @@
 ﻿import logging
 import asyncio
 
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.types import ParseMode
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from database import Base, engine
-from handlers import registration, cars, bookings, contracts, payments, reviews, calculator, menu
+from config import (
+    BOT_TOKEN, PROFILER_ENABLED, PROFILER_THRESHOLD, PROFILER_SAMPLE_RATE,
+    SQL_BUDGET_MODE, SQL_N_PLUS_ONE_THRESHOLD, UPDATE_WORKERS, UPDATE_CHAT_BACKLOG,
+    FSM_MAX_BYTES, FSM_STATE_TTLS, FSM_DEFAULT_TTL, FSM_REAP_INTERVAL, BOT_HTTP_PORT,
+    OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS, OUTBOX_LEASE_SECONDS,
+    OUTBOX_RATE_LIMIT, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX,
+    LOG_FILE, LOG_ROTATION, LOG_SAMPLE_RATES, LOG_SITE_RATE,
+    THROTTLE_LIMITS, THROTTLE_DEFAULT, THROTTLE_SWEEP_INTERVAL
+)
+from database import Base, engine, SessionLocal
+from handlers import (
+    registration, cars, bookings, contracts, payments, reviews, reports, inline, waitlist, calculator, menu
+)
+from services.availability import booked_days
+from services.car_text_search import ensure_search_schema
+import services.car_versions  # noqa: F401  версии авто для ETag партнёрского API
+from services.cities import city_directory
+from services.inline_search import inline_index
+from services.loop_monitor import loop_monitor
+from services.ordered_dispatcher import ChatOrderedDispatcher
+from services.fsm_storage import BoundedMemoryStorage
+from services.logging_setup import setup_logging
+from services.outbox import OutboxRelay
+from services.telegram_api import TrackedBot
+from middlewares.callback_ack import CallbackAckMiddleware, answering_handlers
+from middlewares.context import UserContextMiddleware
+from middlewares.loop_monitor import LoopMonitorMiddleware
+from middlewares.profiler import SlowUpdateProfilerMiddleware
+from middlewares.sql_budget import QueryBudgetMiddleware
+from middlewares.throttling import ThrottlingMiddleware
 from loguru import logger
 
 from fastapi import FastAPI
-from api.webhook import app as webhook_app
+from api.metrics import router as metrics_router
+from api.profiles import router as profiles_router, profile_store
 import uvicorn
 
-print("Creating tables...")
-Base.metadata.create_all(bind=engine)
 
-logger.add("logs/bot.log", rotation="10 MB", compression="zip")
-
-async def main():
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN is not set! Please set it in config.py or environment variables.")
-        return
-
-    # Создаём бота и диспетчер
-    bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-    storage = MemoryStorage()
-    dp = Dispatcher(bot, storage=storage)
+def setup_dispatcher(dp: Dispatcher):
+    """Middleware и хендлеры бота; порядок middleware важен."""
+    dp.middleware.setup(UserContextMiddleware())
+    dp.middleware.setup(ThrottlingMiddleware(THROTTLE_LIMITS, THROTTLE_DEFAULT, THROTTLE_SWEEP_INTERVAL))
+    dp.middleware.setup(CallbackAckMiddleware())
+    dp.middleware.setup(LoopMonitorMiddleware(loop_monitor))
+    dp.middleware.setup(QueryBudgetMiddleware(SQL_BUDGET_MODE, SQL_N_PLUS_ONE_THRESHOLD))
+    if PROFILER_ENABLED:
+        dp.middleware.setup(SlowUpdateProfilerMiddleware(profile_store, PROFILER_THRESHOLD, PROFILER_SAMPLE_RATE))
 
     # Регистрируем все хендлеры
+    menu.register_menu_commands(dp)
     registration.register_registration_handlers(dp)
     cars.register_cars_handlers(dp)
     bookings.register_bookings_handlers(dp)
     contracts.register_contracts_handlers(dp)
     payments.register_payments_handlers(dp)
     reviews.register_reviews_handlers(dp)
-    menu.register_menu_handlers(dp) 
+    reports.register_reports_handlers(dp)
+    inline.register_inline_handlers(dp)
+    waitlist.register_waitlist_handlers(dp)
+    menu.register_menu_handlers(dp)
 
-    fastapi_app = FastAPI()
+    logger.info(f"Callbacks answered by handlers themselves: {', '.join(answering_handlers(dp))}")
+
+
+async def main():
+    # Всё, что трогает БД и логи, — только здесь, не при импорте: воркеры пула
+    # графиков (spawn) заново импортируют этот модуль как __mp_main__
+    setup_logging(LOG_FILE, LOG_ROTATION, LOG_SAMPLE_RATES, LOG_SITE_RATE)
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN is not set! Please set it in config.py or environment variables.")
+        return
+
+    print("Creating tables...")
+    Base.metadata.create_all(bind=engine)
+    ensure_search_schema(engine)
 
-    # Монтируем вебхук роутер
-    fastapi_app.mount("/api", webhook_app)
+    # Создаём бота и диспетчер
+    bot = TrackedBot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
+    storage = BoundedMemoryStorage(FSM_MAX_BYTES, FSM_STATE_TTLS, FSM_DEFAULT_TTL)
+    if UPDATE_WORKERS:
+        dp = ChatOrderedDispatcher(bot, storage=storage, workers=UPDATE_WORKERS,
+                                   max_chat_backlog=UPDATE_CHAT_BACKLOG)
+    else:
+        dp = Dispatcher(bot, storage=storage)
+    setup_dispatcher(dp)
+
+    # Загружаем карты занятых дней, справочник городов и индекс inline-поиска
+    db = SessionLocal()
+    try:
+        booked_days.load(db)
+        city_directory.load(db)
+        inline_index.load(db)
+    finally:
+        db.close()
+
+    # Платёжные callback'и принимает отдельный процесс (payment_api.py), бот только
+    # доставляет его события через outbox; здесь лишь служебные маршруты
+    fastapi_app = FastAPI()
+    fastapi_app.include_router(metrics_router)
+    fastapi_app.include_router(profiles_router)
 
     # Запускаем FastAPI сервер асинхронно
-    config = uvicorn.Config(fastapi_app, host="0.0.0.0", port=8000, log_level="info")
+    config = uvicorn.Config(fastapi_app, host="0.0.0.0", port=BOT_HTTP_PORT, log_level="info")
     server = uvicorn.Server(config)
 
     # Запускаем вебсервер в фоне
     loop = asyncio.get_running_loop()
     loop.create_task(server.serve())
 
-    logger.info("Bot started with FastAPI webhook server on port 8000")
+    # Следим за лагом event loop и блокирующими вызовами в хендлерах
+    loop_monitor.start()
+    # Чистим брошенные FSM-сессии
+    loop.create_task(storage.reap_periodically(FSM_REAP_INTERVAL))
+    # Доставляем пользователям события из outbox (подтверждения оплат)
+    relay = OutboxRelay(OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS, OUTBOX_LEASE_SECONDS,
+                        OUTBOX_RATE_LIMIT, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX)
+    loop.create_task(relay.run(bot))
+
+    logger.info(f"Bot started with service HTTP server on port {BOT_HTTP_PORT}")
 
     # Запускаем Telegram polling
     await dp.start_polling()
@@ -1,15 +1,70 @@
-﻿from sqlalchemy import create_engine
+﻿import time
+from contextvars import ContextVar
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DATABASE_URL
+from config import DATABASE_URL, DATABASE_REPLICA_URL, READ_YOUR_WRITES_SECONDS, DB_POOL_SIZE, DB_MAX_OVERFLOW
 
-engine = create_engine(DATABASE_URL, echo=False)
+engine = create_engine(DATABASE_URL, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
 SessionLocal = sessionmaker(bind=engine)
 
+# Реплика для read-only хендлеров; без неё используется основной движок
+replica_engine = create_engine(
+    DATABASE_REPLICA_URL, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW
+) if DATABASE_REPLICA_URL else engine
+ReplicaSessionLocal = sessionmaker(bind=replica_engine)
+
 Base = declarative_base()
 
+# Telegram ID пользователя, чей апдейт сейчас обрабатывается
+current_user_id: ContextVar = ContextVar("current_user_id", default=None)
+
+# telegram_id -> время последней записи, чтобы пользователь видел свои изменения
+_recent_writes: dict[int, float] = {}
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def mark_write(user_id: int):
+    now = time.monotonic()
+    _recent_writes[user_id] = now
+    if len(_recent_writes) > 10000:
+        for uid, ts in list(_recent_writes.items()):
+            if now - ts > READ_YOUR_WRITES_SECONDS:
+                del _recent_writes[uid]
+
+
+def read_session(user_id: int = None):
+    """
+    Сессия для чтения: реплика, если пользователь недавно ничего не записывал,
+    иначе основная БД (read-your-writes).
+    """
+    if user_id is None:
+        user_id = current_user_id.get()
+    wrote_at = _recent_writes.get(user_id)
+    if wrote_at is not None and time.monotonic() - wrote_at < READ_YOUR_WRITES_SECONDS:
+        return SessionLocal()
+    return ReplicaSessionLocal()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _flag_write(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _clear_write(session, previous_transaction):
+    session.info.pop("wrote", None)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _remember_write(session):
+    user_id = current_user_id.get()
+    if session.info.pop("wrote", False) and user_id is not None:
+        mark_write(user_id)
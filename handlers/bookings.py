@@ -1,58 +1,158 @@
-﻿from aiogram import types, Dispatcher
+﻿import re
+
+from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import StatesGroup, State
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from loguru import logger
 
-from database import SessionLocal
+from database import SessionLocal, read_session
 from models.booking import Booking, BookingStatus
 from models.user import User
 from models.car import Car
 from handlers.calculator import calculate_rental_price
 from keyboards.inline import (
-    get_city_kb, get_car_kb,
-    confirm_booking_kb, date_from_kb, date_to_kb
+    get_city_kb, get_car_kb, waitlist_kb,
+    confirm_booking_kb, calendar_kb, date_from_kb
 )
+from services.availability import booked_days
+from services.car_search import search_cars, parse_filters, describe_filters
+from services.cities import city_directory
+from services.inline_search import inline_index
+from services.sql_accounting import query_budget
 
 
 class BookingFSM(StatesGroup):
     select_city = State()
     select_car = State()
+    set_filters = State()
     select_date_from = State()
     select_date_to = State()
     confirm_booking = State()
 
 
+# Календарь месяца для авто: дни вне [first_day, last_day] и занятые дни недоступны
+def _calendar(car_id: int, year: int, month: int, first_day: date, last_day: date, back_callback: str):
+    month_start = date(year, month, 1)
+    month_end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    booked = booked_days.booked_in_month(car_id, year, month)
+    disabled = {
+        day for day in range(1, month_end.day + 1)
+        if day in booked or not (first_day <= date(year, month, day) <= last_day)
+    }
+    return calendar_kb(year, month, disabled,
+                       has_prev=month_start > first_day,
+                       has_next=month_end < last_day,
+                       back_callback=back_callback)
+
+
+def date_from_calendar_kb(car_id: int, year: int = None, month: int = None):
+    today = datetime.today().date()
+    return _calendar(car_id, year or today.year, month or today.month,
+                     today, booked_days.last_day, "back:car")
+
+
+def date_to_calendar_kb(car_id: int, date_from: date, year: int = None, month: int = None):
+    # Аренда не может перекрывать следующее бронирование
+    next_booked = booked_days.first_booked_after(car_id, date_from)
+    last_day = next_booked - timedelta(days=1) if next_booked else booked_days.last_day
+    return _calendar(car_id, year or date_from.year, month or date_from.month,
+                     date_from, last_day, "back:date_from")
+
+
 # Шаг 1 — старт
-async def start_booking(msg: types.Message, state: FSMContext):
-    await msg.answer("Выберите город для аренды авто:", reply_markup=get_city_kb())
+async def start_booking(msg: types.Message, state: FSMContext, edit: bool = False):
+    send = msg.edit_text if edit else msg.answer
+    if not city_directory.has_cars():
+        await send("🚫 Нет доступных авто.")
+        await state.finish()
+        return
+    await send("Выберите город для аренды авто:", reply_markup=get_city_kb())
     await BookingFSM.select_city.set()
 
 
+# Страница авто города с учётом фильтров. В FSM хранятся только фильтры
+# и границы текущей страницы, сами авто каждый раз выбираются в SQL.
+async def show_car_page(msg: types.Message, state: FSMContext, direction: str = None, edit: bool = True):
+    data = await state.get_data()
+    city_id = data["city_id"]
+    filters = data.get("car_filters") or {}
+    page = data.get("car_page")
+
+    db: Session = read_session()
+    try:
+        if direction == "next" and page:
+            cars, has_prev, has_next = search_cars(db, city_id, filters, after=page["last"])
+        elif direction == "prev" and page:
+            cars, has_prev, has_next = search_cars(db, city_id, filters, before=page["first"])
+        elif page:
+            cars, _, has_next = search_cars(db, city_id, filters, start=page["first"])
+            has_prev = page["has_prev"]
+        else:
+            cars, has_prev, has_next = search_cars(db, city_id, filters)
+    finally:
+        db.close()
+
+    send = msg.edit_text if edit else msg.answer
+    if not cars and not filters:
+        # Город остаётся в данных FSM — для подписки на появление авто
+        await send("🚫 Нет доступных авто в этом городе.", reply_markup=waitlist_kb())
+        await state.reset_state(with_data=False)
+        return
+
+    if cars:
+        page = {"first": [cars[0][4], cars[0][0]], "last": [cars[-1][4], cars[-1][0]], "has_prev": has_prev}
+        text = f"Город: {data['city']}\nВыберите авто:"
+    else:
+        page = None
+        text = f"Город: {data['city']}\n🚫 По фильтрам ничего не найдено."
+    if filters:
+        text += f"\n🔎 {describe_filters(filters)}"
+    await state.update_data(car_page=page)
+    await send(text, reply_markup=get_car_kb(cars, has_prev, has_next, bool(filters)))
+    await BookingFSM.select_car.set()
+
+
 # Шаг 2 — выбор города
 async def select_city_handler(callback: types.CallbackQuery, state: FSMContext):
-    city = callback.data.split(":")[1]
-    await state.update_data(city=city)
+    city_id = int(callback.data.split(":")[1])
+    await state.update_data(city=city_directory.name(city_id), city_id=city_id, car_filters={}, car_page=None)
+    await show_car_page(callback.message, state)
 
-    db: Session = SessionLocal()
-    try:
-        cars = db.query(Car).filter(Car.available == True, Car.city == city).all()
-        if not cars:
-            await callback.message.edit_text("🚫 Нет доступных авто в этом городе.")
-            await state.finish()
-            return
 
-        cars_map = {f"{car.brand} {car.model} ({car.year})": car.id for car in cars}
-        await state.update_data(available_cars=cars_map)
+# Листание страниц, фильтры и их сброс
+async def car_page_handler(callback: types.CallbackQuery, state: FSMContext):
+    action = callback.data.split(":")[1]
+    await callback.answer()
 
-        await callback.message.edit_text(f"Город: {city}\nВыберите авто:", reply_markup=get_car_kb(cars_map))
-        await BookingFSM.select_car.set()
-    finally:
-        db.close()
+    if action == "filters":
+        await callback.message.edit_text(
+            "Введите фильтры через «;», например:\n"
+            "цена 20-60; год 2015-; марка Toyota; рейтинг 4; поиск octavia",
+            reply_markup=date_from_kb()
+        )
+        await BookingFSM.set_filters.set()
+        return
+    if action == "reset":
+        await state.update_data(car_filters={}, car_page=None)
+        await show_car_page(callback.message, state)
+        return
+    await show_car_page(callback.message, state, direction=action)
+
+
+async def set_filters(msg: types.Message, state: FSMContext):
+    try:
+        filters = parse_filters(msg.text)
+    except ValueError as e:
+        await msg.answer(f"❌ {e}. Попробуйте снова:", reply_markup=date_from_kb())
+        return
+    await state.update_data(car_filters=filters, car_page=None)
+    await show_car_page(msg, state, edit=False)
 
 
 # Шаг 3 — выбор авто
+@query_budget(2)
 async def select_car(callback: types.CallbackQuery, state: FSMContext):
     car_id = int(callback.data.split(":")[1])
     data = await state.get_data()
@@ -73,7 +173,6 @@ async def select_car(callback: types.CallbackQuery, state: FSMContext):
         await state.update_data(
             selected_car_id=car_id,
             booking_city=data.get("city"),
-            available_cars=data.get("available_cars"),
             return_to="booking_car_selected"  # специальный маркер
         )
         from handlers.registration import start_registration
@@ -87,22 +186,99 @@ async def select_car(callback: types.CallbackQuery, state: FSMContext):
     if car and car.photo_file_id:
         await callback.message.answer_photo(photo=car.photo_file_id, caption=f"{car.brand} {car.model} ({car.year})")
 
-    await callback.message.answer("Введите дату начала аренды (ДД.ММ.ГГГГ):", reply_markup=date_from_kb())
+    await callback.message.answer("Выберите дату начала аренды или введите её (ДД.ММ.ГГГГ):",
+                                  reply_markup=date_from_calendar_kb(car_id))
     await BookingFSM.select_date_from.set()
 
+# Deep link t.me/<bot>?start=car_<id>[_<ГГГГММДД>_<ГГГГММДД>]: payload до 64 символов [A-Za-z0-9_-]
+CAR_LINK_RE = re.compile(r"^car_(\d+)(?:_(\d{8})_(\d{8}))?$")
+
+
+def car_link_payload(car_id: int, date_from: date = None, date_to: date = None) -> str:
+    payload = f"car_{car_id}"
+    if date_from and date_to:
+        payload += f"_{date_from:%Y%m%d}_{date_to:%Y%m%d}"
+    return payload
+
+
+def parse_car_link(payload: str):
+    """``(car_id, date_from, date_to)`` из payload ссылки; даты None, если не заданы или некорректны."""
+    match = CAR_LINK_RE.match(payload or "")
+    if not match:
+        return None
+    car_id, date_from, date_to = match.groups()
+    try:
+        date_from = datetime.strptime(date_from, "%Y%m%d").date() if date_from else None
+        date_to = datetime.strptime(date_to, "%Y%m%d").date() if date_to else None
+    except ValueError:
+        date_from = date_to = None
+    return int(car_id), date_from, date_to
+
+
+# Вход в бронирование конкретного авто по ссылке: сразу к датам, а с датами — к расчёту стоимости
+async def open_car_booking(msg: types.Message, state: FSMContext, car_id: int,
+                           date_from: date = None, date_to: date = None):
+    db: Session = read_session()
+    try:
+        car = db.query(Car).filter(Car.id == car_id).first()
+    finally:
+        db.close()
+
+    if not car or not car.available:
+        await msg.answer("🚫 Это авто сейчас недоступно для бронирования.")
+        await state.finish()
+        return
+
+    await state.update_data(city=city_directory.name(car.city_id) or car.city, city_id=car.city_id,
+                            car_filters={}, car_page=None, selected_car_id=car.id)
+    if car.photo_file_id:
+        await msg.answer_photo(photo=car.photo_file_id, caption=f"{car.brand} {car.model} ({car.year})")
+
+    today = datetime.today().date()
+    if date_from and date_to:
+        if (today <= date_from <= date_to <= booked_days.last_day
+                and booked_days.is_free(car.id, date_from, date_to)):
+            await state.update_data(date_from=date_from)
+            await apply_date_to(msg, state, date_to)
+            return
+        await msg.answer("❌ Даты из ссылки недоступны, выберите другие.")
+
+    await msg.answer("Выберите дату начала аренды или введите её (ДД.ММ.ГГГГ):",
+                     reply_markup=date_from_calendar_kb(car.id))
+    await BookingFSM.select_date_from.set()
+
+
 # Шаг 4 — дата начала
 async def select_date_from(msg: types.Message, state: FSMContext):
+    data = await state.get_data()
     try:
         date_from = datetime.strptime(msg.text.strip(), "%d.%m.%Y").date()
-        if date_from < datetime.today().date():
-            raise ValueError()
-        await state.update_data(date_from=date_from)
-
-        await msg.answer("Введите дату окончания бронирования в формате ДД.MM.ГГГГ:", reply_markup=date_to_kb())
-        await BookingFSM.select_date_to.set()
     except Exception:
         await msg.answer("❌ Некорректная дата. Введите в формате ДД.ММ.ГГГГ, не в прошлом.",
-                         reply_markup=date_from_kb())
+                         reply_markup=date_from_calendar_kb(data["selected_car_id"]))
+        return
+    await apply_date_from(msg, state, date_from)
+
+
+async def apply_date_from(msg: types.Message, state: FSMContext, date_from: date, edit: bool = False):
+    data = await state.get_data()
+    car_id = data["selected_car_id"]
+    send = msg.edit_text if edit else msg.answer
+
+    if not (datetime.today().date() <= date_from <= booked_days.last_day):
+        await send("❌ Некорректная дата. Введите в формате ДД.ММ.ГГГГ, не в прошлом.",
+                   reply_markup=date_from_calendar_kb(car_id))
+        return
+    if booked_days.is_booked(car_id, date_from):
+        await send("❌ Эта дата уже занята. Выберите другую:",
+                   reply_markup=date_from_calendar_kb(car_id, date_from.year, date_from.month))
+        return
+
+    await state.update_data(date_from=date_from)
+    await send(f"Дата начала: {date_from.strftime('%d.%m.%Y')}\n"
+               "Выберите дату окончания аренды или введите её (ДД.ММ.ГГГГ):",
+               reply_markup=date_to_calendar_kb(car_id, date_from))
+    await BookingFSM.select_date_to.set()
 
 
 # Шаг 5 — дата окончания
@@ -110,9 +286,24 @@ async def select_date_to(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     try:
         date_to = datetime.strptime(msg.text.strip(), "%d.%m.%Y").date()
+    except Exception:
+        await msg.answer("❌ Некорректная дата. Попробуйте снова.",
+                         reply_markup=date_to_calendar_kb(data["selected_car_id"], data["date_from"]))
+        return
+    await apply_date_to(msg, state, date_to)
+
+
+async def apply_date_to(msg: types.Message, state: FSMContext, date_to: date, edit: bool = False):
+    data = await state.get_data()
+    send = msg.edit_text if edit else msg.answer
+    try:
         date_from = data["date_from"]
         if date_to < date_from:
             raise ValueError()
+        if not booked_days.is_free(data["selected_car_id"], date_from, date_to):
+            await send("❌ В выбранном периоде авто уже забронировано. Выберите другую дату:",
+                       reply_markup=date_to_calendar_kb(data["selected_car_id"], date_from))
+            return
         await state.update_data(date_to=date_to)
 
         db: Session = SessionLocal()
@@ -127,22 +318,52 @@ async def select_date_to(msg: types.Message, state: FSMContext):
         )
         await state.update_data(total_price=total_price)
 
-        car_name = next((name for name, id_ in data["available_cars"].items() if id_ == car.id), "автомобиль")
-
         summary = (
             f"Подтвердите бронирование:\n"
-            f"🚗 {car_name}\n"
+            f"🚗 {car.brand} {car.model} ({car.year})\n"
             f"📅 С {date_from.strftime('%d.%m.%Y')} по {date_to.strftime('%d.%m.%Y')}\n"
             f"💶 Итого: {total_price:.2f} €\n"
             "Подтверждаете?"
         )
-        await msg.answer(summary, reply_markup=confirm_booking_kb())
+        await send(summary, reply_markup=confirm_booking_kb())
         await BookingFSM.confirm_booking.set()
     except Exception:
-        await msg.answer("❌ Некорректная дата. Попробуйте снова.", reply_markup=date_to_kb())
+        await send("❌ Некорректная дата. Попробуйте снова.",
+                   reply_markup=date_to_calendar_kb(data["selected_car_id"], data["date_from"]))
+
+
+# Календарь — листание месяцев
+async def calendar_navigate(callback: types.CallbackQuery, state: FSMContext):
+    year, month = map(int, callback.data.split(":")[2].split("-"))
+    data = await state.get_data()
+    car_id = data["selected_car_id"]
+
+    if await state.get_state() == BookingFSM.select_date_to.state:
+        kb = date_to_calendar_kb(car_id, data["date_from"], year, month)
+    else:
+        kb = date_from_calendar_kb(car_id, year, month)
+    await callback.message.edit_reply_markup(reply_markup=kb)
+    await callback.answer()
+
+
+# Календарь — выбор дня
+async def calendar_pick(callback: types.CallbackQuery, state: FSMContext):
+    day = date.fromisoformat(callback.data.split(":")[2])
+    await callback.answer()
+
+    if await state.get_state() == BookingFSM.select_date_to.state:
+        await apply_date_to(callback.message, state, day, edit=True)
+    else:
+        await apply_date_from(callback.message, state, day, edit=True)
+
+
+# Календарь — нажатие на заголовок или занятый день
+async def calendar_noop(callback: types.CallbackQuery):
+    await callback.answer()
 
 
 # Шаг 6 — подтверждение
+@query_budget(4)
 async def confirm_booking(callback: types.CallbackQuery, state: FSMContext):
     if callback.data == "confirm:no":
         await callback.message.edit_text("❌ Бронирование отменено.")
@@ -160,6 +381,11 @@ async def confirm_booking(callback: types.CallbackQuery, state: FSMContext):
             await state.finish()
             return
 
+        if not booked_days.is_free(car.id, data["date_from"], data["date_to"]):
+            await callback.message.edit_text("🚫 Эти даты уже заняты. Начните бронирование заново.")
+            await state.finish()
+            return
+
         booking = Booking(
             renter_id=user.id,
             car_id=car.id,
@@ -170,10 +396,16 @@ async def confirm_booking(callback: types.CallbackQuery, state: FSMContext):
         )
         db.add(booking)
         car.available = False
+        # Запоминаем id до commit, чтобы не перечитывать объекты после него
+        user_id, car_id, city_id = user.id, car.id, car.city_id
         db.commit()
+        booked_days.mark(car_id, data["date_from"], data["date_to"])
+        city_directory.change(city_id, -1)
+        # Забронированное авто недоступно — убираем его из inline-поиска
+        inline_index.remove(car_id)
 
         await callback.message.edit_text("✅ Бронирование подтверждено!")
-        logger.info(f"Booking: user={user.id}, car={car.id}")
+        logger.info(f"Booking: user={user_id}, car={car_id}")
     except Exception as e:
         logger.error(f"Ошибка бронирования: {e}")
         await callback.message.edit_text("Ошибка при бронировании.")
@@ -198,24 +430,19 @@ async def back_to_city(callback: types.CallbackQuery, state: FSMContext):
 
 # 🔙 Назад — авто
 async def back_to_car(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    cars_map = data.get("available_cars", {})
-    await callback.message.edit_text("Выберите автомобиль:", reply_markup=get_car_kb(cars_map))
-    await BookingFSM.select_car.set()
+    await show_car_page(callback.message, state)
 
 
-# 🔙 Назад — к выбору авто из ввода даты
+# 🔙 Назад — к выбору авто из ввода даты и фильтров
 async def back_to_car_from_date(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    cars_map = data.get("available_cars", {})
-    await callback.message.edit_text("Выберите автомобиль:", reply_markup=get_car_kb(cars_map))
-    await BookingFSM.select_car.set()
+    await show_car_page(callback.message, state)
 
 
 # 🔙 Назад — к дате начала из даты окончания
 async def back_to_date_from(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("Введите дату начала бронирования в формате ДД.ММ.ГГГГ:",
-                                     reply_markup=date_from_kb())
+    data = await state.get_data()
+    await callback.message.edit_text("Выберите дату начала аренды или введите её (ДД.ММ.ГГГГ):",
+                                     reply_markup=date_from_calendar_kb(data["selected_car_id"]))
     await BookingFSM.select_date_from.set()
 
 
@@ -224,8 +451,16 @@ def register_bookings_handlers(dp: Dispatcher):
     dp.register_callback_query_handler(select_city_handler, lambda c: c.data.startswith("city:"),
                                        state=BookingFSM.select_city)
     dp.register_callback_query_handler(select_car, lambda c: c.data.startswith("car:"), state=BookingFSM.select_car)
+    dp.register_callback_query_handler(car_page_handler, lambda c: c.data.startswith("carpage:"),
+                                       state=BookingFSM.select_car)
+    dp.register_message_handler(set_filters, state=BookingFSM.set_filters)
     dp.register_message_handler(select_date_from, state=BookingFSM.select_date_from)
     dp.register_message_handler(select_date_to, state=BookingFSM.select_date_to)
+    dp.register_callback_query_handler(calendar_navigate, lambda c: c.data.startswith("cal:nav:"),
+                                       state=[BookingFSM.select_date_from, BookingFSM.select_date_to])
+    dp.register_callback_query_handler(calendar_pick, lambda c: c.data.startswith("cal:pick:"),
+                                       state=[BookingFSM.select_date_from, BookingFSM.select_date_to])
+    dp.register_callback_query_handler(calendar_noop, lambda c: c.data == "cal:none", state="*")
     dp.register_callback_query_handler(confirm_booking, lambda c: c.data.startswith("confirm:"),
                                        state=BookingFSM.confirm_booking)
     dp.register_callback_query_handler(back_to_city, lambda c: c.data == "back:city", state="*")
@@ -1,11 +1,28 @@
-﻿from aiogram import types, Dispatcher
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+﻿import io
+import os
+import tempfile
+from datetime import date
+
+from aiogram import types, Dispatcher
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, InputFile
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from database import SessionLocal
+from aiogram.utils.deep_linking import get_start_link
+from database import SessionLocal, read_session
+from handlers.bookings import car_link_payload
 from keyboards.inline import kb_back, kb_skip_cancel, kb_confirm
 from models.car import Car
-from models.user import User
+from models.user import User, UserType
+from services.availability import booked_days
+from services.cities import city_directory
+from services.car_fields import parse_year, parse_price, parse_discount
+from services.fleet_import import import_fleet
+from services.history_export import export_owner_history
+from services.ical import feed_url
+from services.inline_search import inline_index, owner_car_rows
+from services.waitlist import schedule_match
+from services.owner_stats import owner_car_stats, OCCUPANCY_DAYS
+from services.sql_accounting import query_budget, run_counted
 from loguru import logger
 
 
@@ -23,6 +40,17 @@ class AddCarFSM(StatesGroup):
     confirm = State()
 
 
+class FleetImportFSM(StatesGroup):
+    waiting_for_file = State()
+
+
+# Авто на одной странице «Моих автомобилей»
+MY_CARS_PAGE_SIZE = 10
+
+# Лимит Telegram на скачивание файлов ботом
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+
+
 class EditCarFSM(StatesGroup):
     choose_car = State()
     choose_field = State()
@@ -40,8 +68,9 @@ async def cancel_handler(callback: CallbackQuery, state: FSMContext):
 
 
 # ===== Добавление авто =====
-async def add_car_start(msg: types.Message, state: FSMContext):
-    await msg.answer("Введите марку:", reply_markup=kb_back())
+async def add_car_start(msg: types.Message, state: FSMContext, edit: bool = False):
+    send = msg.edit_text if edit else msg.answer
+    await send("Введите марку:", reply_markup=kb_back())
     await AddCarFSM.brand.set()
 
 
@@ -59,14 +88,13 @@ async def get_model(msg, state: FSMContext):
 
 async def get_year(msg, state: FSMContext):
     try:
-        year = int(msg.text)
-        if not (1900 <= year <= 2100):
-            raise
-        await state.update_data(year=year)
-        await msg.answer("Номерной знак:", reply_markup=kb_skip_cancel())
-        await AddCarFSM.license_plate.set()
-    except:
+        year = parse_year(msg.text)
+    except ValueError:
         await msg.answer("Год 1900–2100:", reply_markup=kb_back())
+        return
+    await state.update_data(year=year)
+    await msg.answer("Номерной знак:", reply_markup=kb_skip_cancel())
+    await AddCarFSM.license_plate.set()
 
 
 # ===== Пропуски =====
@@ -112,26 +140,24 @@ async def get_vin(msg, state: FSMContext):
 
 async def get_price(msg, state: FSMContext):
     try:
-        price = float(msg.text.replace(",", "."))
-        if price <= 0:
-            raise
-        await state.update_data(price_per_day=price)
-        await msg.answer("Скидка 0–100%:", reply_markup=kb_back())
-        await AddCarFSM.discount.set()
-    except:
+        price = parse_price(msg.text)
+    except ValueError:
         await msg.answer("Укажите €:", reply_markup=kb_back())
+        return
+    await state.update_data(price_per_day=price)
+    await msg.answer("Скидка 0–100%:", reply_markup=kb_back())
+    await AddCarFSM.discount.set()
 
 
 async def get_discount(msg, state: FSMContext):
     try:
-        disc = float(msg.text.replace(",", "."))
-        if not (0 <= disc <= 100):
-            raise
-        await state.update_data(discount=disc)
-        await msg.answer("Условия аренды:", reply_markup=kb_skip_cancel())
-        await AddCarFSM.rental_terms.set()
-    except:
+        disc = parse_discount(msg.text)
+    except ValueError:
         await msg.answer("Скидка 0–100:", reply_markup=kb_back())
+        return
+    await state.update_data(discount=disc)
+    await msg.answer("Условия аренды:", reply_markup=kb_skip_cancel())
+    await AddCarFSM.rental_terms.set()
 
 
 async def get_terms(msg, state: FSMContext):
@@ -184,6 +210,7 @@ async def confirm_add(callback: CallbackQuery, state: FSMContext):
             if not user:
                 await callback.message.edit_text("❌ Сначала зарегистрируйтесь.")
                 return
+            city = city_directory.resolve(db, d["city"])
             car = Car(
                 owner_id=user.id,
                 brand=d["brand"],
@@ -194,12 +221,16 @@ async def confirm_add(callback: CallbackQuery, state: FSMContext):
                 price_per_day=d["price_per_day"],
                 discount=d["discount"],
                 rental_terms=d["rental_terms"],
-                city=d["city"],
+                city=city.name,
+                city_id=city.id,
                 photo_file_id=d.get("photo_file_id"),
                 available=True
             )
             db.add(car)
             db.commit()
+            city_directory.change(car.city_id, 1)
+            inline_index.upsert(car)
+            schedule_match(car_ids=[car.id])
             await callback.message.edit_text("🚗 Авто добавлено.")
         except Exception as e:
             logger.error(f"Add car error: {e}")
@@ -212,31 +243,193 @@ async def confirm_add(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-# ===== Редактирование и удаление =====
+# ===== Импорт автопарка из CSV/XLSX =====
+async def import_fleet_start(msg: types.Message, state: FSMContext):
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.telegram_id == msg.chat.id).first()
+    finally:
+        db.close()
+    if not user:
+        await msg.answer("Зарегистрируйтесь (/start).")
+        return
+    if user.user_type != UserType.OWNER_LEGAL:
+        await msg.answer("Импорт автопарка доступен только юридическим лицам.")
+        return
+
+    await msg.answer(
+        "Отправьте файл CSV или XLSX с автопарком.\n"
+        "Колонки: brand, model, year, price_per_day, city (обязательные), "
+        "license_plate, vin, discount, rental_terms.",
+        reply_markup=kb_back()
+    )
+    await FleetImportFSM.waiting_for_file.set()
+
+
+# Импорт пишет пачками по 1000 строк: файл до 20 МБ — до нескольких сотен запросов
+@query_budget(500)
+async def import_fleet_file(msg: types.Message, state: FSMContext):
+    document = msg.document
+    suffix = os.path.splitext(document.file_name or "")[1].lower()
+    if suffix not in (".csv", ".xlsx"):
+        await msg.answer("Нужен файл .csv или .xlsx.", reply_markup=kb_back())
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await msg.answer("Файл больше 20 МБ, разбейте его на части.", reply_markup=kb_back())
+        return
 
-async def list_user_cars(msg: types.Message, state: FSMContext):
     db = SessionLocal()
-    user = db.query(User).filter(User.telegram_id == msg.from_user.id).first()
+    try:
+        user = db.query(User).filter(User.telegram_id == msg.from_user.id).first()
+    finally:
+        db.close()
     if not user:
         await msg.answer("Зарегистрируйтесь (/start).")
+        await state.finish()
         return
-    cars = db.query(Car).filter(Car.owner_id == user.id).all()
-    db.close()
-    if not cars:
-        await msg.answer("Нет авто.")
+
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        await document.download(destination_file=path)
+        await msg.answer("⏳ Импортируем автопарк...")
+        # Разбор файла и вставка в БД — в потоке, чтобы не блокировать бота
+        report = await run_counted(import_fleet, path, user.id)
+    except Exception as e:
+        logger.error(f"Fleet import error: {e}")
+        await msg.answer("Ошибка при импорте файла.")
+        await state.finish()
+        return
+    finally:
+        os.remove(path)
+
+    for city_id, count in report.city_counts.items():
+        city_directory.change(city_id, count)
+    if report.imported:
+        inline_index.add_rows(await run_counted(owner_car_rows, user.id))
+        schedule_match(owner_id=user.id)
+    logger.info(f"Fleet import: user={user.id}, imported={report.imported}, errors={len(report.errors)}")
+
+    await msg.answer(f"✅ Импортировано авто: {report.imported}\nОшибок: {len(report.errors)}")
+    if report.errors:
+        await msg.answer_document(
+            InputFile(io.BytesIO(report.errors_csv()), filename="import_errors.csv"),
+            caption="Строки с ошибками"
+        )
+    await state.finish()
+
+
+# ===== Выгрузка истории для бухгалтерии =====
+async def export_history(msg: types.Message, state: FSMContext):
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.telegram_id == msg.chat.id).first()
+    finally:
+        db.close()
+    if not user:
+        await msg.answer("Зарегистрируйтесь (/start).")
         return
 
+    fd, path = tempfile.mkstemp(suffix=".csv.gz")
+    os.close(fd)
+    try:
+        await msg.answer("⏳ Готовим выгрузку...")
+        rows = await run_counted(export_owner_history, user.id, path, msg.chat.id)
+        if not rows:
+            await msg.answer("По вашим авто ещё нет бронирований.")
+            return
+        await msg.answer_document(
+            InputFile(path, filename=f"history_{date.today():%Y-%m-%d}.csv.gz"),
+            caption=f"📤 Бронирования и платежи: {rows} строк"
+        )
+    except Exception as e:
+        logger.error(f"History export error: {e}")
+        await msg.answer("Ошибка при выгрузке истории.")
+    finally:
+        os.remove(path)
+
+
+# ===== Редактирование и удаление =====
+
+def my_cars_page(stats: list, page: int, owner_id: int):
+    """Текст и клавиатура страницы «Моих автомобилей» со сводкой по всему автопарку."""
+    pages = max((len(stats) + MY_CARS_PAGE_SIZE - 1) // MY_CARS_PAGE_SIZE, 1)
+    page = min(max(page, 0), pages - 1)
+    chunk = stats[page * MY_CARS_PAGE_SIZE:(page + 1) * MY_CARS_PAGE_SIZE]
+
+    total_revenue = sum(s.revenue for s in stats)
+    total_bookings = sum(s.bookings for s in stats)
+    occupancy = sum(s.occupancy for s in stats) / len(stats)
+    lines = [
+        f"📋 Ваши авто: {len(stats)}",
+        f"📅 Бронирований: {total_bookings} · загрузка на {OCCUPANCY_DAYS} дн.: {occupancy:.0%}",
+        f"💶 Выручка: {total_revenue:.2f} €",
+        "",
+    ]
+    # Подписка на бронирования всех авто в Google/Apple Calendar
+    calendar = feed_url("owners", owner_id)
+    if calendar:
+        lines.insert(-1, f"📆 Календарь бронирований (iCal): {calendar}")
     markup = InlineKeyboardMarkup()
-    for car in cars:
+    for s in chunk:
+        rating = f"⭐ {s.rating:.1f} ({s.reviews})" if s.rating else "⭐ —"
+        lines.append(
+            f"{'✅' if s.available else '⛔'} {s.brand} {s.model} ({s.year})\n"
+            f"    📅 {s.bookings} · {s.occupancy:.0%} · 💶 {s.revenue:.2f} € · {rating}"
+        )
         markup.add(InlineKeyboardButton(
-            f"{car.brand} {car.model} ({car.year})",
-            callback_data=f"edit_select:{car.id}"
+            f"✏️ {s.brand} {s.model} ({s.year})",
+            callback_data=f"edit_select:{s.id}"
         ))
+    if pages > 1:
+        lines.append(f"\nСтраница {page + 1} из {pages}")
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️", callback_data=f"mycars:{page - 1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("▶️", callback_data=f"mycars:{page + 1}"))
+        markup.row(*nav)
     markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="cancel"))
-    await msg.answer("Выберите авто для редактирования:", reply_markup=markup)
+    return "\n".join(lines), markup
+
+
+def load_my_cars(telegram_id: int):
+    db = read_session()
+    try:
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        if not user:
+            return None, None
+        return user.id, owner_car_stats(db, user.id)
+    finally:
+        db.close()
+
+
+@query_budget(2)
+async def list_user_cars(msg: types.Message, state: FSMContext):
+    owner_id, stats = load_my_cars(msg.chat.id)
+    if stats is None:
+        await msg.answer("Зарегистрируйтесь (/start).")
+        return
+    if not stats:
+        await msg.answer("Нет авто.")
+        return
+
+    text, markup = my_cars_page(stats, 0, owner_id)
+    await msg.answer(text, reply_markup=markup, disable_web_page_preview=True)
     await EditCarFSM.choose_car.set()
 
 
+@query_budget(2)
+async def my_cars_navigate(callback: CallbackQuery, state: FSMContext):
+    page = int(callback.data.split(":")[1])
+    owner_id, stats = load_my_cars(callback.from_user.id)
+    await callback.answer()
+    if not stats:
+        return
+    text, markup = my_cars_page(stats, page, owner_id)
+    await callback.message.edit_text(text, reply_markup=markup, disable_web_page_preview=True)
+
+
 async def select_car_edit(callback: CallbackQuery, state: FSMContext):
     car_id = int(callback.data.split(":")[1])
     await state.update_data(edit_car_id=car_id)
@@ -245,7 +438,14 @@ async def select_car_edit(callback: CallbackQuery, state: FSMContext):
     for f in fields:
         markup.insert(InlineKeyboardButton(f, callback_data=f"field:{f}"))
     markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="cancel"))
-    await callback.message.edit_text("Что изменить?", reply_markup=markup)
+    # Ссылку можно разместить в своём канале: она открывает бронирование этого авто
+    link = await get_start_link(car_link_payload(car_id))
+    text = f"🔗 Ссылка для бронирования: {link}"
+    calendar = feed_url("cars", car_id)
+    if calendar:
+        text += f"\n📆 Календарь авто (iCal): {calendar}"
+    await callback.message.edit_text(f"{text}\n\nЧто изменить?",
+                                     reply_markup=markup, disable_web_page_preview=True)
     await EditCarFSM.choose_field.set()
 
 
@@ -290,9 +490,16 @@ async def update_value(msg: types.Message, state: FSMContext):
     val = msg.text
     try:
         if field == "Год":
-            val = int(val)
-        elif field in ("Цена", "Скидка"):
-            val = float(val.replace(",", "."))
+            val = parse_year(val)
+        elif field == "Цена":
+            val = parse_price(val)
+        elif field == "Скидка":
+            val = parse_discount(val)
+        elif field == "Город":
+            old_city_id = car.city_id
+            city = city_directory.resolve(db, val)
+            val = city.name
+            car.city_id = city.id
         setattr(car, {"Марка": "brand",
                       "Модель": "model",
                       "Год": "year",
@@ -302,6 +509,13 @@ async def update_value(msg: types.Message, state: FSMContext):
                       "Город": "city"}
         [field], val)
         db.commit()
+        if field == "Город" and car.available and old_city_id != car.city_id:
+            city_directory.change(old_city_id, -1)
+            city_directory.change(car.city_id, 1)
+        inline_index.upsert(car)
+        # Авто подешевело или переехало — может подойти ждущим в листе ожидания
+        if field in ("Цена", "Город"):
+            schedule_match(car_ids=[car.id])
         await msg.answer("✅ Обновлено.", reply_markup=main_menu_kb())
     except Exception as e:
         logger.error(e)
@@ -327,11 +541,13 @@ async def edit_upload_photo(msg: types.Message, state: FSMContext):
     if msg.photo:
         car.photo_file_id = msg.photo[-1].file_id
         db.commit()
+        inline_index.upsert(car)
         await msg.answer("✅ Фото обновлено.", reply_markup=main_menu_kb())
 
     elif msg.text.lower() == "пропустить":
         car.photo_file_id = None
         db.commit()
+        inline_index.upsert(car)
         await msg.answer("✅ Фото удалено.", reply_markup=main_menu_kb())
 
     else:
@@ -349,8 +565,13 @@ async def confirm_delete_car(callback: CallbackQuery, state: FSMContext):
     db = SessionLocal()
     car = db.query(Car).filter(Car.id == car_id).first()
     if callback.data == "confirm_yes" and car:
+        city_id, was_available = car.city_id, car.available
         db.delete(car)
         db.commit()
+        if was_available:
+            city_directory.change(city_id, -1)
+        booked_days.drop(car_id)
+        inline_index.remove(car_id)
         await callback.message.edit_text("Удалено 👍")
     else:
         await callback.message.edit_text("Удаление отменено.")
@@ -383,7 +604,13 @@ def register_cars_handlers(dp: Dispatcher):
 
     dp.register_callback_query_handler(select_car_edit, lambda c: c.data.startswith("edit_select:"),
                                        state=EditCarFSM.choose_car)
+    dp.register_callback_query_handler(my_cars_navigate, lambda c: c.data.startswith("mycars:"),
+                                       state=EditCarFSM.choose_car)
     dp.register_callback_query_handler(choose_field, state=EditCarFSM.choose_field)
     dp.register_message_handler(update_value, state=EditCarFSM.enter_value)
     dp.register_message_handler(edit_upload_photo, content_types=["photo", "text"], state=EditCarFSM.upload_photo)
     dp.register_callback_query_handler(confirm_delete_car, state=EditCarFSM.confirm_delete)
+
+    dp.register_message_handler(import_fleet_start, commands=["import_cars"], state="*")
+    dp.register_message_handler(export_history, commands=["export"], state="*")
+    dp.register_message_handler(import_fleet_file, content_types=["document"], state=FleetImportFSM.waiting_for_file)
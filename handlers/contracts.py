@@ -1,4 +1,7 @@
-﻿import os
+﻿import asyncio
+import io
+import time
+
 from jinja2 import Environment, FileSystemLoader
 from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
@@ -11,6 +14,10 @@ from models.booking import Booking, BookingStatus
 from models.contract import Contract
 from models.user import User
 from loguru import logger
+from config import CONTRACT_LINK_TTL
+from services.contract_store import contract_store, contract_link
+from services.metrics import metrics
+
 
 # Jinja2 шаблоны
 env = Environment(loader=FileSystemLoader('templates'))
@@ -76,45 +83,72 @@ async def start_contract(message: types.Message, state: FSMContext):
 async def select_booking_callback(callback: types.CallbackQuery, state: FSMContext):
     booking_id_str = callback.data.replace("select_booking_", "")
     if not booking_id_str.isdigit():
-        await callback.answer("Неверный формат.")
+        await callback.message.answer("Неверный формат.")
         return
 
     booking_id = int(booking_id_str)
     data = await state.get_data()
     bookings_map = data.get("bookings_map", {})
-    booking = bookings_map.get(booking_id)
-    if not booking:
-        await callback.answer("Бронирование не найдено.")
+    if booking_id not in bookings_map:
+        await callback.message.answer("Бронирование не найдено.")
         return
 
     db = SessionLocal()
     try:
+        # В FSM лежит копия без сессии — арендатора и авто для шаблона загружаем заново
+        booking = db.query(Booking).options(joinedload(Booking.renter), joinedload(Booking.car)) \
+            .filter(Booking.id == booking_id).first()
+        contract = db.query(Contract).filter(
+            Contract.booking_id == booking.id, Contract.signed == False
+        ).first()
+        if not contract:
+            contract = Contract(booking_id=booking.id, signed=False)
+            db.add(contract)
+
         template = env.get_template("contract_template.html")
 
         contract_text = template.render(
             booking=booking,
             user=booking.renter,
-            car=booking.car
+            car=booking.car,
+            contract=contract
         )
+        content = contract_text.encode("utf-8")
+
+        # Договор адресуется хэшем содержимого: повторная генерация того же договора
+        # не пишет файл заново, а уже загруженный в Telegram отправляется по file_id
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(None, contract_store.put, content)
+
+        if contract.content_hash != key:
+            contract.content_hash = key
+            contract.telegram_file_id = db.query(Contract.telegram_file_id).filter(
+                Contract.content_hash == key, Contract.telegram_file_id != None
+            ).limit(1).scalar()
+        db.commit()
 
-        os.makedirs("contracts", exist_ok=True)
-        contract_path = f"contracts/contract_{booking.id}.html"
-        with open(contract_path, "w", encoding="utf-8") as f:
-            f.write(contract_text)
+        caption = "Подписать контракт?"
+        expires = int(time.time()) + CONTRACT_LINK_TTL
+        link = contract_link(key, expires)
+        if link:
+            caption += f"\n\n🔗 Скачать: {link}"
 
-        new_contract = Contract(
-            booking_id=booking.id,
-            contract_pdf_path=contract_path,
-            signed=False
-        )
-        db.add(new_contract)
-        db.commit()
+        await callback.message.edit_text(f"📄 Договор по бронированию #{booking.id}:")
+        if contract.telegram_file_id:
+            await callback.message.answer_document(
+                contract.telegram_file_id, caption=caption, reply_markup=confirm_signature_kb()
+            )
+            metrics.inc("contract_sent", source="file_id")
+        else:
+            sent = await callback.message.answer_document(
+                types.InputFile(io.BytesIO(content), filename=f"contract_{booking.id}.html"),
+                caption=caption, reply_markup=confirm_signature_kb()
+            )
+            metrics.inc("contract_sent", source="upload")
+            contract.telegram_file_id = sent.document.file_id
+            db.commit()
 
-        await state.update_data(selected_booking_id=booking.id, contract_path=contract_path)
-        await callback.message.edit_text(
-            "Контракт сгенерирован. Подписать контракт?",
-            reply_markup=confirm_signature_kb()
-        )
+        await state.update_data(selected_booking_id=booking.id)
         await ContractStates.CONFIRM_SIGNATURE.set()
     except Exception as e:
         logger.error(f"Ошибка при генерации контракта: {e}")
@@ -127,10 +161,10 @@ async def select_booking_callback(callback: types.CallbackQuery, state: FSMConte
 
 # Подтверждение подписи
 async def confirm_signature_callback(callback: types.CallbackQuery, state: FSMContext):
-    from handlers.menu import main_menu_kb
+    from handlers.menu import main_menu_kb, edit_message
 
     if callback.data in ["sign_no", "cancel_contract"]:
-        await callback.message.edit_text("Операция отменена.", reply_markup=main_menu_kb())
+        await edit_message(callback.message, "Операция отменена.", reply_markup=main_menu_kb())
         await state.finish()
         await callback.answer()
         return
@@ -142,7 +176,7 @@ async def confirm_signature_callback(callback: types.CallbackQuery, state: FSMCo
     data = await state.get_data()
     booking_id = data.get("selected_booking_id")
     if not booking_id:
-        await callback.message.edit_text("Ошибка: данные бронирования не найдены.")
+        await edit_message(callback.message, "Ошибка: данные бронирования не найдены.")
         await state.finish()
         await callback.answer()
         return
@@ -151,21 +185,23 @@ async def confirm_signature_callback(callback: types.CallbackQuery, state: FSMCo
     try:
         booking = db.query(Booking).filter(Booking.id == booking_id).first()
         if not booking:
-            await callback.message.edit_text("Бронирование не найдено.")
+            await edit_message(callback.message, "Бронирование не найдено.")
             await state.finish()
             return
 
         booking.contract_signed = True
-        contract = db.query(Contract).filter(Contract.booking_id == booking.id).first()
+        contract = db.query(Contract).filter(
+            Contract.booking_id == booking.id, Contract.signed == False
+        ).first()
         if contract:
             contract.signed = True
 
         db.commit()
-        await callback.message.edit_text("✅ Контракт подписан успешно!", reply_markup=main_menu_kb())
+        await edit_message(callback.message, "✅ Контракт подписан успешно!", reply_markup=main_menu_kb())
         logger.info(f"User {booking.renter_id} подписал контракт #{booking.id}")
     except Exception as e:
         logger.error(f"Ошибка при подписании контракта: {e}")
-        await callback.message.edit_text("Произошла ошибка при подписании контракта.")
+        await edit_message(callback.message, "Произошла ошибка при подписании контракта.")
     finally:
         db.close()
         await state.finish()
@@ -221,7 +257,7 @@ async def confirm_cancel_contract(callback: types.CallbackQuery, state: FSMConte
 
     contract_id_str = callback.data.replace("cancel_contract_", "")
     if not contract_id_str.isdigit():
-        await callback.answer("Неверный формат.")
+        await callback.message.answer("Неверный формат.")
         return
 
     contract_id = int(contract_id_str)
@@ -0,0 +1,50 @@
+﻿from aiogram import types, Dispatcher
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InlineQueryResultCachedPhoto,
+    InputTextMessageContent
+)
+from aiogram.utils.deep_linking import get_start_link
+
+from config import INLINE_CACHE_TIME
+from handlers.bookings import car_link_payload
+from services.inline_search import inline_index
+
+# Telegram принимает не больше 50 результатов за ответ
+INLINE_PAGE_SIZE = 20
+
+
+def car_card(car) -> str:
+    price = f"{car.price_per_day:.0f} €/сутки"
+    if car.discount:
+        price += f" (скидка {car.discount:.0f}%)"
+    return f"🚗 {car.brand} {car.model} ({car.year})\n📍 {car.city}\n💶 {price}"
+
+
+# @bot <запрос> в любом чате: авто из индекса в памяти, без запросов к БД
+async def inline_search(query: types.InlineQuery):
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    cars, next_offset = inline_index.search(query.query, offset, INLINE_PAGE_SIZE)
+
+    results = []
+    for car in cars:
+        link = await get_start_link(car_link_payload(car.id))
+        markup = InlineKeyboardMarkup().add(InlineKeyboardButton("📅 Забронировать", url=link))
+        if car.photo_file_id:
+            # Фото уже лежит у Telegram — отдаём file_id, без повторной загрузки
+            results.append(InlineQueryResultCachedPhoto(
+                id=str(car.id), photo_file_id=car.photo_file_id,
+                title=f"{car.brand} {car.model}", caption=car_card(car), reply_markup=markup
+            ))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=str(car.id), title=f"{car.brand} {car.model} ({car.year})",
+                description=f"{car.city} · {car.price_per_day:.0f} €/сутки",
+                input_message_content=InputTextMessageContent(car_card(car)), reply_markup=markup
+            ))
+
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False,
+                       next_offset=str(next_offset) if next_offset else "")
+
+
+def register_inline_handlers(dp: Dispatcher):
+    dp.register_inline_handler(inline_search, state="*")
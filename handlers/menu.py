@@ -4,19 +4,21 @@ from aiogram.dispatcher.filters.state import StatesGroup, State
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from sqlalchemy import func
 
-from database import SessionLocal
+from database import SessionLocal, read_session
 from handlers import cars
-from handlers.bookings import start_booking
+from handlers.bookings import start_booking, parse_car_link, open_car_booking
 from handlers.registration import start_registration
+from keyboards.inline import search_results_kb, cancel_kb
 from handlers.contracts import start_contract, cancel_contract_callback
-from models.car import Car
-from models.payment import Payment, PaymentStatus
+from models.payment import Payment, PaymentStatus, PaymentMethod
 from models.user import User
+from services.car_text_search import search_cars_ranked
 
 
 # FSM для подтверждений
 class MenuFSM(StatesGroup):
     waiting_for_confirmation = State()
+    catalog_query = State()
 
 
 # Главное меню
@@ -27,6 +29,9 @@ def main_menu_kb():
         InlineKeyboardButton("📅 Забронировать авто", callback_data="cmd_book"),
         InlineKeyboardButton("🚗 Сдать авто в аренду", callback_data="cmd_add_car"),
         InlineKeyboardButton("📋 Мои автомобили", callback_data="cmd_my_cars"),
+        InlineKeyboardButton("📦 Импорт автопарка", callback_data="cmd_import_cars"),
+        InlineKeyboardButton("📤 Выгрузка истории", callback_data="cmd_export"),
+        InlineKeyboardButton("📈 Графики", callback_data="cmd_charts"),
         InlineKeyboardButton("📄 Договоры", callback_data="submenu_contracts"),
         InlineKeyboardButton("💳 Оплата", callback_data="submenu_payments"),
         InlineKeyboardButton("📝 Оставить отзыв", callback_data="cmd_review"),
@@ -56,11 +61,12 @@ def payments_menu_kb():
     return kb
 
 
-# Проверка регистрации пользователя
+# Проверка регистрации пользователя. Сюда приходит и сообщение бота из callback'а,
+# поэтому пользователя определяем по чату, а не по автору сообщения
 async def require_registration(message: types.Message):
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.telegram_id == message.from_user.id, User.registered == True).first()
+        user = db.query(User).filter(User.telegram_id == message.chat.id, User.registered == True).first()
         return user is not None
     finally:
         db.close()
@@ -71,8 +77,8 @@ async def process_menu_callbacks(callback: types.CallbackQuery, state: FSMContex
     data = callback.data
 
     if data == "cmd_catalog":
-        await callback.message.delete()
-        await show_catalog(callback.message)
+        await state.update_data(catalog_query="")
+        await show_catalog(callback.message, state, edit=True)
         await callback.answer()
         return
 
@@ -89,8 +95,7 @@ async def process_menu_callbacks(callback: types.CallbackQuery, state: FSMContex
             await state.update_data(return_to="booking")
             await start_registration(callback.message, state)
             return
-        await callback.message.delete()
-        await start_booking(callback.message, state)
+        await start_booking(callback.message, state, edit=True)
         await callback.answer()
         return
 
@@ -101,8 +106,7 @@ async def process_menu_callbacks(callback: types.CallbackQuery, state: FSMContex
             await state.update_data(return_to="add_car")
             await start_registration(callback.message, state)
             return
-        await callback.message.delete()
-        await cars.add_car_start(callback.message, state)
+        await cars.add_car_start(callback.message, state, edit=True)
         await callback.answer()
         return
 
@@ -118,6 +122,21 @@ async def process_menu_callbacks(callback: types.CallbackQuery, state: FSMContex
         await callback.answer()
         return
 
+    if data == "cmd_import_cars":
+        if not await require_registration(callback.message):
+            await callback.message.answer("⚠️ Для импорта автопарка необходимо зарегистрироваться.")
+            await start_registration(callback.message, state)
+            return
+        await callback.message.delete()
+        await cars.import_fleet_start(callback.message, state)
+        await callback.answer()
+        return
+
+    if data == "cmd_export":
+        await callback.answer()
+        await cars.export_history(callback.message, state)
+        return
+
     if data == "cmd_contract":
         await callback.message.delete()
         await start_contract(callback.message, state)
@@ -146,7 +165,14 @@ async def process_menu_callbacks(callback: types.CallbackQuery, state: FSMContex
         await callback.answer()
         return
 
-    await callback.answer("Неизвестная команда.", show_alert=True)
+    await callback.message.answer("Неизвестная команда.")
+
+
+# Подтверждение оплаты приходит и с фото QR-кода: у фото меняем подпись, а не текст
+async def edit_message(message: types.Message, text: str, reply_markup=None):
+    if message.photo or message.document:
+        return await message.edit_caption(text, reply_markup=reply_markup)
+    return await message.edit_text(text, reply_markup=reply_markup)
 
 
 # Подтверждение оплаты или отмены
@@ -155,42 +181,68 @@ async def confirmation_handler(callback: types.CallbackQuery, state: FSMContext)
 
     if data.startswith("pay_confirm_"):
         payment_id = int(data.split("_")[-1])
-        await callback.message.edit_text("Обрабатываем оплату...")
         await process_payment(callback, payment_id)
         await state.finish()
 
     elif data == "pay_decline":
-        await callback.message.edit_text("Оплата отменена.", reply_markup=main_menu_kb())
+        await edit_message(callback.message, "Оплата отменена.", reply_markup=main_menu_kb())
         await state.finish()
 
     elif data.startswith("pay_cancel_confirm_"):
         payment_id = int(data.split("_")[-1])
-        await callback.message.edit_text("Обрабатываем отмену оплаты...")
         await process_payment_cancellation(callback, payment_id)
         await state.finish()
 
     elif data == "pay_cancel_decline":
-        await callback.message.edit_text("Отмена оплаты отменена.", reply_markup=main_menu_kb())
+        await edit_message(callback.message, "Отмена оплаты отменена.", reply_markup=main_menu_kb())
         await state.finish()
 
     else:
         await callback.answer()
 
 
-# Показ каталога автомобилей
-async def show_catalog(message: types.Message):
-    db = SessionLocal()
-    cars_list = db.query(Car).all()
-    db.close()
+# Показ каталога автомобилей: страница поиска, без запроса — все авто по цене
+async def show_catalog(message: types.Message, state: FSMContext, edit: bool = False, page: int = 0):
+    query = (await state.get_data()).get("catalog_query", "")
+    db = read_session()
+    try:
+        cars, has_next = search_cars_ranked(db, query, page)
+    finally:
+        db.close()
 
-    if not cars_list:
-        await message.answer("В каталоге нет автомобилей.", reply_markup=main_menu_kb())
+    send = message.edit_text if edit else message.answer
+    if not cars and not query:
+        await send("В каталоге нет автомобилей.", reply_markup=main_menu_kb())
         return
 
-    msg = "🚗 Каталог автомобилей:\n\n"
-    for car in cars_list:
-        msg += f"ID: {car.id} | {car.model} | Цена: {car.price_per_day:.2f} EUR/день\n"
-    await message.answer(msg, reply_markup=main_menu_kb())
+    extra = [InlineKeyboardButton("🔍 Поиск", callback_data="catalog:search")]
+    if query:
+        extra.append(InlineKeyboardButton("♻️ Весь каталог", callback_data="catalog:reset"))
+    text = f"🚗 Каталог автомобилей, поиск «{query}»:" if query else "🚗 Каталог автомобилей:"
+    if not cars:
+        text += "\n\nНичего не найдено."
+    await send(text, reply_markup=search_results_kb(cars, page, has_next, "catalog", extra))
+
+
+async def catalog_callback(callback: types.CallbackQuery, state: FSMContext):
+    action, _, value = callback.data.split(":", 1)[1].partition(":")
+    await callback.answer()
+    if action == "search":
+        await callback.message.edit_text("Введите марку, модель или город:", reply_markup=cancel_kb())
+        await MenuFSM.catalog_query.set()
+    elif action == "reset":
+        await state.update_data(catalog_query="")
+        await show_catalog(callback.message, state, edit=True)
+    elif action == "page":
+        await show_catalog(callback.message, state, edit=True, page=int(value))
+    elif action == "car":
+        await book_car(callback.message, state, int(value))
+
+
+async def catalog_query(message: types.Message, state: FSMContext):
+    await state.update_data(catalog_query=message.text.strip())
+    await state.reset_state(with_data=False)
+    await show_catalog(message, state)
 
 
 # Обработка оплаты
@@ -199,15 +251,23 @@ async def process_payment(callback: types.CallbackQuery, payment_id: int):
     try:
         payment = db.query(Payment).filter(Payment.id == payment_id).first()
         if not payment:
-            await callback.message.edit_text("Платеж не найден.", reply_markup=main_menu_kb())
+            await edit_message(callback.message, "Платеж не найден.", reply_markup=main_menu_kb())
             return
         if payment.status == PaymentStatus.COMPLETED:
-            await callback.message.edit_text("Платеж уже оплачен.", reply_markup=main_menu_kb())
+            await edit_message(callback.message, "Платеж уже оплачен.", reply_markup=main_menu_kb())
+            return
+        # Оплату через FreeKassa подтверждает только её callback, уведомление придёт само
+        if payment.method == PaymentMethod.FREEKASSA:
+            await edit_message(
+                callback.message,
+                "Оплата ещё не поступила. Мы пришлём сообщение, как только FreeKassa её подтвердит.",
+                reply_markup=main_menu_kb()
+            )
             return
 
         payment.status = PaymentStatus.COMPLETED
         db.commit()
-        await callback.message.edit_text("Оплата успешно подтверждена!", reply_markup=main_menu_kb())
+        await edit_message(callback.message, "Оплата успешно подтверждена!", reply_markup=main_menu_kb())
     finally:
         db.close()
     await callback.answer()
@@ -219,35 +279,56 @@ async def process_payment_cancellation(callback: types.CallbackQuery, payment_id
     try:
         payment = db.query(Payment).filter(Payment.id == payment_id).first()
         if not payment:
-            await callback.message.edit_text("Платеж не найден.", reply_markup=main_menu_kb())
+            await edit_message(callback.message, "Платеж не найден.", reply_markup=main_menu_kb())
             return
         if payment.status == PaymentStatus.CANCELLED:
-            await callback.message.edit_text("Платеж уже отменён.", reply_markup=main_menu_kb())
+            await edit_message(callback.message, "Платеж уже отменён.", reply_markup=main_menu_kb())
             return
 
         payment.status = PaymentStatus.CANCELLED
         db.commit()
-        await callback.message.edit_text("Оплата успешно отменена.", reply_markup=main_menu_kb())
+        await edit_message(callback.message, "Оплата успешно отменена.", reply_markup=main_menu_kb())
     finally:
         db.close()
     await callback.answer()
 
 
 # Команды /start и /menu
-async def start_command(message: types.Message):
-    await message.answer("Добро пожаловать! Главное меню:", reply_markup=main_menu_kb())
+# Бронирование выбранного авто (из каталога или по ссылке), с регистрацией при необходимости
+async def book_car(message: types.Message, state: FSMContext, car_id: int, date_from=None, date_to=None):
+    await state.finish()
+    if not await require_registration(message):
+        await state.update_data(selected_car_id=car_id, link_date_from=date_from, link_date_to=date_to,
+                                return_to="booking_car_selected")
+        await message.answer("⚠️ Для бронирования необходимо зарегистрироваться.")
+        await start_registration(message, state)
+        return
+    await open_car_booking(message, state, car_id, date_from, date_to)
+
+
+async def start_command(message: types.Message, state: FSMContext):
+    link = parse_car_link(message.get_args())
+    if not link:
+        await message.answer("Добро пожаловать! Главное меню:", reply_markup=main_menu_kb())
+        return
+    # Ссылка на конкретное авто из канала владельца — сразу в бронирование
+    await book_car(message, state, *link)
 
 
 async def menu_command(message: types.Message):
     await message.answer("Главное меню:", reply_markup=main_menu_kb())
 
 
-# Регистрация хендлеров
-def register_menu_handlers(dp: Dispatcher):
+# Команды регистрируются раньше остальных хендлеров: иначе в середине сценария
+# их перехватит хендлер текущего состояния FSM (например, ввод даты)
+def register_menu_commands(dp: Dispatcher):
     dp.register_message_handler(start_command, commands=["start"], state="*")
     dp.register_message_handler(menu_command, commands=["menu"], state="*")
-    dp.register_callback_query_handler(process_menu_callbacks, state="*")
-    # Ловим только кнопки оплат из инлайнов
+
+
+# Регистрация хендлеров
+def register_menu_handlers(dp: Dispatcher):
+    # Ловим только кнопки оплат из инлайнов; до общего обработчика меню, иначе он их перехватит
     dp.register_callback_query_handler(
         confirmation_handler,
         lambda c: c.data.startswith("pay_confirm_")
@@ -255,4 +336,7 @@ def register_menu_handlers(dp: Dispatcher):
                   or c.data.startswith("pay_cancel_confirm_")
                   or c.data == "pay_cancel_decline",
         state="*"
-    )
\ No newline at end of file
+    )
+    dp.register_callback_query_handler(catalog_callback, lambda c: c.data.startswith("catalog:"), state="*")
+    dp.register_message_handler(catalog_query, state=MenuFSM.catalog_query)
+    dp.register_callback_query_handler(process_menu_callbacks, state="*")
\ No newline at end of file
@@ -7,12 +7,14 @@ from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+from sqlalchemy.orm import joinedload
 
 from keyboards.inline import payment_confirmation_kb
 from models.payment import Payment, PaymentStatus, PaymentMethod
 from models.booking import Booking, BookingStatus
 from models.user import User
 from database import SessionLocal
+from services.sql_accounting import query_budget
 
 from config import FREEKASSA_MERCHANT_ID, FREEKASSA_SECRET_1, NBS_PRIMALAC, NBS_BROJ_RACUNA
 from handlers.menu import main_menu_kb
@@ -68,6 +70,7 @@ def create_freekassa_payment_link(booking: Booking, payment_id: int):
 
 
 # ⬇️ Хендлер запуска через inline-кнопку
+@query_budget(2)
 async def start_payment_handler(callback: types.CallbackQuery, state: FSMContext):
     db = SessionLocal()
     try:
@@ -77,7 +80,7 @@ async def start_payment_handler(callback: types.CallbackQuery, state: FSMContext
             await state.finish()
             return
 
-        bookings = db.query(Booking).filter(
+        bookings = db.query(Booking).options(joinedload(Booking.car)).filter(
             Booking.renter_id == user.id,
             Booking.status == BookingStatus.CONFIRMED
         ).all()
@@ -147,15 +150,13 @@ async def select_method_handler(callback: types.CallbackQuery, state: FSMContext
             payment, booking = create_payment(db, booking_id, method)
             url = create_freekassa_payment_link(booking, payment.id)
 
-            keyboard = InlineKeyboardMarkup().add(
-                InlineKeyboardButton("Перейти к оплате", url=url)
-            )
-            await callback.message.edit_text("Нажмите кнопку ниже для перехода к оплате:", reply_markup=keyboard)
-
-            confirm_kb = payment_confirmation_kb(payment.id)
-            await callback.message.answer(
-                f"Платеж #{payment.id} на сумму {payment.amount:.2f} EUR. Подтвердите оплату или отмените.",
-                reply_markup=confirm_kb
+            # Ссылка на оплату и подтверждение — одним сообщением
+            keyboard = payment_confirmation_kb(payment.id)
+            keyboard.inline_keyboard.insert(0, [InlineKeyboardButton("Перейти к оплате", url=url)])
+            await callback.message.edit_text(
+                f"Платеж #{payment.id} на сумму {payment.amount:.2f} EUR.\n"
+                "Нажмите кнопку ниже для перехода к оплате, затем подтвердите оплату или отмените.",
+                reply_markup=keyboard
             )
 
 
@@ -164,21 +165,17 @@ async def select_method_handler(callback: types.CallbackQuery, state: FSMContext
             payment, booking = create_payment(db, booking_id, method)
             qr_image = generate_nbs_qr(booking)
 
+            # QR-код и подтверждение — одним сообщением вместо фото и отдельного текста
             photo = InputFile(qr_image, filename="qr.png")
             await callback.bot.send_photo(
                 callback.from_user.id,
                 photo=photo,
-                caption=f"Отсканируйте QR-код для оплаты аренды {booking.car.model} с {booking.date_from} по {booking.date_to}.",
-                reply_markup=main_menu_kb()
+                caption=f"Отсканируйте QR-код для оплаты аренды {booking.car.model} с {booking.date_from} по {booking.date_to}.\n"
+                        f"Платеж #{payment.id} на сумму {payment.amount:.2f} EUR. Подтвердите оплату или отмените.",
+                reply_markup=payment_confirmation_kb(payment.id)
             )
             await callback.message.delete()
 
-            confirm_kb = payment_confirmation_kb(payment.id)
-            await callback.message.answer(
-                f"Платеж #{payment.id} на сумму {payment.amount:.2f} EUR. Подтвердите оплату или отмените.",
-                reply_markup=confirm_kb
-            )
-
         else:
             await callback.answer()
             return
@@ -4,7 +4,6 @@ from aiogram.dispatcher.filters.state import State, StatesGroup
 from database import SessionLocal
 from keyboards.inline import user_type_keyboard, cancel_keyboard
 from models.user import User, UserType
-from models.car import Car
 from loguru import logger
 import re
 
@@ -174,27 +173,13 @@ async def continue_after_registration(message: types.Message, state: FSMContext)
     return_to = state_data.get('return_to')
 
     if return_to == "booking_car_selected":
-        # Восстанавливаем данные бронирования
-        from handlers.bookings import BookingFSM
-        from keyboards.inline import date_from_kb
-
-        car_id = state_data.get("selected_car_id")
-        db = SessionLocal()
-        try:
-            car = db.query(Car).filter(Car.id == car_id).first()
-            if car and car.photo_file_id:
-                await message.answer_photo(
-                    photo=car.photo_file_id,
-                    caption=f"{car.brand} {car.model} ({car.year})"
-                )
-
-            await message.answer(
-                "Отлично! Теперь укажите дату начала аренды (ДД.ММ.ГГГГ):",
-                reply_markup=date_from_kb()
-            )
-            await BookingFSM.select_date_from.set()
-        finally:
-            db.close()
+        # Восстанавливаем данные бронирования (в т.ч. даты из deep link)
+        from handlers.bookings import open_car_booking
+
+        await open_car_booking(
+            message, state, state_data.get("selected_car_id"),
+            state_data.get("link_date_from"), state_data.get("link_date_to")
+        )
     else:
         # Если нет специального маркера, просто показываем главное меню
         await message.answer("✅ Регистрация завершена!", reply_markup=main_menu_kb())
@@ -221,4 +206,3 @@ def register_registration_handlers(dp: Dispatcher):
     dp.register_message_handler(get_phone_handler, state=RegistrationFSM.get_phone)
     dp.register_message_handler(get_inn_handler, state=RegistrationFSM.get_inn)
     dp.register_message_handler(get_contact_person_handler, state=RegistrationFSM.get_contact_person)
-    dp.register_message_handler(continue_after_registration, state="*")
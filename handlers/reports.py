@@ -0,0 +1,84 @@
+﻿from io import BytesIO
+
+from aiogram import types, Dispatcher
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+from loguru import logger
+
+from database import read_session
+from middlewares.callback_ack import answers_callback
+from models.user import User
+from services.charts import chart_cache, chart_renderer, data_version, week_starts, weekly_aggregates
+from services.metrics import metrics
+
+# Доступные периоды графиков, в неделях
+CHART_PERIODS = (4, 12, 26)
+
+
+def chart_periods_kb():
+    kb = InlineKeyboardMarkup(row_width=3)
+    kb.add(*[InlineKeyboardButton(f"{weeks} нед.", callback_data=f"charts:{weeks}") for weeks in CHART_PERIODS])
+    kb.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_main"))
+    return kb
+
+
+# ⬇️ Выбор периода
+async def charts_start(msg: types.Message):
+    await msg.answer("📈 Выручка и загрузка ваших авто. Выберите период:", reply_markup=chart_periods_kb())
+
+
+async def charts_menu_callback(callback: types.CallbackQuery):
+    await callback.answer()
+    await charts_start(callback.message)
+
+
+# ⬇️ Отправка графика
+@answers_callback
+async def send_chart(callback: types.CallbackQuery):
+    weeks = int(callback.data.split(":")[1])
+    if weeks not in CHART_PERIODS:
+        await callback.answer()
+        return
+    await callback.answer("⏳ Строим график...")
+
+    starts = week_starts(weeks)
+    db = read_session()
+    try:
+        user = db.query(User).filter(User.telegram_id == callback.from_user.id).first()
+        if not user:
+            await callback.message.answer("Зарегистрируйтесь (/start).")
+            return
+        key = (user.id, (weeks, starts[-1]), data_version(db, user.id))
+        entry = chart_cache.get(key)
+        if entry is None:
+            revenue, occupancy = weekly_aggregates(db, user.id, starts)
+    finally:
+        db.close()
+
+    caption = f"📈 Выручка и загрузка за {weeks} нед."
+    if entry is not None and entry["file_id"]:
+        metrics.inc("chart_cache", result="file_id")
+        await callback.message.answer_photo(entry["file_id"], caption=caption)
+        return
+
+    if entry is None:
+        metrics.inc("chart_cache", result="miss")
+        labels = [start.strftime("%d.%m") for start in starts]
+        try:
+            png = await chart_renderer.render(labels, revenue, occupancy, caption)
+        except Exception as e:
+            logger.error(f"Chart render error: {e}")
+            await callback.message.answer("Ошибка при построении графика.")
+            return
+        chart_cache.put(key, png)
+    else:
+        metrics.inc("chart_cache", result="png")
+        png = entry["png"]
+
+    sent = await callback.message.answer_photo(InputFile(BytesIO(png), filename="chart.png"), caption=caption)
+    chart_cache.set_file_id(key, sent.photo[-1].file_id)
+
+
+def register_reports_handlers(dp: Dispatcher):
+    dp.register_message_handler(charts_start, commands=["charts"], state="*")
+    dp.register_callback_query_handler(charts_menu_callback, lambda c: c.data == "cmd_charts", state="*")
+    dp.register_callback_query_handler(send_chart, lambda c: c.data.startswith("charts:"), state="*")
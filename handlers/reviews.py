@@ -3,12 +3,13 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from sqlalchemy import func
 
-from database import SessionLocal
-from keyboards.inline import cancel_kb, comment_kb
+from database import SessionLocal, read_session
+from keyboards.inline import cancel_kb, comment_kb, search_results_kb
 from models.car import Car
 from models.review import Review
 from models.booking import Booking
 from handlers.menu import main_menu_kb
+from services.car_text_search import search_cars_ranked
 
 
 class ReviewStates(StatesGroup):
@@ -121,25 +122,58 @@ async def cancel_callback(callback: types.CallbackQuery, state: FSMContext):
 # ⬇️ Старт просмотра отзывов
 async def show_reviews_start(callback: types.CallbackQuery):
     await callback.message.edit_text(
-        "Введите ID автомобиля для просмотра отзывов:",
+        "Введите марку, модель или город автомобиля (или его ID) для просмотра отзывов:",
         reply_markup=cancel_kb()
     )
     await ReviewStates.waiting_for_car_id.set()
     await callback.answer()
 
 
-# ⬇️ Обработка ID авто для просмотра
+# ⬇️ Поиск авто для просмотра отзывов: по ID или по названию
 async def process_car_id(message: types.Message, state: FSMContext):
-    if not message.text.isdigit():
-        await message.answer("ID должен быть числом. Попробуйте снова:", reply_markup=cancel_kb())
+    query = (message.text or "").strip()
+    if query.isdigit():
+        await show_car_reviews(message, state, int(query))
         return
+    await state.update_data(review_query=query)
+    await show_review_search(message, state, 0)
 
-    car_id = int(message.text)
-    db = SessionLocal()
+
+async def show_review_search(message: types.Message, state: FSMContext, page: int, edit: bool = False):
+    data = await state.get_data()
+    db = read_session()
+    try:
+        cars, has_next = search_cars_ranked(db, data.get("review_query", ""), page)
+    finally:
+        db.close()
+
+    send = message.edit_text if edit else message.answer
+    if not cars:
+        await send("Ничего не найдено. Попробуйте другой запрос:", reply_markup=cancel_kb())
+        return
+    if len(cars) == 1 and page == 0:
+        await show_car_reviews(message, state, cars[0].id, edit=edit)
+        return
+    await send("Выберите автомобиль:", reply_markup=search_results_kb(cars, page, has_next, "reviews"))
+
+
+async def review_search_callback(callback: types.CallbackQuery, state: FSMContext):
+    _, action, value = callback.data.split(":")
+    if action == "page":
+        await show_review_search(callback.message, state, int(value), edit=True)
+    else:
+        await show_car_reviews(callback.message, state, int(value), edit=True)
+    await callback.answer()
+
+
+# ⬇️ Отзывы об авто
+async def show_car_reviews(message: types.Message, state: FSMContext, car_id: int, edit: bool = False):
+    send = message.edit_text if edit else message.answer
+    db = read_session()
     car = db.query(Car).filter(Car.id == car_id).first()
     if not car:
         db.close()
-        await message.answer("Авто не найдено. Попробуйте снова:", reply_markup=cancel_kb())
+        await send("Авто не найдено. Попробуйте снова:", reply_markup=cancel_kb())
         return
 
     reviews = db.query(Review).filter(Review.car_id == car_id).all()
@@ -147,16 +181,16 @@ async def process_car_id(message: types.Message, state: FSMContext):
     db.close()
 
     if not reviews:
-        await message.answer(f"Для {car.model} ещё нет отзывов.", reply_markup=main_menu_kb())
+        await send(f"Для {car.brand} {car.model} ещё нет отзывов.", reply_markup=main_menu_kb())
         await state.finish()
         return
 
     avg_text = f"{round(avg_rating, 2):.2f}" if avg_rating else "нет данных"
-    msg = f"Отзывы для {car.model} (средний рейтинг: {avg_text}):\n\n"
+    msg = f"Отзывы для {car.brand} {car.model} (средний рейтинг: {avg_text}):\n\n"
     for r in reviews:
         msg += f"👤 Пользователь {r.renter_id}\n⭐️ {r.rating}\n💬 {r.comment or '—'}\n\n"
 
-    await message.answer(msg, reply_markup=main_menu_kb())
+    await send(msg, reply_markup=main_menu_kb())
     await state.finish()
 
 
@@ -169,6 +203,8 @@ def register_reviews_handlers(dp: Dispatcher):
     dp.register_message_handler(process_rating, state=ReviewStates.waiting_for_rating)
     dp.register_message_handler(process_comment, state=ReviewStates.waiting_for_comment)
     dp.register_message_handler(process_car_id, state=ReviewStates.waiting_for_car_id)
+    dp.register_callback_query_handler(review_search_callback, lambda c: c.data.startswith("reviews:"),
+                                       state=ReviewStates.waiting_for_car_id)
 
     dp.register_callback_query_handler(skip_comment_callback, lambda c: c.data == "skip_comment",
                                        state=ReviewStates.waiting_for_comment)
@@ -0,0 +1,89 @@
+﻿from datetime import datetime
+
+from aiogram import types, Dispatcher
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+from database import SessionLocal
+from handlers.menu import main_menu_kb, book_car
+from keyboards.inline import cancel_kb
+from middlewares.callback_ack import answers_callback
+from services.availability import booked_days
+from services.car_fields import parse_price
+from services.waitlist import subscribe
+
+
+class WaitlistFSM(StatesGroup):
+    dates = State()
+    max_price = State()
+
+
+# Подписка на город, где сейчас нет подходящих авто (город — из данных бронирования)
+@answers_callback
+async def waitlist_start(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if not data.get("city_id"):
+        await callback.answer("Сначала выберите город.", show_alert=True)
+        return
+    await callback.message.edit_text(
+        f"🔔 Сообщим, когда в городе {data['city']} появится авто.\n"
+        "Введите даты аренды в формате ДД.ММ.ГГГГ-ДД.ММ.ГГГГ:",
+        reply_markup=cancel_kb()
+    )
+    await WaitlistFSM.dates.set()
+    await callback.answer()
+
+
+async def waitlist_dates(msg: types.Message, state: FSMContext):
+    try:
+        date_from, date_to = (datetime.strptime(part.strip(), "%d.%m.%Y").date() for part in msg.text.split("-"))
+        if not (datetime.today().date() <= date_from <= date_to <= booked_days.last_day):
+            raise ValueError()
+    except ValueError:
+        await msg.answer("❌ Некорректные даты. Пример: 01.08.2026-05.08.2026", reply_markup=cancel_kb())
+        return
+
+    await state.update_data(waitlist_from=date_from, waitlist_to=date_to)
+    await msg.answer("Максимальная цена за сутки, € (или «-», если не важно):", reply_markup=cancel_kb())
+    await WaitlistFSM.max_price.set()
+
+
+async def waitlist_max_price(msg: types.Message, state: FSMContext):
+    try:
+        max_price = None if msg.text.strip() == "-" else parse_price(msg.text)
+    except ValueError:
+        await msg.answer("❌ Введите цену числом или «-»:", reply_markup=cancel_kb())
+        return
+
+    data = await state.get_data()
+    db = SessionLocal()
+    try:
+        subscribe(db, msg.from_user.id, data["city_id"], data["waitlist_from"], data["waitlist_to"], max_price)
+    except ValueError as e:
+        await msg.answer(f"❌ Не удалось подписаться: {e}.", reply_markup=main_menu_kb())
+        await state.finish()
+        return
+    finally:
+        db.close()
+
+    await msg.answer(
+        f"✅ Готово! Напишем, как только в городе {data['city']} освободится авто "
+        f"с {data['waitlist_from']:%d.%m.%Y} по {data['waitlist_to']:%d.%m.%Y}.",
+        reply_markup=main_menu_kb()
+    )
+    await state.finish()
+
+
+# Кнопка из уведомления: сразу к расчёту стоимости на даты подписки
+async def waitlist_book(callback: types.CallbackQuery, state: FSMContext):
+    _, _, car_id, date_from, date_to = callback.data.split(":")
+    await callback.answer()
+    await book_car(callback.message, state, int(car_id),
+                   datetime.strptime(date_from, "%Y%m%d").date(), datetime.strptime(date_to, "%Y%m%d").date())
+
+
+def register_waitlist_handlers(dp: Dispatcher):
+    dp.register_callback_query_handler(waitlist_start, lambda c: c.data == "wl:subscribe", state="*")
+    dp.register_callback_query_handler(waitlist_book, lambda c: c.data.startswith("wl:book:"), state="*")
+    dp.register_message_handler(waitlist_dates, state=WaitlistFSM.dates)
+    dp.register_message_handler(waitlist_max_price, state=WaitlistFSM.max_price)
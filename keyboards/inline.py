@@ -1,18 +1,76 @@
-﻿from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from models.constants import POPULAR_CITIES
+﻿import calendar
+from datetime import date
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+MONTH_NAMES = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+               "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+WEEKDAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
 
 def get_city_kb():
+    from services.cities import city_directory
+    return city_directory.keyboard()
+
+
+def city_counts_kb(cities):
+    """Кнопки городов с числом доступных авто; ``cities`` — список (id, название, количество)."""
     kb = InlineKeyboardMarkup(row_width=2)
-    for city in POPULAR_CITIES:
-        kb.insert(InlineKeyboardButton(city, callback_data=f"city:{city}"))
+    for city_id, name, count in cities:
+        kb.insert(InlineKeyboardButton(f"{name} ({count})", callback_data=f"city:{city_id}"))
+    return kb
+
+
+def get_car_kb(cars: list, has_prev: bool, has_next: bool, filtered: bool):
+    """Страница авто: строки (id, brand, model, year, price_per_day, rating) из ``search_cars``."""
+    kb = InlineKeyboardMarkup(row_width=1)
+    for car_id, brand, model, year, price, rating in cars:
+        label = f"{brand} {model} ({year}) — {price:g} €"
+        if rating:
+            label += f" ⭐{rating:.1f}"
+        kb.add(InlineKeyboardButton(label, callback_data=f"car:{car_id}"))
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("◀️", callback_data="carpage:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton("▶️", callback_data="carpage:next"))
+    if nav:
+        kb.row(*nav)
+    if not cars:
+        kb.add(InlineKeyboardButton("🔔 Сообщить, когда появится", callback_data="wl:subscribe"))
+    kb.row(InlineKeyboardButton("🔎 Фильтры", callback_data="carpage:filters"))
+    if filtered:
+        kb.insert(InlineKeyboardButton("♻️ Сбросить", callback_data="carpage:reset"))
+    kb.add(InlineKeyboardButton("⬅️ Назад", callback_data="back:city"))
     return kb
 
 
-def get_car_kb(cars_map: dict):
+def search_results_kb(cars: list, page: int, has_next: bool, prefix: str, extra: list = ()):
+    """
+    Страница результатов поиска (строки из ``search_cars_ranked``).
+
+    Выбор авто — ``<prefix>:car:<id>``, листание — ``<prefix>:page:<номер>``.
+    """
+    kb = InlineKeyboardMarkup(row_width=1)
+    for car_id, brand, model, year, city, price in cars:
+        kb.add(InlineKeyboardButton(f"{brand} {model} ({year}), {city} — {price:g} €",
+                                    callback_data=f"{prefix}:car:{car_id}"))
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}:page:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}:page:{page + 1}"))
+    if nav:
+        kb.row(*nav)
+    for button in extra:
+        kb.add(button)
+    kb.add(InlineKeyboardButton("❌ Отмена", callback_data="cancel"))
+    return kb
+
+
+def waitlist_kb():
     kb = InlineKeyboardMarkup(row_width=1)
-    for name, car_id in cars_map.items():
-        kb.add(InlineKeyboardButton(name, callback_data=f"car:{car_id}"))
+    kb.add(InlineKeyboardButton("🔔 Сообщить, когда появится", callback_data="wl:subscribe"))
     kb.add(InlineKeyboardButton("⬅️ Назад", callback_data="back:city"))
     return kb
 
@@ -35,6 +93,40 @@ def date_to_kb():
     return InlineKeyboardMarkup().add(InlineKeyboardButton("⬅️ Назад", callback_data="back:date_from"))
 
 
+def calendar_kb(year: int, month: int, disabled_days: set, has_prev: bool, has_next: bool,
+                back_callback: str):
+    """
+    Календарь на месяц. Дни из ``disabled_days`` показываются серыми и не выбираются.
+    """
+    kb = InlineKeyboardMarkup(row_width=7)
+    kb.row(InlineKeyboardButton(f"{MONTH_NAMES[month - 1]} {year}", callback_data="cal:none"))
+    kb.row(*[InlineKeyboardButton(name, callback_data="cal:none") for name in WEEKDAY_NAMES])
+
+    for week in calendar.monthcalendar(year, month):
+        row = []
+        for day in week:
+            if day == 0:
+                row.append(InlineKeyboardButton(" ", callback_data="cal:none"))
+            elif day in disabled_days:
+                row.append(InlineKeyboardButton("·", callback_data="cal:none"))
+            else:
+                row.append(InlineKeyboardButton(
+                    str(day), callback_data=f"cal:pick:{date(year, month, day).isoformat()}"
+                ))
+        kb.row(*row)
+
+    prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+    next_year, next_month = (year, month + 1) if month < 12 else (year + 1, 1)
+    kb.row(
+        InlineKeyboardButton("◀️" if has_prev else " ",
+                             callback_data=f"cal:nav:{prev_year}-{prev_month:02d}" if has_prev else "cal:none"),
+        InlineKeyboardButton("▶️" if has_next else " ",
+                             callback_data=f"cal:nav:{next_year}-{next_month:02d}" if has_next else "cal:none"),
+    )
+    kb.add(InlineKeyboardButton("⬅️ Назад", callback_data=back_callback))
+    return kb
+
+
 def kb_back():
     return InlineKeyboardMarkup().add(InlineKeyboardButton("⬅️ Назад", callback_data="cancel"))
 
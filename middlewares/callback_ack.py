@@ -0,0 +1,59 @@
+﻿from collections import Counter
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from middlewares.context import current_handler_info
+from services.metrics import metrics
+from services.telegram_api import current_api_calls
+
+
+# Хендлеры, которые сами отвечают на callback с текстом или alert
+ANSWERING_HANDLERS = set()
+
+
+def answers_callback(handler):
+    """
+    Хендлер сам отвечает на callback с текстом или alert — не отвечать за него заранее.
+
+    Только для быстрых хендлеров: до их ответа у пользователя крутятся «часики».
+    Ошибки и «неизвестная команда» в остальных хендлерах сообщаются сообщением.
+    """
+    ANSWERING_HANDLERS.add(handler)
+    return handler
+
+
+def answering_handlers(dp) -> list:
+    """Зарегистрированные хендлеры callback'ов, которые middleware не отвечает заранее."""
+    return [
+        f"{h.handler.__module__}.{h.handler.__qualname__}"
+        for h in dp.callback_query_handlers.handlers if h.handler in ANSWERING_HANDLERS
+    ]
+
+
+class CallbackAckMiddleware(BaseMiddleware):
+    """
+    Отвечает на callback сразу после выбора хендлера, до его работы с БД,
+    чтобы у пользователя не висели «часики» на кнопке. Заодно считает
+    вызовы Telegram API на апдейт по хендлерам.
+
+    Рассчитан на ``TrackedBot``: повторный ``callback.answer()`` в хендлере
+    не отправляется в Telegram.
+    """
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["_api_calls"] = Counter()
+        current_api_calls.set(data["_api_calls"])
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        if current_handler.get(None) not in ANSWERING_HANDLERS:
+            await callback.answer()
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        calls = data.pop("_api_calls", None)
+        current_api_calls.set(None)
+        if calls is None:
+            return
+        handler, _ = current_handler_info.get()
+        metrics.observe("telegram_api_calls_per_update", sum(calls.values()), handler=handler)
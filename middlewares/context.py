@@ -0,0 +1,50 @@
+﻿import time
+from contextvars import ContextVar
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from database import current_user_id
+
+# (имя хендлера, FSM-состояние) для апдейта, который обрабатывается в текущей задаче
+current_handler_info: ContextVar = ContextVar("current_handler_info", default=("-", "-"))
+# (update_id, время начала обработки по time.monotonic()) — для логов и задержек
+current_update_info: ContextVar = ContextVar("current_update_info", default=None)
+
+
+def update_user(update: types.Update):
+    """Автор апдейта (сообщения, callback, inline-запроса) или None."""
+    event = (update.message or update.edited_message or update.callback_query
+             or update.inline_query or update.chosen_inline_result
+             or update.shipping_query or update.pre_checkout_query)
+    return event.from_user if event else None
+
+
+def handler_name(handler) -> str:
+    """Имя хендлера для логов и метрик, например ``handlers.bookings.select_car``."""
+    if handler is None:
+        return "-"
+    return f"{handler.__module__}.{handler.__qualname__}"
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Запоминает автора апдейта и выбранный для него хендлер с FSM-состоянием."""
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        user = update_user(update)
+        current_user_id.set(user.id if user else None)
+        current_handler_info.set(("-", "-"))
+        current_update_info.set((update.update_id, time.monotonic()))
+
+    def _remember_handler(self, data: dict):
+        current_handler_info.set((handler_name(current_handler.get()), data.get("raw_state") or "-"))
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._remember_handler(data)
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        self._remember_handler(data)
+
+    async def on_process_inline_query(self, query: types.InlineQuery, data: dict):
+        self._remember_handler(data)
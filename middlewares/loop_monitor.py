@@ -0,0 +1,35 @@
+﻿from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from middlewares.context import handler_name
+from services.loop_monitor import LoopMonitor
+
+
+class LoopMonitorMiddleware(BaseMiddleware):
+    """Сообщает сторожу loop, какой хендлер и в каком состоянии сейчас работает."""
+
+    def __init__(self, monitor: LoopMonitor):
+        super().__init__()
+        self.monitor = monitor
+
+    def _enter(self, data: dict):
+        self.monitor.enter(handler_name(current_handler.get()), data.get("raw_state"))
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._enter(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self.monitor.leave()
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        self._enter(data)
+
+    async def on_post_process_callback_query(self, callback: types.CallbackQuery, results, data: dict):
+        self.monitor.leave()
+
+    async def on_process_inline_query(self, query: types.InlineQuery, data: dict):
+        self._enter(data)
+
+    async def on_post_process_inline_query(self, query: types.InlineQuery, results, data: dict):
+        self.monitor.leave()
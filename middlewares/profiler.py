@@ -0,0 +1,71 @@
+﻿import asyncio
+import cProfile
+import hashlib
+import random
+import time
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from loguru import logger
+
+from config import BOT_TOKEN
+from middlewares.context import update_user, current_handler_info
+from services.profiles import ProfileStore
+
+
+def user_hash(user_id) -> str:
+    if user_id is None:
+        return "-"
+    return hashlib.sha256(f"{BOT_TOKEN}:{user_id}".encode()).hexdigest()[:12]
+
+
+class SlowUpdateProfilerMiddleware(BaseMiddleware):
+    """
+    Профилирует долю апдейтов через cProfile и сохраняет профиль, только
+    если апдейт обрабатывался дольше ``threshold`` секунд.
+
+    cProfile привязан к потоку, поэтому одновременно профилируется не больше
+    одного апдейта, а в профиль попадает и работа других задач loop за это время.
+    """
+
+    def __init__(self, store: ProfileStore, threshold: float, sample_rate: float):
+        super().__init__()
+        self.store = store
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._active = None
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if self._active is not None or random.random() >= self.sample_rate:
+            return
+        profiler = cProfile.Profile()
+        self._active = update.update_id
+        data["_profile"] = (profiler, time.perf_counter())
+        profiler.enable()
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        profile = data.pop("_profile", None)
+        if profile is None:
+            return
+        profiler, started = profile
+        profiler.disable()
+        self._active = None
+
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+
+        handler, state = current_handler_info.get()
+        user = update_user(update)
+        meta = {
+            "update_id": update.update_id,
+            "handler": handler,
+            "state": state,
+            "user": user_hash(user.id if user else None),
+            "duration": round(duration, 4),
+            "created_at": time.time(),
+        }
+        loop = asyncio.get_running_loop()
+        name = await loop.run_in_executor(None, self.store.save, profiler, meta)
+        logger.warning(f"Slow update {update.update_id}: {duration:.3f}s in {handler} (state={state}), "
+                       f"profile {name}")
@@ -0,0 +1,59 @@
+﻿from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from loguru import logger
+
+from middlewares.context import current_handler_info
+from services.metrics import metrics
+from services.sql_accounting import QueryStats, current_query_stats, handler_budget
+
+
+class QueryBudgetMiddleware(BaseMiddleware):
+    """
+    Считает SQL-запросы каждого апдейта и повторяющиеся запросы одной формы (N+1).
+
+    Число запросов по хендлерам уходит в метрики; в режиме "log" превышение
+    бюджета и N+1 пишутся в лог, в режиме "raise" запрос сверх бюджета падает.
+    """
+
+    def __init__(self, mode: str, n_plus_one_threshold: int):
+        super().__init__()
+        self.mode = mode
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["_query_stats"] = QueryStats()
+        current_query_stats.set(data["_query_stats"])
+
+    def _remember_budget(self, data: dict):
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.budget = handler_budget(current_handler.get())
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._remember_budget(data)
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        self._remember_budget(data)
+
+    async def on_process_inline_query(self, query: types.InlineQuery, data: dict):
+        self._remember_budget(data)
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        stats = data.pop("_query_stats", None)
+        current_query_stats.set(None)
+        if stats is None or not stats.count:
+            return
+
+        handler, _ = current_handler_info.get()
+        metrics.inc("sql_queries", stats.count, handler=handler)
+        metrics.observe("sql_queries_per_update", stats.count, handler=handler)
+
+        repeated = stats.repeated(self.n_plus_one_threshold)
+        for shape, count in repeated.items():
+            metrics.inc("sql_n_plus_one", handler=handler)
+            if self.mode != "metrics":
+                logger.warning(f"Possible N+1 in {handler}: {count}x {shape[:200]}")
+
+        if self.mode != "metrics" and stats.budget is not None and stats.count > stats.budget:
+            logger.warning(f"{handler} issued {stats.count} SQL queries, budget is {stats.budget}")
@@ -0,0 +1,97 @@
+﻿import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from services.metrics import metrics
+
+
+# Команды, которые делают то же, что и кнопки меню, — в корзину той же кнопки
+COMMAND_NAMESPACES = {
+    "export": "cmd_export",
+    "charts": "cmd_charts",
+    "import_cars": "cmd_import_cars",
+}
+
+
+def callback_namespace(data: str, known) -> str:
+    """
+    ``car:12`` -> ``car``, ``cmd_catalog`` -> ``cmd_catalog``, если они есть в ``known``.
+
+    Остальные — в общее ``"callback"``: данные вида ``pay_confirm_<id>`` (и любые
+    подделанные клиентом) иначе давали бы по корзине и метке метрики на каждый ID.
+    """
+    namespace = (data or "").split(":", 1)[0]
+    return namespace if namespace in known else "callback"
+
+
+def message_namespace(message: types.Message) -> str:
+    """Команды из ``COMMAND_NAMESPACES`` — в корзину своей кнопки, остальное — ``"message"``."""
+    if message.is_command():
+        return COMMAND_NAMESPACES.get(message.get_command(pure=True).lower(), "message")
+    return "message"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту действий каждого пользователя корзинами токенов.
+
+    Корзина заводится на пару (пользователь, пространство имён действия) и
+    пополняется со скоростью из ``limits``. Проверка идёт до фильтров и FSM,
+    поэтому отклонённый апдейт не стоит ни одного запроса к БД: на callback
+    отвечаем «подождите», лишние сообщения молча отбрасываем. Полностью
+    восстановившиеся корзины удаляются, память — O(активных пользователей).
+    """
+
+    def __init__(self, limits: dict, default: tuple, sweep_interval: float):
+        super().__init__()
+        self.limits = limits
+        self.default = default
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+
+    def allow(self, user_id: int, namespace: str) -> bool:
+        rate, burst = self.limits.get(namespace, self.default)
+        now = time.monotonic()
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(now)
+
+        key = (user_id, namespace)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = burst
+        else:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        if tokens < 1:
+            self._buckets[key] = [tokens, now]
+            metrics.inc("throttled", namespace=namespace)
+            return False
+        self._buckets[key] = [tokens - 1, now]
+        return True
+
+    def _sweep(self, now: float):
+        # Корзина, которая успела наполниться до ёмкости, ничем не отличается от новой
+        expired = []
+        for (user_id, namespace), (tokens, updated) in self._buckets.items():
+            rate, burst = self.limits.get(namespace, self.default)
+            if tokens + (now - updated) * rate >= burst:
+                expired.append((user_id, namespace))
+        for key in expired:
+            del self._buckets[key]
+        self._last_sweep = now
+        metrics.set("throttle_buckets", len(self._buckets))
+
+    async def on_pre_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        if not self.allow(callback.from_user.id, callback_namespace(callback.data, self.limits)):
+            await callback.answer("⏳ Слишком часто, подождите немного")
+            raise CancelHandler()
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if message.from_user and not self.allow(message.from_user.id, message_namespace(message)):
+            raise CancelHandler()
+
+    async def on_pre_process_inline_query(self, query: types.InlineQuery, data: dict):
+        if not self.allow(query.from_user.id, "inline"):
+            raise CancelHandler()
@@ -1,6 +1,7 @@
-﻿from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean
+﻿from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, Index, func
 from database import Base
 from sqlalchemy.orm import relationship
+from models.city import City
 
 class Car(Base):
     __tablename__ = "cars"
@@ -14,9 +15,23 @@ class Car(Base):
     vin = Column(String, nullable=True)
     price_per_day = Column(Float, nullable=False)
     city = Column(String, nullable=False)  
+    city_id = Column(Integer, ForeignKey("cities.id"), index=True, nullable=True)
     photo_file_id = Column(String, nullable=True)  
     rental_terms = Column(String, nullable=True)
     available = Column(Boolean, default=True)
     discount = Column(Float, default=0.0) 
+    # Растёт при любом изменении авто или его бронирований (services/car_versions.py) — из него ETag партнёрского API
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
-    owner = relationship("User", backref="cars")
\ No newline at end of file
+    __table_args__ = (
+        # Поиск авто в городе: фильтр по доступности и сортировка по (цена, id)
+        Index("ix_cars_city_available_price", "city_id", "available", "price_per_day", "id"),
+        Index("ix_cars_city_year", "city_id", "year"),
+        Index("ix_cars_brand_lower", func.lower(brand)),
+        # Проверка If-None-Match в партнёрском API (available, id -> version) и страницы каталога
+        # без фильтра по городу — index-only scan без строк таблицы
+        Index("ix_cars_available_id_version", "available", "id", "version"),
+    )
+
+    owner = relationship("User", backref="cars")
+    city_ref = relationship(City)
\ No newline at end of file
@@ -0,0 +1,9 @@
+﻿from sqlalchemy import Column, Integer, String
+from database import Base
+
+class City(Base):
+    __tablename__ = "cities"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    normalized_name = Column(String, unique=True, index=True, nullable=False)
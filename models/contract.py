@@ -7,7 +7,9 @@ class Contract(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     booking_id = Column(Integer, ForeignKey("bookings.id"))
-    contract_pdf_path = Column(String, nullable=True)
+    contract_pdf_path = Column(String, nullable=True)  # старые договоры; новые лежат в хранилище по content_hash
+    content_hash = Column(String(64), nullable=True, index=True)
+    telegram_file_id = Column(String, nullable=True)
     signed = Column(Boolean, default=False)
     signature_data = Column(String, nullable=True)
     cancelled = Column(Boolean, default=False)
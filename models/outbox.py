@@ -0,0 +1,19 @@
+﻿from datetime import datetime
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, JSON
+from database import Base
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    dedup_key = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True, index=True)
+    attempts = Column(Integer, default=0)
+    # До этого момента событие отправляет взявший его экземпляр бота
+    locked_until = Column(DateTime, nullable=True)
+    # Раньше этого момента повторно не отправлять (отсрочка после ошибки или RetryAfter)
+    next_attempt_at = Column(DateTime, nullable=True)
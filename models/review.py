@@ -6,7 +6,7 @@ class Review(Base):
     __tablename__ = "reviews"
 
     id = Column(Integer, primary_key=True, index=True)
-    car_id = Column(Integer, ForeignKey("cars.id"))
+    car_id = Column(Integer, ForeignKey("cars.id"), index=True)
     renter_id = Column(Integer, ForeignKey("users.id"))
     rating = Column(Float, nullable=False)
     comment = Column(String, nullable=True)
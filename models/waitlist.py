@@ -0,0 +1,23 @@
+﻿from datetime import datetime
+from sqlalchemy import Column, Integer, BigInteger, Float, Date, DateTime, ForeignKey, Index
+from database import Base
+
+
+class WaitlistSubscription(Base):
+    __tablename__ = "waitlist_subscriptions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    telegram_id = Column(BigInteger, nullable=False, index=True)
+    city_id = Column(Integer, ForeignKey("cities.id"), nullable=False)
+    date_from = Column(Date, nullable=False)
+    date_to = Column(Date, nullable=False)
+    max_price = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    notified_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Подбор подписок под освободившееся авто: город + диапазон начала аренды,
+        # только среди ещё не уведомлённых
+        Index("ix_waitlist_active_city_from", "city_id", "date_from",
+              postgresql_where=notified_at.is_(None), sqlite_where=notified_at.is_(None)),
+    )
@@ -0,0 +1,22 @@
+﻿import uvicorn
+from fastapi import FastAPI
+from loguru import logger
+
+from api.webhook import app as webhook_app
+from config import PAYMENT_API_HOST, PAYMENT_API_PORT, PAYMENT_API_WORKERS
+# Модели, на которые ссылаются relationship() у Booking и Payment: без бота их никто не импортирует
+from models import car, user, review, contract  # noqa: F401
+# Версии авто для ETag партнёрского API растут при записи и из этого процесса (платёжные callback'и)
+import services.car_versions  # noqa: F401
+
+# Платёжное API отдельно от бота: callback'и FreeKassa не ждут polling и хендлеры,
+# а число воркеров uvicorn (у каждого свой пул соединений к БД) задаётся PAYMENT_API_WORKERS.
+# Публичные маршруты (партнёры, iCal, договоры) живут в public_api.py, чтобы их нагрузка
+# не занимала воркеры и пул соединений callback'ов; метрики — на служебном порту бота
+app = FastAPI()
+app.mount("/api", webhook_app)
+
+if __name__ == "__main__":
+    logger.info(f"Payment API on port {PAYMENT_API_PORT} with {PAYMENT_API_WORKERS} workers")
+    uvicorn.run("payment_api:app", host=PAYMENT_API_HOST, port=PAYMENT_API_PORT,
+                workers=PAYMENT_API_WORKERS, log_level="info")
@@ -0,0 +1,23 @@
+﻿import uvicorn
+from fastapi import FastAPI
+from loguru import logger
+
+from api.contracts import router as contracts_router
+from api.partner import router as partner_router
+from api.ical import router as ical_router
+from config import PUBLIC_API_HOST, PUBLIC_API_PORT, PUBLIC_API_WORKERS
+# Модели, на которые ссылаются relationship(): без бота их никто не импортирует
+from models import booking, car, user, review, contract, payment  # noqa: F401
+
+# Публичное API отдельно и от бота, и от платёжного API: партнёрский каталог, iCal-фиды
+# и скачивание договоров масштабируются своими воркерами (PUBLIC_API_WORKERS)
+# и не отнимают соединения к БД у callback'ов FreeKassa
+app = FastAPI()
+app.include_router(contracts_router)
+app.include_router(partner_router)
+app.include_router(ical_router)
+
+if __name__ == "__main__":
+    logger.info(f"Public API on port {PUBLIC_API_PORT} with {PUBLIC_API_WORKERS} workers")
+    uvicorn.run("public_api:app", host=PUBLIC_API_HOST, port=PUBLIC_API_PORT,
+                workers=PUBLIC_API_WORKERS, log_level="info")
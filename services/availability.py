@@ -0,0 +1,149 @@
+﻿from datetime import date, timedelta
+
+from loguru import logger
+
+from database import SessionLocal
+from models.booking import Booking, BookingStatus
+
+# Горизонт календаря бронирований (в днях)
+HORIZON_DAYS = 730
+
+# Статусы, которые занимают дни в календаре
+ACTIVE_STATUSES = (BookingStatus.PENDING, BookingStatus.CONFIRMED)
+
+
+class BookedDays:
+    """
+    Битовые карты занятых дней по каждому авто.
+
+    Бит i карты авто означает, что день ``origin + i`` занят. Карты строятся
+    один раз при старте (``load``) и дальше обновляются инкрементально при
+    создании и отмене бронирований, поэтому отрисовка календаря не ходит в БД.
+    """
+
+    def __init__(self, horizon_days: int = HORIZON_DAYS):
+        self.horizon_days = horizon_days
+        self.origin = date.today()
+        self._bitmaps: dict[int, bytearray] = {}
+
+    @property
+    def last_day(self) -> date:
+        return self.origin + timedelta(days=self.horizon_days - 1)
+
+    def load(self, db):
+        self._bitmaps.clear()
+        self.origin = date.today()
+        bookings = db.query(Booking.car_id, Booking.date_from, Booking.date_to).filter(
+            Booking.status.in_(ACTIVE_STATUSES),
+            Booking.date_to >= self.origin
+        ).all()
+        for car_id, date_from, date_to in bookings:
+            self.mark(car_id, date_from, date_to)
+        logger.info(f"Booked days loaded: {len(bookings)} bookings, {len(self._bitmaps)} cars")
+
+    # Сдвигаем начало карт на целое число байт, когда прошло достаточно дней.
+    # Дни, которые добавились в конец горизонта, загружаем из БД: бронирования
+    # на них могли быть созданы ещё до старта и в картах не отмечены
+    def _rebase(self):
+        shift = (date.today() - self.origin).days // 8
+        if shift <= 0:
+            return
+        window_from = self.last_day + timedelta(days=1)
+        window_to = self.last_day + timedelta(days=shift * 8)
+        bookings = self._load_window(window_from, window_to)
+
+        for bitmap in self._bitmaps.values():
+            bitmap[:] = bitmap[shift:] + bytes(min(shift, len(bitmap)))
+        self.origin += timedelta(days=shift * 8)
+        for car_id, date_from, date_to in bookings:
+            self.mark(car_id, max(date_from, window_from), date_to)
+        logger.info(f"Booked days rebased to {self.origin}: {len(bookings)} bookings in the new window")
+
+    def _load_window(self, date_from: date, date_to: date) -> list:
+        db = SessionLocal()
+        try:
+            return db.query(Booking.car_id, Booking.date_from, Booking.date_to).filter(
+                Booking.status.in_(ACTIVE_STATUSES),
+                Booking.date_from <= date_to,
+                Booking.date_to >= date_from
+            ).all()
+        finally:
+            db.close()
+
+    def _bitmap(self, car_id: int) -> bytearray:
+        bitmap = self._bitmaps.get(car_id)
+        if bitmap is None:
+            bitmap = bytearray((self.horizon_days + 7) // 8)
+            self._bitmaps[car_id] = bitmap
+        return bitmap
+
+    def _index_range(self, date_from: date, date_to: date) -> range:
+        start = max((date_from - self.origin).days, 0)
+        stop = min((date_to - self.origin).days + 1, self.horizon_days)
+        return range(start, stop)
+
+    def _set(self, car_id: int, date_from: date, date_to: date, value: bool):
+        self._rebase()
+        bitmap = self._bitmap(car_id)
+        for i in self._index_range(date_from, date_to):
+            if value:
+                bitmap[i >> 3] |= 1 << (i & 7)
+            else:
+                bitmap[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def mark(self, car_id: int, date_from: date, date_to: date):
+        self._set(car_id, date_from, date_to, True)
+
+    def release(self, car_id: int, date_from: date, date_to: date):
+        if car_id in self._bitmaps:
+            self._set(car_id, date_from, date_to, False)
+
+    def drop(self, car_id: int):
+        self._bitmaps.pop(car_id, None)
+
+    def is_booked(self, car_id: int, day: date) -> bool:
+        self._rebase()
+        bitmap = self._bitmaps.get(car_id)
+        i = (day - self.origin).days
+        if bitmap is None or not (0 <= i < self.horizon_days):
+            return False
+        return bool(bitmap[i >> 3] >> (i & 7) & 1)
+
+    def is_free(self, car_id: int, date_from: date, date_to: date) -> bool:
+        self._rebase()
+        bitmap = self._bitmaps.get(car_id)
+        if bitmap is None:
+            return True
+        return not any(bitmap[i >> 3] >> (i & 7) & 1 for i in self._index_range(date_from, date_to))
+
+    def booked_count(self, car_id: int, date_from: date, date_to: date) -> int:
+        """Число занятых дней в интервале [date_from, date_to]."""
+        self._rebase()
+        bitmap = self._bitmaps.get(car_id)
+        if bitmap is None:
+            return 0
+        return sum(bitmap[i >> 3] >> (i & 7) & 1 for i in self._index_range(date_from, date_to))
+
+    def first_booked_after(self, car_id: int, day: date):
+        """Первый занятый день после ``day`` или None, если до конца горизонта свободно."""
+        self._rebase()
+        bitmap = self._bitmaps.get(car_id)
+        if bitmap is None:
+            return None
+        for i in self._index_range(day + timedelta(days=1), self.last_day):
+            byte = bitmap[i >> 3]
+            if byte and byte >> (i & 7) & 1:
+                return self.origin + timedelta(days=i)
+        return None
+
+    def booked_in_month(self, car_id: int, year: int, month: int) -> set:
+        """Номера занятых дней месяца."""
+        first = date(year, month, 1)
+        next_month = date(year + month // 12, month % 12 + 1, 1)
+        return {
+            d.day for d in (first + timedelta(days=n) for n in range((next_month - first).days))
+            if self.is_booked(car_id, d)
+        }
+
+
+booked_days = BookedDays()
@@ -0,0 +1,23 @@
+﻿# Правила проверки полей авто — общие для пошагового добавления (AddCarFSM),
+# редактирования и массового импорта автопарка
+
+
+def parse_year(text) -> int:
+    year = int(str(text).strip())
+    if not (1900 <= year <= 2100):
+        raise ValueError("Год 1900–2100")
+    return year
+
+
+def parse_price(text) -> float:
+    price = float(str(text).strip().replace(",", "."))
+    if price <= 0:
+        raise ValueError("Цена должна быть больше 0")
+    return price
+
+
+def parse_discount(text) -> float:
+    discount = float(str(text).strip().replace(",", ".") or 0)
+    if not (0 <= discount <= 100):
+        raise ValueError("Скидка 0–100")
+    return discount
@@ -0,0 +1,147 @@
+﻿import re
+
+from sqlalchemy import select, func, and_, or_
+
+from models.car import Car
+from models.review import Review
+from services.car_text_search import search_condition
+
+PAGE_SIZE = 8
+
+# Ключи фильтров в тексте пользователя -> поле фильтра
+FILTER_KEYS = {
+    "цена": "price", "price": "price",
+    "год": "year", "year": "year",
+    "марка": "brand", "brand": "brand",
+    "рейтинг": "rating", "rating": "rating",
+    "поиск": "text", "search": "text",
+}
+
+
+def _range(value: str, cast):
+    """«20-60» -> (20, 60), «20-» -> (20, None), «-60» -> (None, 60), «2015» -> (2015, 2015)."""
+    if "-" not in value:
+        number = cast(value)
+        return number, number
+    low, high = (part.strip() for part in value.split("-", 1))
+    return (cast(low) if low else None), (cast(high) if high else None)
+
+
+def parse_filters(text: str) -> dict:
+    """
+    Разбирает строку вида ``цена 20-60; год 2015-; марка Toyota; рейтинг 4``.
+
+    Бросает ValueError при неизвестном ключе или неверном значении.
+    """
+    filters = {}
+    for part in re.split(r"[;\n]+", text or ""):
+        part = part.strip()
+        if not part:
+            continue
+        key, _, value = part.partition(" ")
+        field = FILTER_KEYS.get(key.strip(":").casefold())
+        value = value.strip().replace(",", ".")
+        if not field or not value:
+            raise ValueError(f"не понял фильтр «{part}»")
+        if field == "price":
+            filters["price_min"], filters["price_max"] = _range(value, float)
+        elif field == "year":
+            filters["year_min"], filters["year_max"] = _range(value, int)
+        elif field == "brand":
+            filters["brand"] = value
+        elif field == "text":
+            filters["text"] = value
+        elif field == "rating":
+            rating = float(value)
+            if not 1 <= rating <= 5:
+                raise ValueError("рейтинг должен быть от 1 до 5")
+            filters["min_rating"] = rating
+    return {k: v for k, v in filters.items() if v is not None}
+
+
+def describe_filters(filters: dict) -> str:
+    parts = []
+    if "price_min" in filters or "price_max" in filters:
+        parts.append(f"цена {filters.get('price_min', '')}-{filters.get('price_max', '')} €")
+    if "year_min" in filters or "year_max" in filters:
+        parts.append(f"год {filters.get('year_min', '')}-{filters.get('year_max', '')}")
+    if "brand" in filters:
+        parts.append(f"марка {filters['brand']}")
+    if "min_rating" in filters:
+        parts.append(f"рейтинг от {filters['min_rating']:g}")
+    if "text" in filters:
+        parts.append(f"поиск «{filters['text']}»")
+    return ", ".join(parts)
+
+
+def search_cars(db, city_id: int, filters: dict, after: list = None, before: list = None,
+                start: list = None, limit: int = PAGE_SIZE):
+    """
+    Страница доступных авто города, отфильтрованных в SQL.
+
+    Сортировка по (цена, id); страницы листаются по ключу, а не OFFSET:
+    ``after``/``before`` — ключ ``[price, id]`` последнего/первого авто
+    соседней страницы, ``start`` — ключ первого авто самой страницы (для
+    повторного показа). Возвращает (строки, есть_предыдущая, есть_следующая),
+    строка — (id, brand, model, year, price_per_day, rating).
+    """
+    # Средний рейтинг — коррелированным подзапросом по индексу reviews.car_id:
+    # считается только для авто страницы (и кандидатов фильтра по рейтингу),
+    # а не GROUP BY по всей таблице отзывов на каждую страницу
+    rating = (
+        select(func.avg(Review.rating))
+        .where(Review.car_id == Car.id)
+        .correlate(Car)
+        .scalar_subquery()
+    )
+    conditions = [Car.available == True, Car.city_id == city_id]
+    if "price_min" in filters:
+        conditions.append(Car.price_per_day >= filters["price_min"])
+    if "price_max" in filters:
+        conditions.append(Car.price_per_day <= filters["price_max"])
+    if "year_min" in filters:
+        conditions.append(Car.year >= filters["year_min"])
+    if "year_max" in filters:
+        conditions.append(Car.year <= filters["year_max"])
+    if "brand" in filters:
+        conditions.append(func.lower(Car.brand) == filters["brand"].lower())
+    if "min_rating" in filters:
+        conditions.append(rating >= filters["min_rating"])
+    if "text" in filters:
+        # Тот же поиск, что в каталоге и отзывах; порядок страниц остаётся по цене
+        conditions.append(search_condition(db, filters["text"])[0])
+
+    if before:
+        conditions.append(_key_before(before))
+        order = (Car.price_per_day.desc(), Car.id.desc())
+    else:
+        if after:
+            conditions.append(_key_after(after))
+        elif start:
+            conditions.append(_key_after(start, inclusive=True))
+        order = (Car.price_per_day, Car.id)
+
+    query = (
+        select(Car.id, Car.brand, Car.model, Car.year, Car.price_per_day, rating.label("rating"))
+        .where(and_(*conditions))
+        .order_by(*order)
+        .limit(limit + 1)
+    )
+    rows = db.execute(query).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        return list(reversed(rows)), more, True
+    return rows, bool(after or start), more
+
+
+# Сравнение по ключу (price, id) без tuple-сравнения, которое есть не во всех БД
+def _key_after(cursor, inclusive: bool = False):
+    price, car_id = cursor
+    same_price = Car.id >= car_id if inclusive else Car.id > car_id
+    return or_(Car.price_per_day > price, and_(Car.price_per_day == price, same_price))
+
+
+def _key_before(cursor):
+    price, car_id = cursor
+    return or_(Car.price_per_day < price, and_(Car.price_per_day == price, Car.id < car_id))
@@ -0,0 +1,114 @@
+﻿import re
+
+from loguru import logger
+from sqlalchemy import select, func, event, and_, or_, literal, literal_column, text, String
+
+from config import CAR_SEARCH_WORD_SIMILARITY
+from database import engine as primary_engine, replica_engine
+from models.car import Car
+
+PAGE_SIZE = 10
+
+# Название авто для нечёткого поиска. Выражение совпадает с выражением GIN-индекса
+# ix_cars_search_trgm, иначе Postgres индекс не использует
+SEARCH_NAME = literal_column("lower(cars.brand || ' ' || cars.model || ' ' || cars.city)")
+SEARCH_VECTOR = literal_column("cars.search_vector")
+
+# Схема поиска в Postgres. Колонка search_vector вычисляемая (STORED), поэтому
+# она сама обновляется при любой вставке и изменении авто, в том числе при
+# импорте автопарка. Команды идемпотентны и выполняются при старте.
+POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE cars ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(brand, '') || ' ' || coalesce(model, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(city, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(rental_terms, '')), 'D')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_cars_search_vector ON cars USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_cars_search_trgm ON cars "
+    "USING gin ((lower(brand || ' ' || model || ' ' || city)) gin_trgm_ops)",
+)
+
+
+def _set_word_similarity(dbapi_connection, connection_record):
+    # SET вне транзакции, иначе его откатит сброс соединения при возврате в пул
+    autocommit = dbapi_connection.autocommit
+    dbapi_connection.autocommit = True
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"SET pg_trgm.word_similarity_threshold = {CAR_SEARCH_WORD_SIMILARITY:g}")
+    cursor.close()
+    dbapi_connection.autocommit = autocommit
+
+
+# Оператор <% сравнивает с порогом сессии pg_trgm.word_similarity_threshold (по умолчанию 0.6)
+for _engine in {primary_engine, replica_engine}:
+    if _engine.dialect.name == "postgresql":
+        event.listen(_engine, "connect", _set_word_similarity)
+
+
+def ensure_search_schema(engine):
+    """Создаёт колонку и индексы полнотекстового поиска (только Postgres)."""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for ddl in POSTGRES_DDL:
+            conn.execute(text(ddl))
+    logger.info("Car search schema is up to date")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(re.findall(r"\w+", (query or "").casefold().replace("ё", "е")))
+
+
+def search_condition(db, query: str):
+    """
+    Условие «авто подходит под запрос» и оценка релевантности для ORDER BY.
+
+    В Postgres: совпадение слов по tsvector (марка и модель весят больше города
+    и условий аренды) или похожесть запроса на часть названия по триграммам
+    (``<%``, word_similarity): со всем названием «марка модель город» опечатка
+    вроде "bmv" почти не похожа, а с его словом "bmw" — похожа, как и
+    недописанное "toyo" на "toyota". В других БД (SQLite для разработки) —
+    вхождение каждого слова в название или условия, без ранжирования (None).
+    """
+    query = normalize_query(query)
+    if db.get_bind().dialect.name == "postgresql":
+        words = literal(query, String)
+        tsquery = func.plainto_tsquery("simple", words)
+        # words <% name использует тот же GIN-индекс gin_trgm_ops, что и %
+        condition = or_(SEARCH_VECTOR.op("@@")(tsquery), words.op("<%")(SEARCH_NAME))
+        rank = func.ts_rank(SEARCH_VECTOR, tsquery) + func.word_similarity(words, SEARCH_NAME)
+        return condition, rank
+
+    document = func.lower(Car.brand + " " + Car.model + " " + Car.city + " " + func.coalesce(Car.rental_terms, ""))
+    condition = and_(*(document.contains(term, autoescape=True) for term in query.split()))
+    return condition, None
+
+
+def search_cars_ranked(db, query: str, page: int = 0, limit: int = PAGE_SIZE, city_id: int = None):
+    """
+    Страница доступных авто по запросу, самые релевантные первыми.
+
+    Пустой запрос — все авто по цене. Листается по номеру страницы: ранг
+    считается заново для каждого запроса, а дальше первых страниц результаты
+    не смотрят. Возвращает (строки, есть_следующая), строка —
+    (id, brand, model, year, city, price_per_day).
+    """
+    conditions = [Car.available == True]
+    if city_id is not None:
+        conditions.append(Car.city_id == city_id)
+    order = (Car.price_per_day, Car.id)
+    if normalize_query(query):
+        condition, rank = search_condition(db, query)
+        conditions.append(condition)
+        if rank is not None:
+            order = (rank.desc(),) + order
+
+    rows = db.execute(
+        select(Car.id, Car.brand, Car.model, Car.year, Car.city, Car.price_per_day)
+        .where(and_(*conditions))
+        .order_by(*order)
+        .offset(page * limit)
+        .limit(limit + 1)
+    ).all()
+    return rows[:limit], len(rows) > limit
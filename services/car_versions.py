@@ -0,0 +1,49 @@
+﻿from sqlalchemy import event, update
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.util import identity_key
+
+from database import SessionLocal
+from models.booking import Booking
+from models.car import Car
+
+
+def bump_versions(connection, car_ids):
+    """Увеличивает версии авто одним UPDATE; для изменений в обход ORM (bulk update, raw SQL)."""
+    car_ids = sorted({car_id for car_id in car_ids if car_id is not None})
+    if car_ids:
+        connection.execute(update(Car.__table__).where(Car.id.in_(car_ids)).values(version=Car.version + 1))
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _bump_car_versions(session, flush_context, instances):
+    bumped = set()
+
+    def bump(car):
+        # Выражение, а не число: параллельные правки не потеряют инкремент.
+        # Авто, загруженное в сессию, получает версию в своём же UPDATE — без лишнего запроса
+        if car.id not in bumped:
+            car.version = Car.version + 1
+            bumped.add(car.id)
+
+    car_ids = set()
+    for obj in session.dirty:
+        if not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Car):
+            bump(obj)
+        elif isinstance(obj, Booking):
+            # Бронирование могли перенести на другое авто — тогда меняются оба
+            car_ids.add(obj.car_id)
+            car_ids.update(get_history(obj, "car_id").deleted)
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Booking):
+            car_ids.add(obj.car_id)
+
+    rest = []
+    for car_id in car_ids - bumped:
+        car = session.identity_map.get(identity_key(Car, car_id)) if car_id is not None else None
+        if car is not None and car not in session.deleted:
+            bump(car)
+        else:
+            rest.append(car_id)
+    bump_versions(session.connection(), rest)
@@ -0,0 +1,37 @@
+﻿import io
+
+
+def render_weekly_chart(weeks: list, revenue: list, occupancy: list, title: str) -> bytes:
+    """
+    PNG с выручкой (столбцы) и загрузкой (линия) по неделям.
+
+    Выполняется в процессе пула: модуль не тянет за собой БД и бота,
+    matplotlib импортируется только в воркере.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    x = np.arange(len(weeks))
+    fig, ax = plt.subplots(figsize=(8, 4.5), dpi=100)
+    try:
+        ax.bar(x, revenue, color="#4c72b0", label="Выручка, €")
+        ax.set_ylabel("Выручка, €")
+        ax.set_xticks(x)
+        ax.set_xticklabels(weeks, rotation=45, ha="right", fontsize=8)
+
+        ax2 = ax.twinx()
+        ax2.plot(x, np.asarray(occupancy) * 100, color="#dd8452", marker="o", label="Загрузка, %")
+        ax2.set_ylabel("Загрузка, %")
+        ax2.set_ylim(0, 100)
+
+        ax.set_title(title)
+        fig.legend(loc="upper left", bbox_to_anchor=(0.1, 0.9), fontsize=8)
+        fig.tight_layout()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
@@ -0,0 +1,157 @@
+﻿import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, func, case, and_
+
+from config import CHART_WORKERS, CHART_CACHE_SIZE
+from models.booking import Booking, BookingStatus
+from models.car import Car
+from models.payment import Payment, PaymentStatus
+from services.chart_render import render_weekly_chart
+from services.metrics import metrics
+
+# Статусы бронирований, которые считаются занятостью
+OCCUPIED_STATUSES = (BookingStatus.CONFIRMED, BookingStatus.COMPLETED)
+
+
+def week_starts(weeks: int, today: date = None) -> list:
+    """Понедельники последних ``weeks`` недель, включая текущую."""
+    today = today or date.today()
+    current = today - timedelta(days=today.weekday())
+    return [current - timedelta(weeks=n) for n in range(weeks - 1, -1, -1)]
+
+
+def _day_diff(db):
+    """Разница дат в днях: в Postgres даты вычитаются напрямую, в SQLite — через julianday."""
+    if db.get_bind().dialect.name == "postgresql":
+        return lambda a, b: a - b, func.greatest, func.least
+    return lambda a, b: func.julianday(a) - func.julianday(b), func.max, func.min
+
+
+def data_version(db, owner_id: int) -> tuple:
+    """
+    Отпечаток данных владельца для ключа кэша: три агрегатных запроса
+    (бронирования, платежи, число авто) на каждый запрос графика. Дешевле
+    недельных агрегатов и рендера, но не бесплатен.
+
+    Меняется при новых бронированиях и платежах и при смене их статусов,
+    в том числе сделанной другим процессом (payment_api.py).
+    """
+    owner_cars = select(Car.id).where(Car.owner_id == owner_id).scalar_subquery()
+    bookings = db.execute(
+        select(func.count(Booking.id), func.max(Booking.id),
+               func.sum(case((Booking.status.in_(OCCUPIED_STATUSES), 1), else_=0)))
+        .where(Booking.car_id.in_(owner_cars))
+    ).one()
+    payments = db.execute(
+        select(func.max(Payment.id), func.sum(case((Payment.status == PaymentStatus.COMPLETED, 1), else_=0)))
+        .join(Booking, Booking.id == Payment.booking_id)
+        .where(Booking.car_id.in_(owner_cars))
+    ).one()
+    cars = db.execute(select(func.count(Car.id)).where(Car.owner_id == owner_id)).scalar()
+    return tuple(bookings) + tuple(payments) + (cars,)
+
+
+def weekly_aggregates(db, owner_id: int, weeks: list) -> tuple:
+    """
+    Выручка и загрузка по неделям одним запросом на каждую таблицу.
+
+    Каждая неделя — отдельная колонка ``sum(case ...)``: для выручки суммируются
+    оплаченные платежи недели, для загрузки — дни пересечения бронирований с неделей.
+    """
+    diff, greatest, least = _day_diff(db)
+    bounds = [(start, start + timedelta(days=6)) for start in weeks]
+    period_start, period_end = bounds[0][0], bounds[-1][1]
+
+    revenue_row = db.execute(
+        select(*[
+            func.coalesce(func.sum(case((and_(
+                Payment.created_at >= datetime.combine(start, datetime.min.time()),
+                Payment.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time())
+            ), Payment.amount), else_=0)), 0)
+            for start, end in bounds
+        ])
+        .join(Booking, Booking.id == Payment.booking_id)
+        .join(Car, Car.id == Booking.car_id)
+        .where(Car.owner_id == owner_id, Payment.status == PaymentStatus.COMPLETED,
+               Payment.created_at >= datetime.combine(period_start, datetime.min.time()))
+    ).one()
+
+    booked_row = db.execute(
+        select(*[
+            func.coalesce(func.sum(case((and_(Booking.date_from <= end, Booking.date_to >= start),
+                                         diff(least(Booking.date_to, end), greatest(Booking.date_from, start)) + 1),
+                                        else_=0)), 0)
+            for start, end in bounds
+        ])
+        .join(Car, Car.id == Booking.car_id)
+        .where(Car.owner_id == owner_id, Booking.status.in_(OCCUPIED_STATUSES),
+               Booking.date_from <= period_end, Booking.date_to >= period_start)
+    ).one()
+
+    cars = db.execute(select(func.count(Car.id)).where(Car.owner_id == owner_id)).scalar() or 0
+    revenue = [float(v) for v in revenue_row]
+    occupancy = [min(float(v) / (cars * 7), 1.0) if cars else 0.0 for v in booked_row]
+    return revenue, occupancy
+
+
+class ChartCache:
+    """
+    Готовые графики по ключу (владелец, период, версия данных).
+
+    Хранит PNG и file_id, который Telegram вернул после первой отправки:
+    повторный запрос с тем же ключом не рендерит и не загружает картинку заново.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, png: bytes):
+        # Старые версии графиков того же владельца и периода больше не нужны
+        for stale in [k for k in self._entries if k[:2] == key[:2] and k != key]:
+            del self._entries[stale]
+        self._entries[key] = {"png": png, "file_id": None}
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set_file_id(self, key, file_id: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry["png"] = None
+            entry["file_id"] = file_id
+
+
+class ChartRenderer:
+    """Пул процессов для matplotlib: рендер не держит GIL и event loop бота."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            # spawn: не копируем в воркеры потоки и соединения процесса бота. Воркер заново
+            # импортирует главный модуль (bot.py) — побочные эффекты там только в main()
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def render(self, *args) -> bytes:
+        started = time.perf_counter()
+        png = await asyncio.get_running_loop().run_in_executor(self._executor(), render_weekly_chart, *args)
+        metrics.observe("chart_render_seconds", time.perf_counter() - started)
+        return png
+
+
+chart_cache = ChartCache(CHART_CACHE_SIZE)
+chart_renderer = ChartRenderer(CHART_WORKERS)
@@ -0,0 +1,95 @@
+﻿import re
+
+from sqlalchemy import func
+from loguru import logger
+
+from models.car import Car
+from models.city import City
+from models.constants import POPULAR_CITIES
+
+
+def normalize_city(name: str) -> str:
+    """Ключ города для сравнения: «Novi Sad», « novi-sad » и «NOVI  SAD» совпадают."""
+    s = (name or "").strip().casefold().replace("ё", "е")
+    s = re.sub(r"[\s\-_.,]+", " ", s)
+    return s.strip()
+
+
+class CityDirectory:
+    """
+    Справочник городов со счётчиками доступных авто.
+
+    Счётчики строятся одним GROUP BY при старте и дальше поддерживаются
+    инкрементально хендлерами, меняющими авто. Клавиатура городов собирается
+    заново только после изменения счётчиков.
+    """
+
+    def __init__(self):
+        self._names: dict[int, str] = {}
+        self._ids: dict[str, int] = {}
+        self._counts: dict[int, int] = {}
+        self._keyboard = None
+
+    def load(self, db):
+        for name in POPULAR_CITIES:
+            self.resolve(db, name)
+
+        # Авто, добавленные до появления справочника, привязываем по названию
+        for car in db.query(Car).filter(Car.city_id == None).all():
+            car.city_id = self.resolve(db, car.city).id
+        db.commit()
+
+        for city in db.query(City).all():
+            self._remember(city)
+        self._counts = dict(
+            db.query(Car.city_id, func.count(Car.id))
+            .filter(Car.available == True, Car.city_id != None)
+            .group_by(Car.city_id)
+            .all()
+        )
+        self._keyboard = None
+        logger.info(f"City directory loaded: {len(self._names)} cities")
+
+    def _remember(self, city: City):
+        self._names[city.id] = city.name
+        self._ids[city.normalized_name] = city.id
+
+    def resolve(self, db, name: str) -> City:
+        """Находит город по нормализованному названию или создаёт новый."""
+        key = normalize_city(name)
+        city = db.query(City).filter(City.normalized_name == key).first()
+        if not city:
+            city = City(name=name.strip(), normalized_name=key)
+            db.add(city)
+            db.flush()
+        self._remember(city)
+        return city
+
+    def name(self, city_id: int) -> str:
+        return self._names.get(city_id, "")
+
+    def count(self, city_id: int) -> int:
+        return self._counts.get(city_id, 0)
+
+    def has_cars(self) -> bool:
+        return any(self._counts.values())
+
+    def change(self, city_id: int, delta: int):
+        if city_id is None or not delta:
+            return
+        self._counts[city_id] = max(self._counts.get(city_id, 0) + delta, 0)
+        self._keyboard = None
+
+    def keyboard(self):
+        if self._keyboard is None:
+            from keyboards.inline import city_counts_kb
+            cities = sorted(
+                ((city_id, name, self.count(city_id)) for city_id, name in self._names.items()
+                 if self.count(city_id) > 0),
+                key=lambda c: (-c[2], c[1])
+            )
+            self._keyboard = city_counts_kb(cities)
+        return self._keyboard
+
+
+city_directory = CityDirectory()
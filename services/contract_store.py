@@ -0,0 +1,135 @@
+﻿import gzip
+import hashlib
+import hmac
+import os
+import tempfile
+from pathlib import Path
+
+from loguru import logger
+
+from config import (
+    CONTRACT_STORE, CONTRACT_STORE_DIR, CONTRACT_S3_BUCKET, CONTRACT_S3_ENDPOINT,
+    PUBLIC_API_URL, CONTRACT_LINK_SECRET
+)
+from services.metrics import metrics
+
+SUFFIX = ".html.gz"
+
+
+def content_key(data: bytes) -> str:
+    """Адрес договора — SHA-256 содержимого: одинаковые договоры хранятся один раз."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _compress(data: bytes) -> bytes:
+    # mtime=0 — одинаковое содержимое даёт побайтно одинаковый архив
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+class FilesystemContractStore:
+    """
+    Договоры в локальном каталоге: ``<root>/<2 символа хэша>/<хэш>.html.gz``.
+
+    Файл записывается во временный и переименовывается, поэтому читатели
+    никогда не видят недописанный договор.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}{SUFFIX}"
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def put(self, data: bytes) -> str:
+        key = content_key(data)
+        path = self.path(key)
+        if path.exists():
+            metrics.inc("contract_store_dedup")
+            return key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(_compress(data))
+        os.replace(tmp, path)
+        metrics.inc("contract_store_put")
+        return key
+
+    def get(self, key: str) -> bytes:
+        return gzip.decompress(self.path(key).read_bytes())
+
+
+class S3ContractStore:
+    """
+    Договоры в S3-совместимом бакете (AWS S3, MinIO).
+
+    Объект хранится сжатым с ``Content-Encoding: gzip``; скачивание идёт по
+    подписанной ссылке прямо из бакета, диапазоны (Range) отдаёт сам S3.
+    """
+
+    def __init__(self, bucket: str, endpoint_url: str = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("Хранилище S3 недоступно: не установлен boto3")
+        self.bucket = bucket
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    def object_key(self, key: str) -> str:
+        return f"contracts/{key[:2]}/{key}{SUFFIX}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, data: bytes) -> str:
+        key = content_key(data)
+        if self.exists(key):
+            metrics.inc("contract_store_dedup")
+            return key
+        self.client.put_object(
+            Bucket=self.bucket, Key=self.object_key(key), Body=_compress(data),
+            ContentType="text/html; charset=utf-8", ContentEncoding="gzip"
+        )
+        metrics.inc("contract_store_put")
+        return key
+
+    def get(self, key: str) -> bytes:
+        body = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"].read()
+        return gzip.decompress(body)
+
+    def presigned_url(self, key: str, expires_in: int) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.object_key(key)}, ExpiresIn=expires_in
+        )
+
+
+def create_store():
+    if CONTRACT_STORE == "s3":
+        logger.info(f"Contract store: S3 bucket {CONTRACT_S3_BUCKET} ({CONTRACT_S3_ENDPOINT or 'AWS'})")
+        return S3ContractStore(CONTRACT_S3_BUCKET, CONTRACT_S3_ENDPOINT)
+    return FilesystemContractStore(CONTRACT_STORE_DIR)
+
+
+def link_signature(key: str, expires: int) -> str:
+    message = f"{key}:{expires}".encode()
+    return hmac.new(CONTRACT_LINK_SECRET.encode(), message, hashlib.sha256).hexdigest()
+
+
+def contract_link(key: str, expires: int) -> str:
+    """Подписанная ссылка на скачивание через публичное API или пустая строка, если оно не настроено."""
+    if not PUBLIC_API_URL:
+        return ""
+    return f"{PUBLIC_API_URL.rstrip('/')}/contracts/{key}?expires={expires}&sig={link_signature(key, expires)}"
+
+
+contract_store = create_store()
@@ -0,0 +1,158 @@
+﻿import csv
+import io
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import insert
+from loguru import logger
+
+from database import SessionLocal
+from models.car import Car
+from services.car_fields import parse_year, parse_price, parse_discount
+from services.cities import city_directory, normalize_city
+
+BATCH_SIZE = 1000
+
+# Допустимые заголовки колонок -> поле Car
+COLUMNS = {
+    "brand": "brand", "марка": "brand",
+    "model": "model", "модель": "model",
+    "year": "year", "год": "year",
+    "license_plate": "license_plate", "номер": "license_plate",
+    "vin": "vin",
+    "price_per_day": "price_per_day", "price": "price_per_day", "цена": "price_per_day",
+    "discount": "discount", "скидка": "discount",
+    "rental_terms": "rental_terms", "условия": "rental_terms",
+    "city": "city", "город": "city",
+}
+REQUIRED = ("brand", "model", "year", "price_per_day", "city")
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []
+        self.city_counts = Counter()
+
+    def errors_csv(self) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["row", "error"])
+        writer.writerows(self.errors)
+        return buf.getvalue().encode("utf-8-sig")
+
+
+def _iter_csv(path: Path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(f, dialect)
+
+
+def _iter_xlsx(path: Path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Импорт XLSX недоступен: не установлен openpyxl")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(path: Path):
+    """Строки файла по одной, без загрузки всего файла в память."""
+    if path.suffix.lower() == ".xlsx":
+        return _iter_xlsx(path)
+    return _iter_csv(path)
+
+
+def parse_row(values: dict) -> dict:
+    """Проверяет строку по тем же правилам, что и AddCarFSM; бросает ValueError."""
+    for field in REQUIRED:
+        if not values.get(field):
+            raise ValueError(f"не заполнено поле {field}")
+    return {
+        "brand": values["brand"],
+        "model": values["model"],
+        "year": parse_year(values["year"]),
+        "license_plate": values.get("license_plate") or None,
+        "vin": values.get("vin") or None,
+        "price_per_day": parse_price(values["price_per_day"]),
+        "discount": parse_discount(values.get("discount") or 0),
+        "rental_terms": values.get("rental_terms") or None,
+        "city": values["city"],
+    }
+
+
+def import_fleet(path, owner_id: int) -> ImportReport:
+    """
+    Импортирует автопарк из CSV/XLSX пачками по ``BATCH_SIZE`` строк.
+
+    Выполняется в потоке-воркере: синхронно читает файл и пишет в БД.
+    Счётчики городов не трогает — их применяет вызывающий код в event loop.
+    """
+    path = Path(path)
+    report = ImportReport()
+    rows = iter_rows(path)
+
+    header = next(rows, None)
+    if not header:
+        report.errors.append((1, "пустой файл"))
+        return report
+    fields = [COLUMNS.get(str(name).strip().lower()) for name in header]
+    missing = [f for f in REQUIRED if f not in fields]
+    if missing:
+        report.errors.append((1, f"нет колонок: {', '.join(missing)}"))
+        return report
+
+    db = SessionLocal()
+    cities = {}
+    batch = []
+    batch_cities = Counter()
+    try:
+        def flush():
+            if batch:
+                db.execute(insert(Car), batch)
+                db.commit()
+                report.imported += len(batch)
+                report.city_counts.update(batch_cities)
+                batch.clear()
+                batch_cities.clear()
+
+        for row_number, raw in enumerate(rows, start=2):
+            if not any(str(v).strip() for v in raw):
+                continue
+            values = {f: str(v).strip() for f, v in zip(fields, raw) if f}
+            try:
+                car = parse_row(values)
+            except ValueError as e:
+                report.errors.append((row_number, str(e)))
+                continue
+
+            key = normalize_city(car["city"])
+            if key not in cities:
+                city = city_directory.resolve(db, car["city"])
+                cities[key] = (city.id, city.name)
+            car["city_id"], car["city"] = cities[key]
+            car["owner_id"] = owner_id
+            car["available"] = True
+            batch.append(car)
+            batch_cities[car["city_id"]] += 1
+
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        flush()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Fleet import failed: {e}")
+        report.errors.append((0, f"ошибка импорта: {e}"))
+    finally:
+        db.close()
+    return report
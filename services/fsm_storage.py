@@ -0,0 +1,197 @@
+﻿import asyncio
+import copy
+import sys
+import time
+import typing
+from collections import OrderedDict
+
+from aiogram.dispatcher.storage import BaseStorage
+from loguru import logger
+
+from services.metrics import metrics
+
+
+def approx_size(obj, _seen=None) -> int:
+    """Грубая оценка памяти, занятой объектом вместе с вложенными контейнерами."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, _seen) for item in obj)
+    return size
+
+
+def state_group(state) -> str:
+    """Группа состояний: ``BookingFSM:select_car`` -> ``BookingFSM``."""
+    return state.split(":", 1)[0] if state else "-"
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    FSM-хранилище в памяти с ограничением объёма.
+
+    Записи хранятся в порядке последнего обращения: при превышении ``max_bytes``
+    вытесняются самые давние. Записи, к которым не обращались дольше TTL своей
+    группы состояний, удаляет периодический сборщик (``reap_periodically``).
+    """
+
+    def __init__(self, max_bytes: int, state_ttls: dict, default_ttl: int):
+        self.max_bytes = max_bytes
+        self.state_ttls = state_ttls
+        self.default_ttl = default_ttl
+        self.data: OrderedDict = OrderedDict()
+        self.total_bytes = 0
+        self._reported_groups = set()
+
+    async def close(self):
+        self.data.clear()
+        self.total_bytes = 0
+
+    async def wait_closed(self):
+        pass
+
+    def _record(self, chat, user, create: bool = True):
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        record = self.data.get(key)
+        if record is None:
+            if not create:
+                return key, None
+            record = {"state": None, "data": {}, "bucket": {}, "size": 0}
+            self.data[key] = record
+        record["touched"] = time.monotonic()
+        self.data.move_to_end(key)
+        return key, record
+
+    def _resize(self, key, record):
+        if record["state"] is None and not record["data"] and not record["bucket"]:
+            self.total_bytes -= record["size"]
+            del self.data[key]
+            return
+        size = approx_size(record["data"]) + approx_size(record["bucket"]) + approx_size(record["state"])
+        self.total_bytes += size - record["size"]
+        record["size"] = size
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.data) > 1:
+            key, record = self.data.popitem(last=False)
+            self.total_bytes -= record["size"]
+            metrics.inc("fsm_evicted", group=state_group(record["state"]))
+            logger.debug(f"FSM session {key} evicted (state={record['state']})")
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        _, record = self._record(chat, user, create=False)
+        if record is None or record["state"] is None:
+            return self.resolve_state(default)
+        return record["state"]
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[str] = None) -> typing.Dict:
+        _, record = self._record(chat, user, create=False)
+        return copy.deepcopy(record["data"]) if record else {}
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        key, record = self._record(chat, user)
+        record["data"].update(data or {}, **kwargs)
+        self._resize(key, record)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key, record = self._record(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._resize(key, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key, record = self._record(chat, user)
+        record["data"] = copy.deepcopy(data or {})
+        self._resize(key, record)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        key, record = self._record(chat, user)
+        record["state"] = None
+        if with_data:
+            record["data"] = {}
+        self._resize(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = self._record(chat, user, create=False)
+        return copy.deepcopy(record["bucket"]) if record else {}
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key, record = self._record(chat, user)
+        record["bucket"] = copy.deepcopy(bucket or {})
+        self._resize(key, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        key, record = self._record(chat, user)
+        record["bucket"].update(bucket or {}, **kwargs)
+        self._resize(key, record)
+
+    def reap(self) -> int:
+        """Удаляет записи с истёкшим TTL, возвращает их количество."""
+        now = time.monotonic()
+        expired = [
+            key for key, record in self.data.items()
+            if now - record["touched"] > self.state_ttls.get(state_group(record["state"]), self.default_ttl)
+        ]
+        for key in expired:
+            record = self.data.pop(key)
+            self.total_bytes -= record["size"]
+            metrics.inc("fsm_expired", group=state_group(record["state"]))
+        return len(expired)
+
+    def stats(self) -> dict:
+        """Число живых сессий и их объём по группам состояний."""
+        result = {}
+        for record in self.data.values():
+            group = result.setdefault(state_group(record["state"]), {"sessions": 0, "bytes": 0})
+            group["sessions"] += 1
+            group["bytes"] += record["size"]
+        return result
+
+    async def reap_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            expired = self.reap()
+            if expired:
+                logger.info(f"FSM reaper removed {expired} abandoned sessions")
+            stats = self.stats()
+            for group in self._reported_groups | stats.keys():
+                group_stats = stats.get(group, {"sessions": 0, "bytes": 0})
+                metrics.set("fsm_sessions", group_stats["sessions"], group=group)
+                metrics.set("fsm_bytes", group_stats["bytes"], group=group)
+            self._reported_groups |= stats.keys()
+            metrics.set("fsm_total_bytes", self.total_bytes)
@@ -0,0 +1,66 @@
+﻿import csv
+import gzip
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from database import read_session
+from models.booking import Booking
+from models.car import Car
+from models.payment import Payment
+from models.user import User
+
+# Сколько строк забирать с сервера за раз (серверный курсор на Postgres)
+YIELD_PER = 1000
+
+HEADER = [
+    "booking_id", "created_at", "car_id", "brand", "model", "license_plate", "city",
+    "renter", "renter_phone", "date_from", "date_to", "booking_status", "total_price",
+    "payment_id", "payment_method", "payment_status", "payment_amount", "transaction_id", "payment_created_at",
+]
+
+
+def _value(v):
+    if v is None:
+        return ""
+    return getattr(v, "value", v)
+
+
+def owner_history_query(owner_id: int):
+    """Бронирования авто владельца с арендатором и всеми платежами, по одной строке на платёж."""
+    renter = aliased(User)
+    return (
+        select(
+            Booking.id, Booking.created_at, Car.id, Car.brand, Car.model, Car.license_plate, Car.city,
+            renter.name, renter.phone, Booking.date_from, Booking.date_to, Booking.status, Booking.total_price,
+            Payment.id, Payment.method, Payment.status, Payment.amount, Payment.transaction_id, Payment.created_at,
+        )
+        .join(Car, Booking.car_id == Car.id)
+        .outerjoin(renter, Booking.renter_id == renter.id)
+        .outerjoin(Payment, Payment.booking_id == Booking.id)
+        .where(Car.owner_id == owner_id)
+        .order_by(Booking.id, Payment.id)
+    )
+
+
+def export_owner_history(owner_id: int, path: str, telegram_id: int = None) -> int:
+    """
+    Пишет историю бронирований и платежей владельца в gzip-CSV ``path``.
+
+    Строки читаются пачками по ``YIELD_PER`` и сразу пишутся в файл, поэтому
+    память не растёт с объёмом истории. Возвращает число строк без заголовка.
+    Выполняется в потоке-воркере.
+    """
+    db = read_session(telegram_id)
+    rows = 0
+    try:
+        result = db.execute(owner_history_query(owner_id).execution_options(yield_per=YIELD_PER))
+        with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            for row in result:
+                writer.writerow([_value(v) for v in row])
+                rows += 1
+    finally:
+        db.close()
+    return rows
@@ -0,0 +1,121 @@
+﻿import hashlib
+import hmac
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from config import PUBLIC_API_URL, ICAL_FEED_SECRET, ICAL_PAST_DAYS, ICAL_CACHE_SIZE
+from models.booking import BookingStatus
+from services.metrics import metrics
+
+# В календаре владельца — всё, кроме отменённых бронирований
+FEED_STATUSES = (BookingStatus.PENDING, BookingStatus.CONFIRMED, BookingStatus.COMPLETED)
+PRODID = "-//MyRentCar//Bookings//RU"
+
+
+def feed_token(kind: str, object_id: int) -> str:
+    """
+    Секрет в ссылке на ленту: календари (Google, Apple) не умеют слать заголовки.
+
+    Срока действия нет — подписка живёт годами; отозвать все ссылки можно сменой ICAL_FEED_SECRET.
+    """
+    message = f"ical:{kind}:{object_id}".encode()
+    return hmac.new(ICAL_FEED_SECRET.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def feed_url(kind: str, object_id: int) -> str:
+    """Ссылка на ленту ``kind`` ("cars" или "owners") или пустая строка без PUBLIC_API_URL."""
+    if not PUBLIC_API_URL:
+        return ""
+    return f"{PUBLIC_API_URL.rstrip('/')}/ical/{kind}/{object_id}.ics?token={feed_token(kind, object_id)}"
+
+
+def feed_since() -> date:
+    """Начало ленты: прошедшие брони старше ICAL_PAST_DAYS в календарь не попадают."""
+    return date.today() - timedelta(days=ICAL_PAST_DAYS)
+
+
+def escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def fold(line: str) -> bytes:
+    """Строка iCalendar: не длиннее 75 октетов, продолжения начинаются с пробела (RFC 5545, 3.1)."""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return data + b"\r\n"
+    parts, chunk = [], b""
+    for char in line:
+        encoded = char.encode("utf-8")
+        if len(chunk) + len(encoded) > (75 if not parts else 74):
+            parts.append(chunk)
+            chunk = b""
+        chunk += encoded
+    parts.append(chunk)
+    return b"\r\n ".join(parts) + b"\r\n"
+
+
+def calendar_header(name: str) -> bytes:
+    return b"".join(fold(line) for line in (
+        "BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN", "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{escape(name)}",
+    ))
+
+
+CALENDAR_FOOTER = fold("END:VCALENDAR")
+
+
+def render_events(car_name: str, bookings) -> bytes:
+    """
+    VEVENT'ы бронирований одного авто.
+
+    ``bookings`` — строки (id, date_from, date_to, status, created_at). Данные
+    арендатора в ленту не попадают: её могут видеть все, с кем владелец делится календарём.
+    """
+    lines = []
+    for booking in bookings:
+        stamp = f"{booking.created_at:%Y%m%dT%H%M%SZ}" if booking.created_at else "19700101T000000Z"
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:booking-{booking.id}@myrentcar",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{booking.date_from:%Y%m%d}",
+            # DTEND для событий на весь день не включается в интервал
+            f"DTEND;VALUE=DATE:{booking.date_to + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{escape(f'🚗 {car_name} — бронь #{booking.id}')}",
+            "STATUS:TENTATIVE" if booking.status == BookingStatus.PENDING else "STATUS:CONFIRMED",
+            "TRANSP:OPAQUE",
+            "END:VEVENT",
+        ]
+    return b"".join(fold(line) for line in lines)
+
+
+class CarEventsCache:
+    """
+    Готовые VEVENT'ы по авто, помеченные версией авто (cars.version).
+
+    Версия растёт при любом изменении бронирований авто, поэтому блок
+    пересобирается только для тех авто, у которых она сменилась; лента
+    владельца склеивается из готовых блоков. Размер ограничен LRU.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._events: OrderedDict = OrderedDict()
+
+    def get(self, car_id: int, stamp: tuple):
+        entry = self._events.get(car_id)
+        if entry is None or entry[0] != stamp:
+            metrics.inc("ical_cache", result="miss")
+            return None
+        self._events.move_to_end(car_id)
+        metrics.inc("ical_cache", result="hit")
+        return entry[1]
+
+    def put(self, car_id: int, stamp: tuple, events: bytes):
+        self._events[car_id] = (stamp, events)
+        self._events.move_to_end(car_id)
+        while len(self._events) > self.max_size:
+            self._events.popitem(last=False)
+
+
+car_events_cache = CarEventsCache(ICAL_CACHE_SIZE)
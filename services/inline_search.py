@@ -0,0 +1,180 @@
+﻿import heapq
+import re
+import time
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+
+from loguru import logger
+from sqlalchemy import select
+
+from config import INLINE_CACHE_TTL, INLINE_CACHE_SIZE
+from database import SessionLocal
+from models.car import Car
+from services.metrics import metrics
+
+# Больше результатов по одному запросу пользователь всё равно не пролистает
+MAX_RESULTS = 200
+# Порог похожести слов по триграммам, как similarity_threshold в pg_trgm
+FUZZY_THRESHOLD = 0.3
+
+IndexedCar = namedtuple("IndexedCar", "id brand model year price_per_day discount city photo_file_id")
+CAR_COLUMNS = (Car.id, Car.brand, Car.model, Car.year, Car.price_per_day, Car.discount, Car.city,
+               Car.photo_file_id)
+
+
+def normalize_terms(text: str) -> list:
+    """Слова запроса: «Novi-Sad  BMW» -> ['novi', 'sad', 'bmw']."""
+    return re.findall(r"\w+", (text or "").casefold().replace("ё", "е"))
+
+
+def trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InlineCarIndex:
+    """
+    Индекс доступных авто в памяти для inline-поиска (``@bot novi sad bmw``).
+
+    Слова марки, модели, города и год авто лежат в отсортированном списке:
+    каждое слово запроса ищется как префикс бинарным поиском, а если префикс
+    ничего не нашёл — по похожести триграмм (опечатки). Результаты по
+    нормализованному запросу кэшируются на ``cache_ttl`` секунд; любое
+    изменение индекса сбрасывает кэш. Индекс строится при старте (``load``)
+    и дальше обновляется хендлерами, меняющими авто.
+    """
+
+    def __init__(self, cache_ttl: float, cache_size: int):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cars: dict[int, IndexedCar] = {}
+        self._car_words: dict[int, tuple] = {}
+        self._words: dict[str, set] = {}
+        self._trigrams: dict[str, set] = {}
+        self._sorted_words = None
+        self._results: OrderedDict = OrderedDict()
+
+    def load(self, db):
+        for store in (self._cars, self._car_words, self._words, self._trigrams):
+            store.clear()
+        rows = db.execute(select(*CAR_COLUMNS).where(Car.available == True)).all()
+        self.add_rows(rows)
+        logger.info(f"Inline car index loaded: {len(self._cars)} cars, {len(self._words)} words")
+
+    def add_rows(self, rows):
+        for row in rows:
+            self._add(IndexedCar(*row))
+        self._changed()
+
+    def upsert(self, car: Car):
+        """Добавляет или обновляет авто после изменения в БД; недоступные убирает."""
+        if car.available:
+            self._add(IndexedCar(*(getattr(car, column.key) for column in CAR_COLUMNS)))
+        else:
+            self._remove(car.id)
+        self._changed()
+
+    def remove(self, car_id: int):
+        self._remove(car_id)
+        self._changed()
+
+    def _add(self, car: IndexedCar):
+        self._remove(car.id)
+        words = tuple(set(normalize_terms(f"{car.brand} {car.model} {car.city} {car.year}")))
+        self._cars[car.id] = car
+        self._car_words[car.id] = words
+        for word in words:
+            ids = self._words.get(word)
+            if ids is None:
+                ids = self._words[word] = set()
+                for trigram in trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+            ids.add(car.id)
+
+    def _remove(self, car_id: int):
+        self._cars.pop(car_id, None)
+        for word in self._car_words.pop(car_id, ()):
+            ids = self._words[word]
+            ids.discard(car_id)
+            if not ids:
+                del self._words[word]
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].discard(word)
+
+    def _changed(self):
+        self._sorted_words = None
+        self._results.clear()
+
+    def _prefix_ids(self, term: str) -> set:
+        if self._sorted_words is None:
+            self._sorted_words = sorted(self._words)
+        words = self._sorted_words
+        ids = set()
+        i = bisect_left(words, term)
+        while i < len(words) and words[i].startswith(term):
+            ids |= self._words[words[i]]
+            i += 1
+        return ids
+
+    def _fuzzy_ids(self, term: str) -> set:
+        term_trigrams = trigrams(term)
+        shared = {}
+        for trigram in term_trigrams:
+            for word in self._trigrams.get(trigram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        ids = set()
+        for word, common in shared.items():
+            if common / (len(term_trigrams) + len(trigrams(word)) - common) >= FUZZY_THRESHOLD:
+                ids |= self._words[word]
+        return ids
+
+    def _search(self, terms: list) -> tuple:
+        if not terms:
+            ids = self._cars.keys()
+        else:
+            ids = None
+            # Сначала самые длинные слова: у них меньше совпадений
+            for term in sorted(terms, key=len, reverse=True):
+                found = self._prefix_ids(term)
+                if not found and len(term) >= 3:
+                    found = self._fuzzy_ids(term)
+                ids = found if ids is None else ids & found
+                if not ids:
+                    return ()
+        cars = heapq.nsmallest(MAX_RESULTS, (self._cars[car_id] for car_id in ids),
+                               key=lambda c: (c.price_per_day, c.id))
+        return tuple(car.id for car in cars)
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> tuple:
+        """Страница ``(авто, следующий offset или None)``, авто отсортированы по цене."""
+        terms = normalize_terms(query)
+        key = " ".join(sorted(terms))
+        now = time.monotonic()
+        cached = self._results.get(key)
+        if cached and cached[0] > now:
+            self._results.move_to_end(key)
+            ids = cached[1]
+            metrics.inc("inline_search_cache", result="hit")
+        else:
+            ids = self._search(terms)
+            self._results[key] = (now + self.cache_ttl, ids)
+            self._results.move_to_end(key)
+            if len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+            metrics.inc("inline_search_cache", result="miss")
+
+        page = [self._cars[car_id] for car_id in ids[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(ids) else None
+        return page, next_offset
+
+
+def owner_car_rows(owner_id: int) -> list:
+    """Строки индекса по авто владельца — после импорта автопарка; выполняется в потоке."""
+    db = SessionLocal()
+    try:
+        return db.execute(select(*CAR_COLUMNS).where(Car.owner_id == owner_id, Car.available == True)).all()
+    finally:
+        db.close()
+
+
+inline_index = InlineCarIndex(INLINE_CACHE_TTL, INLINE_CACHE_SIZE)
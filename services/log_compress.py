@@ -0,0 +1,15 @@
+﻿"""Сжатие ротированного лога: ``python -m services.log_compress <путь>``."""
+import gzip
+import os
+import shutil
+import sys
+
+
+def compress(path: str):
+    with open(path, "rb") as src, gzip.open(f"{path}.gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    compress(sys.argv[1])
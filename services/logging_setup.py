@@ -0,0 +1,102 @@
+﻿import json
+import random
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+
+from loguru import logger
+
+from middlewares.context import current_handler_info, current_update_info
+from services.metrics import metrics
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# Уровни, которые пишутся всегда, без сэмплирования
+ALWAYS_LOGGED = 40  # ERROR
+
+
+def add_update_context(record):
+    """Патчер loguru: id апдейта, хендлер и время с начала обработки апдейта."""
+    extra = record["extra"]
+    info = current_update_info.get()
+    if info is not None:
+        update_id, started = info
+        extra["update_id"] = update_id
+        extra["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+    extra["handler"] = current_handler_info.get()[0]
+
+
+class LogSampler:
+    """
+    Фильтр sink'а: сэмплирование по уровню и ограничение частоты с одного места.
+
+    ``sample_rates`` — доля сохраняемых записей уровня; ``site_rate`` — сколько
+    записей в секунду пропускать с одной строки кода, остальное отбрасывается
+    до следующей секунды. ERROR и выше проходят всегда.
+    """
+
+    def __init__(self, sample_rates: dict, site_rate: int):
+        self.sample_rates = sample_rates
+        self.site_rate = site_rate
+        self._window = 0
+        self._counts = {}
+
+    def __call__(self, record) -> bool:
+        level = record["level"]
+        if level.no >= ALWAYS_LOGGED:
+            return True
+        rate = self.sample_rates.get(level.name, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            metrics.inc("log_sampled_out", level=level.name, reason="rate")
+            return False
+
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._counts.clear()
+        site = (record["name"], record["line"])
+        count = self._counts.get(site, 0) + 1
+        self._counts[site] = count
+        if count > self.site_rate:
+            metrics.inc("log_sampled_out", level=level.name, reason="site")
+            return False
+        return True
+
+
+def json_format(record) -> str:
+    extra = record["extra"]
+    payload = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        "source": f"{record['name']}:{record['function']}:{record['line']}",
+        "update_id": extra.get("update_id"),
+        "handler": extra.get("handler"),
+        "latency_ms": extra.get("latency_ms"),
+    }
+    if record["exception"] is not None:
+        payload["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    extra["_json"] = json.dumps(payload, ensure_ascii=False, default=str)
+    return "{extra[_json]}\n"
+
+
+def compress_in_background(path: str):
+    """Сжатие ротированного файла отдельным процессом, чтобы не задерживать запись логов."""
+    subprocess.Popen([sys.executable, "-m", "services.log_compress", path], cwd=PROJECT_ROOT,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def setup_logging(path: str, rotation: str, sample_rates: dict, site_rate: int):
+    """
+    Переводит loguru на неблокирующие sink'и.
+
+    ``enqueue=True``: вызов ``logger.*`` в хендлере только кладёт готовую строку
+    в очередь, запись в файл, ротация и вывод в консоль идут в фоновом потоке.
+    """
+    logger.remove()
+    logger.configure(patcher=add_update_context)
+    logger.add(sys.stderr, level="INFO", enqueue=True, filter=LogSampler(sample_rates, site_rate))
+    logger.add(path, level="DEBUG", format=json_format, rotation=rotation, compression=compress_in_background,
+               enqueue=True, filter=LogSampler(sample_rates, site_rate))
@@ -0,0 +1,126 @@
+﻿import asyncio
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from loguru import logger
+
+from config import LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD
+from services.metrics import metrics
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _call_site(stack) -> str:
+    """Самый глубокий кадр из кода проекта (не stdlib и не site-packages)."""
+    for frame in reversed(stack):
+        path = Path(frame.filename).resolve()
+        if PROJECT_ROOT in path.parents and "site-packages" not in path.parts:
+            return f"{path.relative_to(PROJECT_ROOT)}:{frame.lineno} {frame.name}"
+    frame = stack[-1]
+    return f"{frame.filename}:{frame.lineno} {frame.name}"
+
+
+class LoopMonitor:
+    """
+    Сторож event loop.
+
+    Корутина раз в ``interval`` секунд замеряет задержку пробуждения (лаг).
+    Отдельный поток следит за пульсом корутины: если loop не отвечает дольше
+    ``threshold``, он снимает стек потока loop и привязывает его к хендлеру
+    и FSM-состоянию задачи, которая сейчас выполняется.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.25, top_size: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.top_size = top_size
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._pending = None
+        self._running = {}
+        self._sites = {}
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._loop.create_task(self._measure_lag())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(f"Loop monitor started: interval={self.interval}s, threshold={self.threshold}s")
+
+    # Хендлер начал/закончил обработку апдейта в текущей задаче
+    def enter(self, handler: str, state):
+        self._running[asyncio.current_task()] = (handler, state or "-")
+
+    def leave(self):
+        self._running.pop(asyncio.current_task(), None)
+
+    async def _measure_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            self._heartbeat = now
+
+            metrics.set("event_loop_lag_seconds", lag)
+            metrics.observe("event_loop_lag", lag)
+
+            pending, self._pending = self._pending, None
+            if pending:
+                self._record(pending, lag)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.threshold or self._pending:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            handler, state = self._running.get(task, ("-", "-"))
+            self._pending = {
+                "handler": handler,
+                "state": state,
+                "stack": traceback.extract_stack(frame),
+            }
+
+    def _record(self, sample: dict, duration: float):
+        site = _call_site(sample["stack"])
+        handler, state = sample["handler"], sample["state"]
+
+        logger.warning(
+            f"Event loop blocked for {duration:.3f}s in {handler} (state={state}) at {site}\n"
+            + "".join(traceback.format_list(sample["stack"][-10:]))
+        )
+        # Место вызова (файл:строка) в метки не идёт — иначе число рядов растёт без предела;
+        # оно есть в логе и в ограниченном top_size рейтинге worst()
+        metrics.inc("event_loop_blocked", handler=handler, state=state)
+        metrics.observe("event_loop_blocked_seconds", duration, handler=handler, state=state)
+
+        key = (handler, state, site)
+        stats = self._sites.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += duration
+        stats["max"] = max(stats["max"], duration)
+        if len(self._sites) > self.top_size * 2:
+            for old in sorted(self._sites, key=lambda k: self._sites[k]["total"])[:len(self._sites) - self.top_size]:
+                del self._sites[old]
+
+    def worst(self, limit: int = 10) -> list:
+        """Места блокировок, отсортированные по суммарному времени."""
+        rows = [
+            {"handler": h, "state": s, "site": site, **stats}
+            for (h, s, site), stats in self._sites.items()
+        ]
+        return sorted(rows, key=lambda r: r["total"], reverse=True)[:limit]
+
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD)
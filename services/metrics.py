@@ -0,0 +1,61 @@
+﻿import threading
+from collections import defaultdict
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Metrics:
+    """
+    Простой реестр метрик процесса в текстовом формате Prometheus.
+
+    Счётчики, gauge и сводки (count/sum/max) с произвольными метками.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._summaries = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            summary = self._summaries.setdefault(_key(name, labels), [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}_total{_labels_text(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(f"{name}{_labels_text(labels)} {value}")
+            for (name, labels), (count, total, peak) in sorted(self._summaries.items()):
+                lines.append(f"{name}_count{_labels_text(labels)} {count}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {total}")
+                lines.append(f"{name}_max{_labels_text(labels)} {peak}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,98 @@
+﻿import asyncio
+import contextvars
+from collections import deque
+
+from aiogram import Dispatcher, types
+from loguru import logger
+
+from middlewares.context import update_user
+from services.metrics import metrics
+
+
+def update_chat_id(update: types.Update):
+    """Чат апдейта; для inline-запросов и подобных — ID пользователя."""
+    message = update.message or update.edited_message or (
+        update.callback_query.message if update.callback_query else None
+    )
+    if message:
+        return message.chat.id
+    user = update_user(update)
+    return user.id if user else update.update_id
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """
+    Диспетчер с очередью на каждый чат.
+
+    Апдейты одного чата обрабатываются строго по очереди, разные чаты —
+    параллельно пулом из ``workers`` воркеров. Чат с апдейтами стоит в общей
+    очереди готовых не больше одного раза, так что один чат не занимает
+    больше одного воркера.
+
+    Очередь чата ограничена ``max_chat_backlog`` апдейтами: флуд из одного чата
+    не копится в памяти без предела, лишние апдейты отбрасываются и считаются
+    в метрике ``update_dropped``.
+    """
+
+    def __init__(self, *args, workers: int = 16, max_chat_backlog: int = 20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = workers
+        self.max_chat_backlog = max_chat_backlog
+        self._chat_queues: dict[int, deque] = {}
+        self._ready = None
+        self._worker_tasks = []
+        self._pending = 0
+
+    def _start_workers(self):
+        # Контекст, в котором апдейты обрабатывались бы без воркеров: каждый апдейт
+        # получает свою копию, иначе contextvars aiogram (например, закэшированное
+        # StateFilter состояние FSM) переходят от одного апдейта к следующему
+        self._base_context = contextvars.copy_context()
+        self._ready = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Chat-ordered dispatcher started with {self.workers} workers")
+
+    async def process_updates(self, updates, fast: bool = True):
+        if self._ready is None:
+            self._start_workers()
+
+        for update in updates:
+            chat_id = update_chat_id(update)
+            queue = self._chat_queues.get(chat_id)
+            if queue is None:
+                self._chat_queues[chat_id] = deque([update])
+                self._ready.put_nowait(chat_id)
+            elif len(queue) >= self.max_chat_backlog:
+                # Уже стоящие в очереди апдейты не трогаем, чтобы не ломать порядок чата
+                metrics.inc("update_dropped", reason="chat_backlog")
+                logger.debug(f"Update {update.update_id} dropped: chat {chat_id} backlog is full")
+                continue
+            else:
+                queue.append(update)
+            self._pending += 1
+
+        self._export_metrics()
+        return []
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._chat_queues[chat_id]
+            update = queue.popleft()
+            try:
+                await self._base_context.run(asyncio.create_task, self.updates_handler.notify(update))
+            except Exception:
+                logger.exception(f"Update {update.update_id} failed")
+            finally:
+                self._pending -= 1
+                if queue:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._chat_queues[chat_id]
+                self._export_metrics()
+
+    def _export_metrics(self):
+        metrics.set("update_queue_depth", self._pending)
+        metrics.set("update_queue_chats", len(self._chat_queues))
+        metrics.set("update_queue_max_chat_backlog",
+                    max((len(q) for q in self._chat_queues.values()), default=0))
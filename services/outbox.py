@@ -0,0 +1,211 @@
+﻿import asyncio
+import math
+from datetime import date, datetime, timedelta
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, RetryAfter, UserDeactivated
+from loguru import logger
+from sqlalchemy import or_, update
+
+from database import SessionLocal
+from models.outbox import OutboxEvent
+from services.metrics import metrics
+
+PERMANENT_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated)
+
+
+def add_event(db, event_type: str, telegram_id: int, payload: dict, dedup_key: str) -> OutboxEvent:
+    """
+    Кладёт событие в outbox в рамках текущей транзакции ``db``.
+
+    ``dedup_key`` уникален: повторный callback по тому же платежу не создаст второе уведомление.
+    """
+    event = OutboxEvent(event_type=event_type, telegram_id=telegram_id, payload=payload, dedup_key=dedup_key)
+    db.add(event)
+    return event
+
+
+def render_event(event: OutboxEvent) -> str:
+    payload = event.payload or {}
+    if event.event_type == "payment_completed":
+        return (
+            f"✅ Оплата #{payload.get('payment_id')} на сумму {payload.get('amount', 0):.2f} EUR получена.\n"
+            f"Бронирование #{payload.get('booking_id')} подтверждено."
+        )
+    if event.event_type == "waitlist_match":
+        date_from, date_to = date.fromisoformat(payload["date_from"]), date.fromisoformat(payload["date_to"])
+        return (
+            f"🔔 Появилось авто на ваши даты!\n"
+            f"🚗 {payload['car']}, {payload['city']}\n"
+            f"📅 С {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y}\n"
+            f"💶 {payload['price']:g} € в сутки"
+        )
+    return payload.get("text", "")
+
+
+def render_markup(event: OutboxEvent):
+    payload = event.payload or {}
+    if event.event_type == "waitlist_match":
+        date_from = payload["date_from"].replace("-", "")
+        date_to = payload["date_to"].replace("-", "")
+        return InlineKeyboardMarkup().add(InlineKeyboardButton(
+            "📅 Забронировать", callback_data=f"wl:book:{payload['car_id']}:{date_from}:{date_to}"
+        ))
+    return None
+
+
+class OutboxRelay:
+    """
+    Доставляет события outbox пользователям через бота.
+
+    Доставка «хотя бы один раз»: событие отмечается доставленным только после
+    успешной отправки, поэтому после падения процесса оно может уйти повторно.
+
+    Пачка берётся короткой транзакцией: строки выбираются с SKIP LOCKED и
+    получают аренду ``locked_until``, после чего транзакция сразу фиксируется.
+    Отправка идёт без открытой транзакции и соединения, а результат пишется
+    второй короткой транзакцией в новой сессии. Если экземпляр упал, не
+    дописав результат, события снова берутся после истечения аренды.
+
+    Сообщения уходят не чаще ``rate`` в секунду. Неудачная отправка
+    откладывает событие (``next_attempt_at``) с экспоненциальной задержкой,
+    а ``RetryAfter`` от Telegram ставит на паузу всю отправку на указанное
+    время и попыткой не считается.
+    """
+
+    def __init__(self, batch_size: int, interval: float, max_attempts: int, lease_seconds: float = 60,
+                 rate: float = 25, retry_base: float = 5, retry_max: float = 3600):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.lease = timedelta(seconds=lease_seconds)
+        self.rate = rate
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # Моменты (loop.time()) следующей разрешённой отправки и конца паузы по RetryAfter
+        self._next_send = 0.0
+        self._paused_until = 0.0
+
+    def _claim(self) -> list:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            events = db.query(OutboxEvent).filter(
+                OutboxEvent.delivered_at == None,
+                OutboxEvent.attempts < self.max_attempts,
+                or_(OutboxEvent.locked_until == None, OutboxEvent.locked_until < now),
+                or_(OutboxEvent.next_attempt_at == None, OutboxEvent.next_attempt_at <= now)
+            ).order_by(OutboxEvent.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+            for event in events:
+                event.locked_until = now + self.lease
+            db.flush()
+            # Отсоединённые объекты сохраняют загруженные поля и после commit
+            db.expunge_all()
+            db.commit()
+            return events
+        finally:
+            db.close()
+
+    def retry_delay(self, attempts: int) -> float:
+        """Задержка перед следующей попыткой после ``attempts`` неудачных."""
+        return min(self.retry_base * 2 ** max(attempts - 1, 0), self.retry_max)
+
+    def _finish(self, delivered: list, failed: list, dropped: list, deferred: list):
+        """``deferred`` — пары (событие, секунды) от RetryAfter: попытка не считается."""
+        if not (delivered or failed or dropped or deferred):
+            return
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            pending = OutboxEvent.delivered_at == None
+            if delivered:
+                db.execute(update(OutboxEvent).where(
+                    OutboxEvent.id.in_([e.id for e in delivered]), pending
+                ).values(delivered_at=now, locked_until=None))
+            for event in failed:
+                attempts = (event.attempts or 0) + 1
+                db.execute(update(OutboxEvent).where(OutboxEvent.id == event.id, pending).values(
+                    attempts=attempts, locked_until=None,
+                    next_attempt_at=now + timedelta(seconds=self.retry_delay(attempts))
+                ))
+            for event, seconds in deferred:
+                db.execute(update(OutboxEvent).where(OutboxEvent.id == event.id, pending).values(
+                    locked_until=None, next_attempt_at=now + timedelta(seconds=seconds)
+                ))
+            if dropped:
+                db.execute(update(OutboxEvent).where(
+                    OutboxEvent.id.in_([e.id for e in dropped]), pending
+                ).values(attempts=self.max_attempts, locked_until=None))
+            db.commit()
+        finally:
+            db.close()
+
+    async def _wait_turn(self):
+        # Слот занимается без await между чтением и записью, поэтому конкурентные
+        # отправки пачки выстраиваются с шагом 1/rate
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_send, self._paused_until)
+        self._next_send = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, bot, event: OutboxEvent):
+        await self._wait_turn()
+        # Слот мог быть занят до того, как соседняя отправка получила RetryAfter
+        paused = self._paused_until - asyncio.get_running_loop().time()
+        if paused > 0:
+            raise RetryAfter(math.ceil(paused))
+        try:
+            await bot.send_message(event.telegram_id, render_event(event), reply_markup=render_markup(event))
+        except RetryAfter as e:
+            # Остальные отправки пачки ждут вместе с этой
+            self._paused_until = max(self._paused_until, asyncio.get_running_loop().time() + e.timeout)
+            raise
+        latency = (datetime.utcnow() - event.created_at).total_seconds()
+        metrics.observe("outbox_delivery_latency_seconds", latency, event_type=event.event_type)
+
+    async def relay_once(self, bot) -> int:
+        loop = asyncio.get_running_loop()
+        events = await loop.run_in_executor(None, self._claim)
+        if not events:
+            return 0
+
+        results = await asyncio.gather(*(self._send(bot, e) for e in events), return_exceptions=True)
+        delivered, failed, dropped, deferred = [], [], [], []
+        for event, result in zip(events, results):
+            if result is None:
+                delivered.append(event)
+            elif isinstance(result, RetryAfter):
+                deferred.append((event, result.timeout))
+            elif isinstance(result, PERMANENT_ERRORS):
+                logger.warning(f"Outbox event {event.id} dropped: {result}")
+                dropped.append(event)
+            else:
+                logger.error(f"Outbox event {event.id} delivery failed: {result}")
+                failed.append(event)
+        if deferred:
+            logger.warning(f"Outbox flood control: {len(deferred)} events deferred by {deferred[0][1]}s")
+
+        await loop.run_in_executor(None, self._finish, delivered, failed, dropped, deferred)
+        metrics.inc("outbox_delivered", len(delivered))
+        metrics.inc("outbox_failed", len(failed) + len(dropped))
+        metrics.inc("outbox_deferred", len(deferred))
+        return len(events)
+
+    async def run(self, bot):
+        logger.info("Outbox relay started")
+        loop = asyncio.get_running_loop()
+        while True:
+            # Под flood control новые пачки не берём, пока пауза не кончится
+            pause = self._paused_until - loop.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                processed = await self.relay_once(bot)
+            except Exception as e:
+                logger.error(f"Outbox relay error: {e}")
+                processed = 0
+            # Полная пачка — сразу берём следующую, иначе ждём
+            if processed < self.batch_size:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,82 @@
+﻿from datetime import date, timedelta
+
+from sqlalchemy import select, func, case
+
+from models.booking import Booking, BookingStatus
+from models.car import Car
+from models.payment import Payment, PaymentStatus
+from models.review import Review
+from services.availability import booked_days
+
+# Окно «ближайшей загрузки» в днях
+OCCUPANCY_DAYS = 30
+
+
+class CarStats:
+    __slots__ = ("id", "brand", "model", "year", "available", "bookings", "revenue",
+                 "rating", "reviews", "occupancy")
+
+    def __init__(self, row, occupancy: float):
+        (self.id, self.brand, self.model, self.year, self.available,
+         self.bookings, self.revenue, self.rating, self.reviews) = row
+        self.occupancy = occupancy
+
+
+def owner_stats_query(owner_id: int):
+    """
+    Статистика по всем авто владельца одним запросом.
+
+    Каждый агрегат считается в подзапросе, ограниченном авто владельца,
+    и присоединяется к ``cars`` по car_id — без запросов на каждое авто.
+    """
+    bookings = (
+        select(Booking.car_id, func.count(Booking.id).label("bookings"))
+        .join(Car, Car.id == Booking.car_id)
+        .where(Car.owner_id == owner_id, Booking.status != BookingStatus.CANCELLED)
+        .group_by(Booking.car_id)
+        .subquery()
+    )
+    revenue = (
+        select(Booking.car_id, func.sum(Payment.amount).label("revenue"))
+        .join(Payment, Payment.booking_id == Booking.id)
+        .join(Car, Car.id == Booking.car_id)
+        .where(Car.owner_id == owner_id, Payment.status == PaymentStatus.COMPLETED)
+        .group_by(Booking.car_id)
+        .subquery()
+    )
+    ratings = (
+        select(Review.car_id, func.avg(Review.rating).label("rating"), func.count(Review.id).label("reviews"))
+        .join(Car, Car.id == Review.car_id)
+        .where(Car.owner_id == owner_id)
+        .group_by(Review.car_id)
+        .subquery()
+    )
+    return (
+        select(
+            Car.id, Car.brand, Car.model, Car.year, Car.available,
+            func.coalesce(bookings.c.bookings, 0),
+            func.coalesce(revenue.c.revenue, 0.0),
+            ratings.c.rating,
+            func.coalesce(ratings.c.reviews, 0),
+        )
+        .outerjoin(bookings, bookings.c.car_id == Car.id)
+        .outerjoin(revenue, revenue.c.car_id == Car.id)
+        .outerjoin(ratings, ratings.c.car_id == Car.id)
+        .where(Car.owner_id == owner_id)
+        .order_by(case((Car.available == True, 0), else_=1), Car.brand, Car.model, Car.id)
+    )
+
+
+def owner_car_stats(db, owner_id: int) -> list:
+    """
+    Статистика авто владельца: число бронирований, оплаченная выручка,
+    средний рейтинг и загрузка на ``OCCUPANCY_DAYS`` дней вперёд.
+
+    Один SQL-запрос; загрузка берётся из битовых карт ``booked_days``.
+    """
+    today = date.today()
+    horizon = today + timedelta(days=OCCUPANCY_DAYS - 1)
+    return [
+        CarStats(row, booked_days.booked_count(row[0], today, horizon) / OCCUPANCY_DAYS)
+        for row in db.execute(owner_stats_query(owner_id)).all()
+    ]
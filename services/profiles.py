@@ -0,0 +1,53 @@
+﻿import json
+import time
+from pathlib import Path
+
+from loguru import logger
+
+
+class ProfileStore:
+    """
+    Каталог с профилями медленных апдейтов.
+
+    Каждый профиль — файл pstats (``.prof``) и рядом ``.json`` с метаданными.
+    Общий размер ограничен ``max_bytes``: старые профили удаляются первыми.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def save(self, profiler, meta: dict) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{int(time.time() * 1000)}_{meta['handler'].rsplit('.', 1)[-1]}"
+        profiler.dump_stats(self.directory / f"{name}.prof")
+        with open(self.directory / f"{name}.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._trim()
+        return name
+
+    def _trim(self):
+        files = sorted(self.directory.glob("*.prof"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        while files and total > self.max_bytes:
+            oldest = files.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
+            oldest.with_suffix(".json").unlink(missing_ok=True)
+            logger.debug(f"Profile {oldest.stem} removed by retention")
+
+    def list(self) -> list:
+        result = []
+        for meta_path in sorted(self.directory.glob("*.json"), reverse=True):
+            prof_path = meta_path.with_suffix(".prof")
+            if not prof_path.exists():
+                continue
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            result.append({"name": meta_path.stem, "size": prof_path.stat().st_size, **meta})
+        return result
+
+    def path(self, name: str):
+        """Путь к файлу профиля или None, если имени нет в каталоге."""
+        candidate = self.directory / f"{Path(name).name}.prof"
+        return candidate if candidate.exists() else None
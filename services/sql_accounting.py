@@ -0,0 +1,80 @@
+﻿import asyncio
+import contextvars
+import re
+from collections import Counter
+from contextvars import ContextVar
+
+from aiogram.dispatcher.handler import current_handler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import SQL_BUDGET_MODE, SQL_DEFAULT_BUDGET
+
+# Статистика запросов апдейта, который обрабатывается в текущей задаче
+current_query_stats: ContextVar = ContextVar("current_query_stats", default=None)
+
+_PLACEHOLDERS = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)\s*,?)+\)")
+_NUMBERS = re.compile(r"\b\d+\b")
+_SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+        self.budget = None
+
+    def repeated(self, threshold: int) -> dict:
+        """Одинаковые по форме запросы, выполненные не меньше ``threshold`` раз (похоже на N+1)."""
+        return {shape: n for shape, n in self.shapes.items() if n >= threshold}
+
+
+def statement_shape(statement: str) -> str:
+    shape = _PLACEHOLDERS.sub("(?)", statement)
+    shape = _NUMBERS.sub("?", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+def query_budget(limit: int):
+    """Объявляет, сколько SQL-запросов хендлер может выполнить за один апдейт."""
+    def decorator(handler):
+        handler.query_budget = limit
+        return handler
+    return decorator
+
+
+def handler_budget(handler) -> int:
+    return getattr(handler, "query_budget", SQL_DEFAULT_BUDGET)
+
+
+def run_counted(func, *args, executor=None):
+    """
+    ``run_in_executor``, запросы которого идут в статистику текущего апдейта.
+
+    Сам ``run_in_executor`` контекст не копирует, и запросы из потока (импорт,
+    выгрузка) не попали бы в бюджет хендлера. Фоновую работу, которая
+    переживает апдейт (``schedule_match``), запускать обычным ``run_in_executor``.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    stats = current_query_stats.get()
+    if stats is None:
+        return
+    stats.count += 1
+    stats.shapes[statement_shape(statement)] += 1
+
+    if SQL_BUDGET_MODE == "raise":
+        handler = current_handler.get(None)
+        budget = handler_budget(handler)
+        if handler is not None and stats.count > budget:
+            raise QueryBudgetExceeded(
+                f"{handler.__module__}.{handler.__qualname__} exceeded its budget of {budget} SQL queries"
+            )
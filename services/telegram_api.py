@@ -0,0 +1,49 @@
+﻿from collections import OrderedDict
+from contextvars import ContextVar
+
+from aiogram import Bot
+from loguru import logger
+
+from middlewares.context import current_handler_info
+from services.metrics import metrics
+
+# Вызовы Bot API, сделанные при обработке текущего апдейта, по методам
+current_api_calls: ContextVar = ContextVar("current_api_calls", default=None)
+
+# Сколько последних ответов на callback помнить для отсева повторных
+ANSWERED_CALLBACKS_LIMIT = 10000
+
+
+class TrackedBot(Bot):
+    """
+    Bot, который считает вызовы Telegram API по хендлерам и методам.
+
+    Повторный ``answerCallbackQuery`` на уже отвеченный callback (его заранее
+    отвечает ``CallbackAckMiddleware``) в Telegram не уходит: он всё равно
+    завершился бы ошибкой «query is too old».
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._answered = OrderedDict()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        handler = current_handler_info.get()[0]
+        if method == "answerCallbackQuery":
+            query_id = (data or {}).get("callback_query_id")
+            if query_id in self._answered:
+                metrics.inc("telegram_api_skipped", method=method, handler=handler)
+                if (data or {}).get("text") or (data or {}).get("show_alert"):
+                    # Хендлер без @answers_callback: пользователь этот текст не увидит
+                    metrics.inc("callback_answer_lost", handler=handler)
+                    logger.warning(f"Callback {query_id} already answered, {handler} lost text: {data.get('text')}")
+                return True
+            self._answered[query_id] = True
+            if len(self._answered) > ANSWERED_CALLBACKS_LIMIT:
+                self._answered.popitem(last=False)
+
+        metrics.inc("telegram_api_calls", method=method, handler=handler)
+        calls = current_api_calls.get()
+        if calls is not None:
+            calls[method] += 1
+        return await super().request(method, data, files, **kwargs)
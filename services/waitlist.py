@@ -0,0 +1,166 @@
+﻿import asyncio
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+from loguru import logger
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal
+from models.car import Car
+from models.outbox import OutboxEvent
+from models.waitlist import WaitlistSubscription
+from services.availability import booked_days
+from services.metrics import metrics
+
+# Активных подписок на одного пользователя
+MAX_SUBSCRIPTIONS = 10
+# Сколько уведомлений записывать в outbox одной транзакцией
+NOTIFY_BATCH_SIZE = 1000
+
+CAR_COLUMNS = (Car.id, Car.brand, Car.model, Car.year, Car.city_id, Car.city, Car.price_per_day)
+
+
+def subscribe(db, telegram_id: int, city_id: int, date_from: date, date_to: date,
+              max_price: float = None) -> WaitlistSubscription:
+    """Создаёт подписку; бросает ValueError, если у пользователя их уже слишком много."""
+    active = db.query(func.count(WaitlistSubscription.id)).filter(
+        WaitlistSubscription.telegram_id == telegram_id,
+        WaitlistSubscription.notified_at == None,
+        WaitlistSubscription.date_to >= date.today()
+    ).scalar()
+    if active >= MAX_SUBSCRIPTIONS:
+        raise ValueError(f"не больше {MAX_SUBSCRIPTIONS} активных подписок")
+    subscription = WaitlistSubscription(telegram_id=telegram_id, city_id=city_id, date_from=date_from,
+                                        date_to=date_to, max_price=max_price)
+    db.add(subscription)
+    db.commit()
+    return subscription
+
+
+def candidates_query(city_id: int, min_price: float, freed_from: date = None, freed_to: date = None):
+    """
+    Подписки города, которые может закрыть авто не дороже ``min_price``.
+
+    Диапазон по (city_id, date_from) идёт по частичному индексу активных
+    подписок. ``freed_from``/``freed_to`` сужают подбор до подписок,
+    пересекающихся с освободившимися датами — для будущей отмены бронирований
+    (сейчас авто после бронирования не возвращается в каталог).
+    """
+    sub = WaitlistSubscription
+    conditions = [
+        sub.city_id == city_id,
+        sub.notified_at == None,
+        sub.date_from >= date.today(),
+        sub.date_from <= (freed_to or booked_days.last_day),
+        or_(sub.max_price == None, sub.max_price >= min_price),
+    ]
+    if freed_from:
+        conditions.append(sub.date_to >= freed_from)
+    return (select(sub.id, sub.telegram_id, sub.date_from, sub.date_to, sub.max_price)
+            .where(*conditions).order_by(sub.id))
+
+
+def _event(subscription, car) -> dict:
+    return {
+        "event_type": "waitlist_match",
+        "telegram_id": subscription.telegram_id,
+        "payload": {
+            "car_id": car.id, "car": f"{car.brand} {car.model} ({car.year})", "city": car.city,
+            "price": car.price_per_day, "date_from": subscription.date_from.isoformat(),
+            "date_to": subscription.date_to.isoformat(),
+        },
+        "dedup_key": f"waitlist:{subscription.id}",
+        "created_at": datetime.utcnow(),
+        "attempts": 0,
+    }
+
+
+# INSERT ... ON CONFLICT DO NOTHING по диалектам, которые использует бот
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _flush(db, events: list, subscription_ids: list) -> int:
+    """
+    Пишет пачку уведомлений и отмечает подписки уведомлёнными.
+
+    Событие с уже существующим ``dedup_key`` (ту же подписку параллельно закрыл
+    другой подбор) пропускается, остальные события пачки записываются.
+    """
+    if not events:
+        return 0
+    stmt = (UPSERT_INSERTS[db.get_bind().dialect.name](OutboxEvent)
+            .on_conflict_do_nothing(index_elements=[OutboxEvent.dedup_key])
+            .returning(OutboxEvent.dedup_key))
+    inserted = set(db.execute(stmt, events).scalars())
+    skipped = len(events) - len(inserted)
+    if skipped:
+        logger.warning(f"Waitlist: {skipped} notifications skipped as duplicates")
+    notified_ids = [sid for sid, event in zip(subscription_ids, events) if event["dedup_key"] in inserted]
+    if notified_ids:
+        db.execute(update(WaitlistSubscription)
+                   .where(WaitlistSubscription.id.in_(notified_ids))
+                   .values(notified_at=datetime.utcnow()))
+    db.commit()
+    events.clear()
+    subscription_ids.clear()
+    return len(notified_ids)
+
+
+def match_cars(db, cars: list, freed_from: date = None, freed_to: date = None) -> int:
+    """
+    Ставит в outbox уведомления по подпискам, которые теперь можно выполнить.
+
+    ``cars`` — строки ``CAR_COLUMNS`` доступных авто. Для каждого города один
+    запрос к индексу; подписке достаётся самое дешёвое подходящее авто,
+    свободное на все её даты. Подписка уведомляется один раз.
+    """
+    by_city = defaultdict(list)
+    for car in cars:
+        by_city[car.city_id].append(car)
+
+    notified = 0
+    for city_id, city_cars in by_city.items():
+        city_cars.sort(key=lambda c: (c.price_per_day, c.id))
+        events, subscription_ids = [], []
+        for subscription in db.execute(candidates_query(city_id, city_cars[0].price_per_day, freed_from, freed_to)):
+            for car in city_cars:
+                if subscription.max_price is not None and car.price_per_day > subscription.max_price:
+                    break
+                if booked_days.is_free(car.id, subscription.date_from, subscription.date_to):
+                    events.append(_event(subscription, car))
+                    subscription_ids.append(subscription.id)
+                    break
+            if len(events) >= NOTIFY_BATCH_SIZE:
+                notified += _flush(db, events, subscription_ids)
+        notified += _flush(db, events, subscription_ids)
+    return notified
+
+
+def match_available(car_ids: list = None, owner_id: int = None, freed_from: date = None, freed_to: date = None) -> int:
+    """Подбор для авто по ID или всех авто владельца (после импорта); выполняется в потоке."""
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        query = select(*CAR_COLUMNS).where(Car.available == True, Car.city_id != None)
+        query = query.where(Car.owner_id == owner_id) if owner_id is not None else query.where(Car.id.in_(car_ids))
+        notified = match_cars(db, db.execute(query).all(), freed_from, freed_to)
+    finally:
+        db.close()
+    metrics.observe("waitlist_match_seconds", time.perf_counter() - started)
+    if notified:
+        metrics.inc("waitlist_notified", notified)
+        logger.info(f"Waitlist: {notified} subscribers notified")
+    return notified
+
+
+def _log_failure(future):
+    if future.exception():
+        logger.error(f"Waitlist matching failed: {future.exception()}")
+
+
+def schedule_match(**kwargs):
+    """Запускает подбор в фоне: ответ пользователю, изменившему авто, не ждёт рассылки."""
+    future = asyncio.get_running_loop().run_in_executor(None, lambda: match_available(**kwargs))
+    future.add_done_callback(_log_failure)
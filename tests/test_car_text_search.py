@@ -0,0 +1,30 @@
+﻿from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from services.car_text_search import search_condition
+
+
+def postgres_db():
+    dialect = SimpleNamespace(name="postgresql")
+    return SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=dialect))
+
+
+def compile_pg(clause) -> str:
+    return str(clause.compile(dialect=postgresql.dialect()))
+
+
+def test_postgres_search_matches_query_against_words_of_name():
+    condition, rank = search_condition(postgres_db(), "bmv")
+    sql = compile_pg(condition)
+    # Запрос слева от <%: похожесть на слово названия, а не на всю строку «марка модель город».
+    # psycopg2 экранирует % удвоением, в БД уходит "<%"
+    assert "%(param_1)s <%% lower(cars.brand || ' ' || cars.model || ' ' || cars.city)" in sql
+    assert " %% " not in sql
+    assert "word_similarity(%(param_1)s, lower(" in compile_pg(rank)
+
+
+def test_query_is_normalized_before_matching():
+    condition, _ = search_condition(postgres_db(), "  Škoda,  Ёлка ")
+    params = condition.compile(dialect=postgresql.dialect()).params
+    assert "škoda елка" in params.values()
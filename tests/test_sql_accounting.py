@@ -0,0 +1,26 @@
+﻿import asyncio
+
+from sqlalchemy import create_engine, text
+
+from services.sql_accounting import QueryStats, current_query_stats, run_counted
+
+
+def select_twice(engine):
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        conn.execute(text("SELECT 2"))
+
+
+def test_run_counted_counts_queries_from_executor_thread():
+    engine = create_engine("sqlite://")
+
+    async def update():
+        stats = QueryStats()
+        current_query_stats.set(stats)
+        await run_counted(select_twice, engine)
+        counted = stats.count
+        # Обычный run_in_executor контекст не копирует — такие запросы не считаются
+        await asyncio.get_running_loop().run_in_executor(None, select_twice, engine)
+        return counted, stats.count
+
+    assert asyncio.run(update()) == (2, 2)